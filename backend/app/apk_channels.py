@@ -0,0 +1,220 @@
+"""
+APK versies en release channels.
+
+Een channel (stable/beta/dev) wijst naar een versie in de blob store. De
+pointers staan in config.json onder `channels`, zodat alle workers een
+wijziging via de config store direct zien en de provisioning payload zonder
+database query opgebouwd kan worden. Het stable channel wordt daarnaast
+gespiegeld naar `apk_filename` / `file_hash` zoals voorheen.
+
+De garbage collector telt per versie hoeveel channels ernaar wijzen
+(`refcount`). Een versie met refcount 0 wordt pas na APK_GC_GRACE_SECONDS
+verwijderd, zodat lopende en hervatte downloads van een vorige versie
+blijven werken. Delta's van of naar een verwijderde versie gaan mee.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from .apk_delta import DELTA_DIR, parse_delta_name
+from .apk_store import BLOB_DIR, blob_path, is_file_hash
+from .config_store import get_config_store
+from .db import SessionLocal
+from .models import ApkDelta, ApkVersion
+from .provisioning import get_provisioning_cache
+from .settings import APK_DIR, APK_GC_GRACE_SECONDS
+
+STABLE = "stable"
+CHANNELS = (STABLE, "beta", "dev")
+
+# Welk channel hoort bij welke Headwind policy
+CHANNEL_FOR_CONFIG = {
+    "dev_ontwikkel": "dev",
+    "kiosk_dev": "beta",
+}
+
+_gc_lock = threading.Lock()
+
+
+def channel_for_config(config_key: str) -> str:
+    return CHANNEL_FOR_CONFIG.get(config_key, STABLE)
+
+
+def channel_pointers(config: dict) -> Dict[str, str]:
+    """channel -> file_hash volgens de config"""
+    pointers = {
+        name: entry["file_hash"]
+        for name, entry in (config.get("channels") or {}).items()
+        if entry and entry.get("file_hash")
+    }
+    if config.get("file_hash"):
+        pointers[STABLE] = config["file_hash"]
+    return pointers
+
+
+def register_version(db: Session, file_hash: str, filename: str, size: int) -> ApkVersion:
+    """Leg een (mogelijk al bestaande) versie vast"""
+    version = db.get(ApkVersion, file_hash)
+    if version is None:
+        version = ApkVersion(
+            file_hash=file_hash,
+            filename=filename,
+            size=size,
+            unreferenced_at=datetime.utcnow(),
+        )
+        db.add(version)
+        db.commit()
+        db.refresh(version)
+    return version
+
+
+def set_channel(db: Session, channel: str, version: Optional[ApkVersion]) -> dict:
+    """Laat een channel naar een versie wijzen (None = channel leegmaken)"""
+    if channel not in CHANNELS:
+        raise ValueError(f"Onbekend channel: {channel}")
+
+    store = get_config_store()
+    with store.edit() as config:
+        channels = config.setdefault("channels", {})
+        if version is None:
+            channels.pop(channel, None)
+        else:
+            channels[channel] = {
+                "file_hash": version.file_hash,
+                "filename": version.filename,
+                "checksum": version.cert_checksum,
+            }
+        if channel == STABLE:
+            config["apk_filename"] = version.filename if version else None
+            config["file_hash"] = version.file_hash if version else None
+            if version is not None and version.cert_checksum:
+                config["checksum"] = version.cert_checksum
+        pointers = channel_pointers(config)
+    get_provisioning_cache().invalidate()
+    update_refcounts(db, pointers)
+    return pointers
+
+
+def set_version_checksum(db: Session, file_hash: str, checksum: str):
+    """Cert checksum van een versie bewaren en in de channels bijwerken"""
+    version = db.get(ApkVersion, file_hash)
+    if version is not None:
+        version.cert_checksum = checksum
+        db.commit()
+
+    store = get_config_store()
+    _, current = store.snapshot()
+    if file_hash not in channel_pointers(current).values():
+        return
+    with store.edit() as config:
+        for entry in (config.get("channels") or {}).values():
+            if entry and entry.get("file_hash") == file_hash:
+                entry["checksum"] = checksum
+        if config.get("file_hash") == file_hash:
+            config["checksum"] = checksum
+    get_provisioning_cache().invalidate()
+
+
+def update_refcounts(db: Session, pointers: Dict[str, str], now: Optional[datetime] = None):
+    """Herbereken refcount (en start van de GC grace periode) per versie"""
+    now = now or datetime.utcnow()
+    counts: Dict[str, int] = {}
+    for file_hash in pointers.values():
+        counts[file_hash] = counts.get(file_hash, 0) + 1
+    for version in db.query(ApkVersion).all():
+        refcount = counts.get(version.file_hash, 0)
+        version.refcount = refcount
+        if refcount:
+            version.unreferenced_at = None
+        elif version.unreferenced_at is None:
+            version.unreferenced_at = now
+    db.commit()
+
+
+def list_versions(db: Session) -> List[dict]:
+    pointers = channel_pointers(get_config_store().snapshot()[1])
+    versions = db.query(ApkVersion).order_by(ApkVersion.uploaded_at.desc()).all()
+    return [
+        {
+            "file_hash": v.file_hash,
+            "filename": v.filename,
+            "size": v.size,
+            "cert_checksum": v.cert_checksum,
+            "uploaded_at": v.uploaded_at.isoformat() if v.uploaded_at else None,
+            "channels": sorted(c for c, h in pointers.items() if h == v.file_hash),
+            "refcount": v.refcount,
+            "unreferenced_at": v.unreferenced_at.isoformat() if v.unreferenced_at else None,
+        }
+        for v in versions
+    ]
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def collect_garbage(grace: float = APK_GC_GRACE_SECONDS) -> dict:
+    """
+    Verwijder versies waar al `grace` seconden geen channel naar wijst (met
+    hun delta's), plus blobs zonder versie (bv. na een crash) en
+    achtergebleven uploads.
+    """
+    with _gc_lock:
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            pointers = channel_pointers(get_config_store().snapshot()[1])
+            update_refcounts(db, pointers, now)
+
+            cutoff = now - timedelta(seconds=grace)
+            removed = []
+            known = set(pointers.values())
+            for version in db.query(ApkVersion).all():
+                if version.refcount == 0 and version.unreferenced_at and version.unreferenced_at <= cutoff:
+                    _remove(blob_path(version.file_hash))
+                    db.delete(version)
+                    removed.append(version.file_hash)
+                else:
+                    known.add(version.file_hash)
+            if removed:
+                db.query(ApkDelta).filter(
+                    ApkDelta.from_hash.in_(removed) | ApkDelta.to_hash.in_(removed)
+                ).delete(synchronize_session=False)
+            db.commit()
+
+            orphans = 0
+            min_mtime = time.time() - grace
+            if os.path.isdir(BLOB_DIR):
+                for root, _, files in os.walk(BLOB_DIR):
+                    for name in files:
+                        file_hash = name[:-4] if name.endswith(".apk") else ""
+                        path = os.path.join(root, name)
+                        if is_file_hash(file_hash) and file_hash in known:
+                            continue
+                        if os.path.getmtime(path) < min_mtime and _remove(path):
+                            orphans += 1
+            if os.path.isdir(DELTA_DIR):
+                for root, _, files in os.walk(DELTA_DIR):
+                    for name in files:
+                        pair = parse_delta_name(name)
+                        if pair and pair[0] in known and pair[1] in known:
+                            continue
+                        path = os.path.join(root, name)
+                        if (pair or os.path.getmtime(path) < min_mtime) and _remove(path):
+                            orphans += 1
+            for name in os.listdir(APK_DIR):
+                path = os.path.join(APK_DIR, name)
+                if name.startswith(".upload-") and os.path.getmtime(path) < min_mtime and _remove(path):
+                    orphans += 1
+
+            return {"removed_versions": removed, "removed_files": orphans, "kept_versions": len(known)}
+        finally:
+            db.close()
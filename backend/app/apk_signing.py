@@ -0,0 +1,144 @@
+"""
+Signing certificate checksum van een APK bepalen.
+
+Eerst via `apksigner` (als die geïnstalleerd is), anders via een pure-Python
+parser van het APK Signing Block (v3 / v2 scheme). De checksum is de
+SHA-256 van het signing certificaat (DER), Base64 gecodeerd.
+Alleen v1 (JAR) gesigneerde APK's worden door de fallback niet herkend.
+"""
+import base64
+import hashlib
+import os
+import shutil
+import struct
+import subprocess
+from typing import Optional
+
+APK_SIG_BLOCK_MAGIC = b"APK Sig Block 42"
+APK_SIGNATURE_SCHEME_V2_ID = 0x7109871A
+APK_SIGNATURE_SCHEME_V3_ID = 0xF05368C0
+EOCD_MAGIC = b"PK\x05\x06"
+EOCD_MIN_SIZE = 22
+MAX_SIG_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+class ApkSigningError(Exception):
+    """APK Signing Block ontbreekt of is ongeldig"""
+
+
+def _length_prefixed(buf: bytes, pos: int):
+    if pos + 4 > len(buf):
+        raise ApkSigningError("Onverwacht einde van signing data")
+    (n,) = struct.unpack_from("<I", buf, pos)
+    end = pos + 4 + n
+    if end > len(buf):
+        raise ApkSigningError("Ongeldige lengte in signing data")
+    return buf[pos + 4:end], end
+
+
+def _central_directory_offset(f, file_size: int) -> int:
+    tail_size = min(file_size, 0xFFFF + EOCD_MIN_SIZE)
+    f.seek(file_size - tail_size)
+    tail = f.read(tail_size)
+    idx = tail.rfind(EOCD_MAGIC)
+    if idx < 0 or idx + EOCD_MIN_SIZE > len(tail):
+        raise ApkSigningError("Geen ZIP End of Central Directory gevonden")
+    (cd_offset,) = struct.unpack_from("<I", tail, idx + 16)
+    return cd_offset
+
+
+def read_signing_block(path: str) -> dict:
+    """Lees de ID-value paren uit het APK Signing Block"""
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        cd_offset = _central_directory_offset(f, file_size)
+        if cd_offset < 32:
+            raise ApkSigningError("Geen APK Signing Block")
+
+        f.seek(cd_offset - 24)
+        footer = f.read(24)
+        if footer[8:] != APK_SIG_BLOCK_MAGIC:
+            raise ApkSigningError("Geen APK Signing Block")
+        (block_size,) = struct.unpack_from("<Q", footer, 0)
+        if block_size < 24 or block_size > MAX_SIG_BLOCK_SIZE or block_size + 8 > cd_offset:
+            raise ApkSigningError("Ongeldige APK Signing Block grootte")
+
+        f.seek(cd_offset - block_size - 8)
+        block = f.read(block_size + 8)
+
+    (header_size,) = struct.unpack_from("<Q", block, 0)
+    if header_size != block_size:
+        raise ApkSigningError("APK Signing Block header en footer verschillen")
+
+    pairs = block[8:-24]
+    result = {}
+    pos = 0
+    while pos + 12 <= len(pairs):
+        (pair_len,) = struct.unpack_from("<Q", pairs, pos)
+        if pair_len < 4 or pos + 8 + pair_len > len(pairs):
+            raise ApkSigningError("Ongeldig ID-value paar in APK Signing Block")
+        (pair_id,) = struct.unpack_from("<I", pairs, pos + 8)
+        result[pair_id] = pairs[pos + 12:pos + 8 + pair_len]
+        pos += 8 + pair_len
+    return result
+
+
+def _first_certificate(scheme_block: bytes) -> bytes:
+    # v2 en v3: signers -> signer -> signed data -> (digests, certificates, ...)
+    signers, _ = _length_prefixed(scheme_block, 0)
+    signer, _ = _length_prefixed(signers, 0)
+    signed_data, _ = _length_prefixed(signer, 0)
+    _, pos = _length_prefixed(signed_data, 0)
+    certificates, _ = _length_prefixed(signed_data, pos)
+    certificate, _ = _length_prefixed(certificates, 0)
+    if not certificate:
+        raise ApkSigningError("Leeg signing certificaat")
+    return certificate
+
+
+def signing_certificate(path: str) -> bytes:
+    """Geef het (eerste) signing certificaat (DER) uit het v3 of v2 block"""
+    block = read_signing_block(path)
+    for scheme_id in (APK_SIGNATURE_SCHEME_V3_ID, APK_SIGNATURE_SCHEME_V2_ID):
+        if scheme_id in block:
+            return _first_certificate(block[scheme_id])
+    raise ApkSigningError("Geen v2/v3 signature in APK Signing Block")
+
+
+def _checksum_via_apksigner(path: str) -> Optional[str]:
+    result = subprocess.run(
+        ["apksigner", "verify", "--print-certs", path],
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    if result.returncode != 0:
+        return None
+    # Zoek SHA-256 digest in output
+    for line in result.stdout.split("\n"):
+        if "SHA-256 digest" in line:
+            hex_hash = line.split(":")[-1].strip()
+            # Converteer hex naar bytes en dan naar base64
+            return base64.b64encode(bytes.fromhex(hex_hash)).decode()
+    return None
+
+
+def extract_cert_checksum(path: str) -> Optional[str]:
+    """
+    Bepaal de signing certificate checksum (Base64 SHA-256) van een APK.
+    Returns None als er geen v2/v3 handtekening gevonden kan worden.
+    """
+    if shutil.which("apksigner"):
+        try:
+            checksum = _checksum_via_apksigner(path)
+            if checksum:
+                return checksum
+        except Exception as e:
+            print(f"apksigner fout, gebruik fallback parser: {e}")
+
+    try:
+        certificate = signing_certificate(path)
+    except ApkSigningError as e:
+        print(f"Geen signing certificaat gevonden in {path}: {e}")
+        return None
+    return base64.b64encode(hashlib.sha256(certificate).digest()).decode()
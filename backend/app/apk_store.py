@@ -0,0 +1,227 @@
+"""
+Content-addressed opslag van APK bestanden.
+
+Elke APK staat als `APK_DIR/blobs/<2 tekens>/<sha256>.apk`. Een blob wordt
+nooit overschreven of aangepast: dezelfde inhoud opnieuw uploaden levert
+dezelfde blob op (deduplicatie), een nieuwe versie een nieuwe blob. Zo kan
+een download van een oude versie gewoon doorlopen terwijl een channel al
+naar een nieuwe versie wijst.
+
+Uploads worden in chunks naar een tijdelijk bestand in APK_DIR gestreamd,
+terwijl de SHA-256 incrementeel wordt bijgewerkt. Pas als het hele bestand
+binnen is wordt het atomisch onder zijn hash op zijn plek gezet. Schrijven
+gebeurt in de threadpool zodat de event loop vrij blijft. De multipart body
+van een upload wordt direct vanaf de socket geparsed (MultipartFile), niet
+eerst door Starlette naar een temp bestand gespoold: de limiet en de hash
+gelden voor de bytes terwijl ze binnenkomen. Dezelfde route
+wordt gebruikt voor APK's die een site cache van de upstream portal haalt;
+daar moet de hash gelijk zijn aan de gevraagde.
+"""
+import hashlib
+import os
+import re
+import tempfile
+from typing import AsyncIterator, List, Optional, Tuple
+
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+from .settings import APK_DIR, APK_MAX_BYTES
+
+CHUNK_SIZE = 1024 * 1024
+BLOB_DIR = os.path.join(APK_DIR, "blobs")
+HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ApkTooLarge(Exception):
+    """Upload is groter dan APK_MAX_BYTES"""
+
+
+class ApkHashMismatch(Exception):
+    """De ontvangen bytes hebben niet de verwachte SHA-256"""
+
+
+class UploadError(ValueError):
+    """Ongeldige of afgebroken multipart upload"""
+
+
+def is_file_hash(value: str) -> bool:
+    return bool(value) and HASH_RE.match(value) is not None
+
+
+def blob_relpath(file_hash: str) -> str:
+    """Pad van een blob relatief aan APK_DIR (ook voor X-Accel-Redirect)"""
+    return f"blobs/{file_hash[:2]}/{file_hash}.apk"
+
+
+def blob_path(file_hash: str) -> str:
+    return os.path.join(APK_DIR, blob_relpath(file_hash))
+
+
+def _write_chunk(f, sha, chunk: bytes):
+    sha.update(chunk)
+    f.write(chunk)
+
+
+def _finish(f):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+def _commit_blob(tmp_path: str, file_hash: str) -> Tuple[str, bool]:
+    """Zet een tijdelijk bestand onder zijn hash neer; bestaat die al, dan weggooien"""
+    dest = blob_path(file_hash)
+    if os.path.exists(dest):
+        os.remove(tmp_path)
+        return dest, False
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, dest)
+    return dest, True
+
+
+async def save_stream(
+    chunks: AsyncIterator[bytes],
+    max_bytes: int = APK_MAX_BYTES,
+    expected_hash: Optional[str] = None,
+) -> Tuple[str, str, int, bool]:
+    """
+    Stream bytes naar de blob store.
+
+    Returns:
+        (pad, sha256 hex, grootte in bytes, True als de blob nieuw is)
+    """
+    os.makedirs(APK_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=APK_DIR, prefix=".upload-", suffix=".tmp")
+    f = os.fdopen(fd, "wb")
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise ApkTooLarge(f"APK is groter dan {max_bytes // (1024 * 1024)} MB")
+            await run_in_threadpool(_write_chunk, f, sha, chunk)
+        await run_in_threadpool(_finish, f)
+        file_hash = sha.hexdigest()
+        if expected_hash is not None and file_hash != expected_hash:
+            raise ApkHashMismatch(f"Verwacht {expected_hash}, ontvangen {file_hash}")
+        dest, created = await run_in_threadpool(_commit_blob, tmp_path, file_hash)
+    except BaseException:
+        f.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return dest, file_hash, size, created
+
+
+class MultipartFile:
+    """
+    Streaming parser voor één bestand (form veld `field`) uit een
+    multipart/form-data body. Eerst `await open()` (leest tot de headers
+    van het bestand, geeft de bestandsnaam), daarna `chunks()` voor de
+    inhoud. Andere velden worden overgeslagen.
+    """
+
+    def __init__(self, stream: AsyncIterator[bytes], content_type: str, field: str = "file"):
+        ctype, params = parse_options_header(content_type)
+        if ctype != b"multipart/form-data" or not params.get(b"boundary"):
+            raise UploadError("Verwacht multipart/form-data")
+        self.field = field.encode()
+        self.filename: Optional[str] = None
+        self._stream = stream.__aiter__()
+        self._found = False
+        self._in_file = False
+        self._done = False
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+        self._headers: dict = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._parser = MultipartParser(
+            params[b"boundary"],
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if not self._found and options.get(b"name") == self.field:
+            self._found = self._in_file = True
+            self.filename = options.get(b"filename", b"").decode("utf-8", "replace")
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._pending.append(data[start:end])
+            self._pending_size += end - start
+
+    def _on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self._done = True
+
+    async def _feed(self) -> bool:
+        """Geef het volgende stuk van de body aan de parser; False aan het einde"""
+        try:
+            chunk = await self._stream.__anext__()
+        except StopAsyncIteration:
+            return False
+        try:
+            self._parser.write(chunk)
+        except MultipartParseError as e:
+            raise UploadError(f"Ongeldige multipart body: {e}")
+        return True
+
+    async def open(self) -> str:
+        """Lees tot de headers van het bestand en geef de bestandsnaam"""
+        while not self._found:
+            if not await self._feed():
+                raise UploadError(f"Geen bestand '{self.field.decode()}' in de upload")
+        return self.filename
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """De inhoud van het bestand, in stukken van ongeveer CHUNK_SIZE"""
+        while True:
+            while not self._done and self._pending_size < CHUNK_SIZE:
+                if not await self._feed():
+                    raise UploadError("Upload afgebroken of onvolledig")
+            if self._pending:
+                data = b"".join(self._pending)
+                self._pending.clear()
+                self._pending_size = 0
+                yield data
+            if self._done:
+                return
+
+
+def import_file(path: str) -> Tuple[str, str, int]:
+    """Verplaats een bestaand (legacy) APK bestand naar de blob store"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    size = os.path.getsize(path)
+    dest, _ = _commit_blob(path, sha.hexdigest())
+    return dest, sha.hexdigest(), size
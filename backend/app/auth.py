@@ -1,16 +1,35 @@
+import asyncio
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Dict, Optional, Set, Tuple
 from jose import jwt, JWTError
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
 
-from .db import get_db
+from .db import AsyncSessionLocal
 from .models import User
-from .settings import JWT_SECRET, JWT_EXPIRE_MINUTES
+from .settings import (
+    JWT_SECRET,
+    JWT_EXPIRE_MINUTES,
+    EVENTS_TICKET_TTL_SECONDS,
+    AUTH_CACHE_TTL_SECONDS,
+    AUTH_CACHE_MAX_ENTRIES,
+    BCRYPT_ROUNDS,
+    HASH_WORKERS,
+    HASH_QUEUE_LIMIT,
+)
 
-pwd = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Bij een andere BCRYPT_ROUNDS markeert passlib oude hashes als "needs update"
+pwd = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2 = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
+# Scope van stream tickets; gewone tokens hebben geen scope
+EVENTS_SCOPE = "events"
 
 
 def hash_pw(pw: str) -> str:
@@ -21,6 +40,57 @@ def verify_pw(pw: str, h: str) -> bool:
     return pwd.verify(pw, h)
 
 
+class HashingBusy(HTTPException):
+    """Te veel password hashes in de wachtrij"""
+
+    def __init__(self):
+        super().__init__(
+            status_code=429,
+            detail="Te veel login pogingen tegelijk, probeer het zo opnieuw",
+            headers={"Retry-After": "1"},
+        )
+
+
+class HashExecutor:
+    """
+    Eigen, begrensde thread pool voor bcrypt, los van Starlette's threadpool.
+    Is de wachtrij vol, dan wordt direct met 429 geweigerd in plaats van
+    alle andere endpoints te laten wachten.
+    """
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.workers + self.queue_limit:
+                self.rejected += 1
+                raise HashingBusy()
+            self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+
+hash_executor = HashExecutor(HASH_WORKERS, HASH_QUEUE_LIMIT)
+
+
+async def hash_pw_async(pw: str) -> str:
+    return await hash_executor.run(hash_pw, pw)
+
+
+async def verify_and_update_async(pw: str, h: str) -> Tuple[bool, Optional[str]]:
+    """Verifieer het wachtwoord; geeft ook een nieuwe hash als de cost parameters veranderd zijn"""
+    return await hash_executor.run(pwd.verify_and_update, pw, h)
+
+
 def create_token(user_id: int, role: str) -> str:
     exp = datetime.utcnow() + timedelta(minutes=JWT_EXPIRE_MINUTES)
     return jwt.encode(
@@ -30,16 +100,157 @@ def create_token(user_id: int, role: str) -> str:
     )
 
 
-def get_current_user(
-    db: Session = Depends(get_db), token: str = Depends(oauth2)
-) -> User:
+def create_stream_ticket(user_id: int) -> str:
+    """
+    Kortlevend token dat alleen voor de event stream geldt. EventSource kan
+    geen Authorization header sturen; dit ticket mag in de URL (en dus in
+    access logs) staan, het login token niet.
+    """
+    exp = datetime.utcnow() + timedelta(seconds=EVENTS_TICKET_TTL_SECONDS)
+    return jwt.encode(
+        {"sub": str(user_id), "scope": EVENTS_SCOPE, "exp": exp},
+        JWT_SECRET,
+        algorithm="HS256",
+    )
+
+
+def _decode(token: str, scope: Optional[str] = None) -> Tuple[int, float]:
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
         uid = int(payload.get("sub"))
+        exp = float(payload.get("exp") or 0)
     except (JWTError, TypeError, ValueError):
         raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("scope") != scope:
+        # Een stream ticket is geen login token, en andersom
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return uid, exp
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Geverifieerde gebruiker zonder ORM object (id, email, rol)"""
+    id: int
+    email: str
+    role: str
+
+
+class PrincipalCache:
+    """
+    Begrensde TTL cache van geverifieerde principals, op hash van het token.
+    Een entry leeft nooit langer dan het token zelf. Bij verwijderen of
+    rol-wijziging van een user worden diens entries expliciet ongeldig
+    gemaakt (in deze worker; andere workers volgen binnen de TTL).
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Tuple[Principal, float]]" = OrderedDict()
+        self._by_user: Dict[int, Set[str]] = {}
+
+    def get(self, key: str) -> Optional[Principal]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            principal, expires_at = item
+            if time.time() >= expires_at:
+                self._remove(key)
+                return None
+            self._items.move_to_end(key)
+            return principal
+
+    def put(self, key: str, principal: Principal, token_exp: float):
+        if self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if token_exp:
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            self._remove(key)
+            self._items[key] = (principal, expires_at)
+            self._by_user.setdefault(principal.id, set()).add(key)
+            while len(self._items) > self.max_entries:
+                oldest = next(iter(self._items))
+                self._remove(oldest)
+
+    def _remove(self, key: str):
+        item = self._items.pop(key, None)
+        if item is not None:
+            keys = self._by_user.get(item[0].id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_user[item[0].id]
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._by_user.clear()
+
+
+_principal_cache = PrincipalCache(AUTH_CACHE_TTL_SECONDS, AUTH_CACHE_MAX_ENTRIES)
+
+
+def get_principal_cache() -> PrincipalCache:
+    return _principal_cache
+
+
+def invalidate_user(user_id: int):
+    """Maak gecachte tokens van een user ongeldig (na verwijderen/rol-wijziging)"""
+    _principal_cache.invalidate_user(user_id)
+
+
+async def _load_principal(uid: int) -> Optional[Principal]:
+    async with AsyncSessionLocal() as db:
+        user = await db.get(User, uid)
+        if not user:
+            return None
+        return Principal(id=user.id, email=user.email, role=user.role)
+
+
+async def get_current_principal(token: str = Depends(oauth2)) -> Principal:
+    """
+    De geverifieerde gebruiker van een request: bij een cache hit geen JWT
+    decode en geen DB sessie; alleen bij een miss wordt de user opgezocht.
+    """
+    return await principal_from_token(token)
+
+
+async def get_stream_principal(request: Request, ticket: Optional[str] = None) -> Principal:
+    """
+    Voor EventSource streams: die kunnen geen Authorization header sturen,
+    dus een stream ticket (`create_stream_ticket`) mag als `?ticket=` query
+    parameter. Tickets gaan niet in de principal cache.
+    """
+    auth = request.headers.get("authorization", "")
+    if auth.lower().startswith("bearer "):
+        return await principal_from_token(auth[7:])
+    if not ticket:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    uid, _ = _decode(ticket, EVENTS_SCOPE)
+    principal = await _load_principal(uid)
+    if principal is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return principal
+
+
+async def principal_from_token(token: str) -> Principal:
+    key = hashlib.sha256(token.encode()).hexdigest()
+    principal = _principal_cache.get(key)
+    if principal is not None:
+        return principal
 
-    user = db.query(User).filter(User.id == uid).first()
-    if not user:
+    uid, exp = _decode(token)
+    principal = await _load_principal(uid)
+    if principal is None:
         raise HTTPException(status_code=401, detail="User not found")
-    return user
+    _principal_cache.put(key, principal, exp)
+    return principal
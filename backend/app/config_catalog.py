@@ -0,0 +1,303 @@
+"""
+Catalogus van Headwind configuraties (policies).
+
+Vervangt het lezen van de hardcoded CONFIGURATIONS: de lijst komt uit
+Headwind (`/rest/private/configurations/search`), zodat een nieuwe policy
+zonder redeploy in de portal verschijnt.
+
+- Stale-while-revalidate: lezers krijgen altijd direct de catalogus uit het
+  geheugen, ook als die ouder is dan CONFIG_CATALOG_TTL_SECONDS. Een
+  achtergrond taak ververst hem elke TTL; een lezer van een verlopen
+  catalogus (bijv. na een mislukte refresh) maakt die taak eerder wakker.
+- Fallback: de laatst goede lijst staat in CONFIG_CATALOG_FILE en wordt bij
+  het starten geladen; zonder snapshot (of zonder HEADWIND_BASE_URL) gelden
+  de ingebouwde CONFIGURATIONS.
+- De provisioning payload en de lijst voor het admin dashboard worden per
+  catalogus één keer opgebouwd; `qr_payload()` is een dict lookup.
+
+Keys blijven stabiel: een configuratie houdt de key die hij eerder had (in
+de vorige catalogus of de ingebouwde lijst, op Headwind id), zodat
+`devices.config_key` en CHANNEL_FOR_CONFIG blijven kloppen. Alleen een nieuwe
+configuratie krijgt een key op basis van zijn naam.
+"""
+import asyncio
+import json
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from .config_store import write_json_atomic
+from .headwind_client import CONFIGURATIONS, HeadwindClient, HeadwindError, get_headwind_client
+from .settings import CONFIG_CATALOG_FILE, CONFIG_CATALOG_TTL_SECONDS, HEADWIND_BASE_URL
+
+SEARCH_PATH = "/rest/private/configurations/search"
+DEFAULT_CONFIG_KEY = "vastelijn_alleen"
+# Na een mislukte refresh niet vaker dan dit opnieuw proberen
+RETRY_SECONDS = 30.0
+
+INSTRUCTIONS = [
+    "1. Factory reset het Android apparaat",
+    "2. Tik 6x op het welkomstscherm om QR setup te starten",
+    "3. Verbind met WiFi",
+    "4. Scan de QR code",
+    "5. Volg de installatie instructies",
+    "6. Het apparaat wordt automatisch geconfigureerd",
+]
+
+
+def build_qr_payload(base_url: str, config: dict) -> dict:
+    """QR provisioning payload (enrollment URL en Android Enterprise extras) voor een configuratie"""
+    qr_key = config["qr_key"]
+    enrollment_url = f"{base_url}/#/qr/{qr_key}"
+
+    # Android Enterprise provisioning payload
+    # Ref: https://developers.google.com/android/management/provision-device
+    provisioning_payload = {
+        "android.app.extra.PROVISIONING_DEVICE_ADMIN_COMPONENT_NAME":
+            "com.hmdm.launcher/com.hmdm.launcher.AdminReceiver",
+        "android.app.extra.PROVISIONING_DEVICE_ADMIN_PACKAGE_DOWNLOAD_LOCATION":
+            f"{base_url}/files/hmdm-{config['id']}.apk",
+        "android.app.extra.PROVISIONING_LEAVE_ALL_SYSTEM_APPS_ENABLED": True,
+        "android.app.extra.PROVISIONING_ADMIN_EXTRAS_BUNDLE": {
+            "com.hmdm.DEVICE_ID": "",
+            "com.hmdm.BASE_URL": base_url,
+            "com.hmdm.SERVER_PROJECT": qr_key,
+        }
+    }
+
+    return {
+        "config_id": config["id"],
+        "config_name": config["name"],
+        "config_description": config["description"],
+        "enrollment_url": enrollment_url,
+        "qr_content": enrollment_url,  # Voor simpele QR code
+        "provisioning_payload": provisioning_payload,
+        "instructions": INSTRUCTIONS,
+    }
+
+
+def slugify(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_") or "config"
+
+
+def parse_configurations(data, known: Dict[str, dict]) -> Dict[str, dict]:
+    """
+    Zet een Headwind configurations/search antwoord om naar key -> config.
+
+    Args:
+        known: vorige catalogus; bepaalt (na de ingebouwde lijst) de key
+            van al bekende Headwind ids
+    """
+    items = data.get("data", data) if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValueError("Onverwacht antwoord van configurations/search")
+    key_for_id = {config["id"]: key for key, config in CONFIGURATIONS.items()}
+    key_for_id.update({config["id"]: key for key, config in known.items()})
+    configs: Dict[str, dict] = {}
+    new = []
+    for item in items:
+        if not isinstance(item, dict) or item.get("id") is None or not item.get("qrCodeKey"):
+            continue  # zonder QR key kan een device er niet mee aangemeld worden
+        config = {
+            "id": int(item["id"]),
+            "name": item.get("name") or f"Configuratie {item['id']}",
+            "description": item.get("description") or "",
+            "qr_key": item["qrCodeKey"],
+        }
+        key = key_for_id.get(config["id"])
+        if key is None or key in configs:
+            new.append(config)
+        else:
+            configs[key] = config
+    for config in new:
+        key = slugify(config["name"])
+        if key in configs or key in key_for_id.values():
+            key = f"{key}_{config['id']}"
+        configs[key] = config
+    if not configs:
+        raise ValueError("Headwind gaf geen bruikbare configuraties")
+    return configs
+
+
+@dataclass(frozen=True)
+class Catalog:
+    """Onveranderlijke catalogus; wordt in zijn geheel vervangen, nooit aangepast"""
+
+    configs: Dict[str, dict]
+    payloads: Dict[str, dict]
+    listing: List[dict]
+    source: str  # headwind|snapshot|builtin
+    loaded_at: float
+
+    @classmethod
+    def build(cls, configs: Dict[str, dict], base_url: str, source: str, loaded_at: float) -> "Catalog":
+        return cls(
+            configs=configs,
+            payloads={key: build_qr_payload(base_url, config) for key, config in configs.items()},
+            listing=[
+                {
+                    "key": key,
+                    "id": config["id"],
+                    "name": config["name"],
+                    "description": config["description"],
+                }
+                for key, config in configs.items()
+            ],
+            source=source,
+            loaded_at=loaded_at,
+        )
+
+
+def read_snapshot(path: str) -> Optional[dict]:
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        print(f"Configuratie snapshot {path} onleesbaar: {e}")
+        return None
+    return data if isinstance(data, dict) and data.get("configurations") else None
+
+
+def write_snapshot(path: str, configs: Dict[str, dict], saved_at: float):
+    write_json_atomic(path, {"saved_at": saved_at, "configurations": configs}, prefix=".configurations-")
+
+
+class ConfigCatalog:
+    def __init__(self, client: HeadwindClient, snapshot_path: str, ttl: float, enabled: bool):
+        self.client = client
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self.enabled = enabled
+        self.last_error: Optional[str] = None
+        self.refreshes = 0
+        self._catalog = self._initial()
+        self._attempted_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._refresh_lock: Optional[asyncio.Lock] = None
+
+    def _initial(self) -> Catalog:
+        snapshot = read_snapshot(self.snapshot_path)
+        if snapshot is not None:
+            # Leeftijd 0: pas na de TTL (of de eerste refresh) wordt hij vervangen
+            return Catalog.build(snapshot["configurations"], self.client.base_url, "snapshot", 0.0)
+        return Catalog.build(CONFIGURATIONS, self.client.base_url, "builtin", 0.0)
+
+    # ============ LEZEN ============
+
+    def current(self) -> Catalog:
+        """De catalogus zoals hij nu is; vraagt bij een verlopen catalogus een refresh aan"""
+        catalog = self._catalog
+        if self._loop is not None and self._stale(catalog):
+            now = time.monotonic()
+            if now - self._attempted_at >= RETRY_SECONDS:
+                self._attempted_at = now
+                # Kan ook vanuit de threadpool aangeroepen worden
+                self._loop.call_soon_threadsafe(self._wake.set)
+        return catalog
+
+    def _stale(self, catalog: Catalog) -> bool:
+        return time.monotonic() - catalog.loaded_at >= self.ttl if catalog.source == "headwind" else True
+
+    def __contains__(self, config_key: str) -> bool:
+        return config_key in self.current().configs
+
+    def get(self, config_key: str) -> Optional[dict]:
+        return self.current().configs.get(config_key)
+
+    def qr_payload(self, config_key: str) -> dict:
+        """
+        De vooraf opgebouwde QR provisioning payload van een configuratie.
+        De dict is gedeeld tussen requests en mag NIET aangepast worden.
+        """
+        payload = self.current().payloads.get(config_key)
+        if payload is None:
+            raise ValueError(f"Onbekende configuratie: {config_key}")
+        return payload
+
+    def list_configurations(self) -> List[dict]:
+        """Lijst alle beschikbare configuraties"""
+        return self.current().listing
+
+    # ============ VERVERSEN ============
+
+    async def refresh(self) -> Catalog:
+        """Haal de configuraties nu bij Headwind op; bij een fout blijft de huidige catalogus staan"""
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            self._attempted_at = time.monotonic()
+            previous = self._catalog
+            try:
+                configs = parse_configurations(await self.client.get_json(SEARCH_PATH), previous.configs)
+            except (HeadwindError, httpx.HTTPError, ValueError) as e:
+                self.last_error = str(e)
+                raise HeadwindError(f"Configuraties ophalen mislukt: {e}") from e
+            self._catalog = Catalog.build(configs, self.client.base_url, "headwind", time.monotonic())
+            self.refreshes += 1
+            self.last_error = None
+            if configs != previous.configs:
+                await run_in_threadpool(write_snapshot, self.snapshot_path, configs, time.time())
+                print(f"Configuratie catalogus bijgewerkt: {len(configs)} configuraties")
+            return self._catalog
+
+    def start(self):
+        """Start de achtergrond refresh (vanuit de lifespan)"""
+        if self._task is None and self.enabled and self.ttl > 0:
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._loop = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except HeadwindError as e:
+                print(f"Configuratie catalogus verversen mislukt: {e}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.ttl)
+            except asyncio.TimeoutError:
+                pass
+
+    def status(self) -> dict:
+        catalog = self._catalog
+        return {
+            "enabled": self._task is not None,
+            "source": catalog.source,
+            "configurations": len(catalog.configs),
+            "age_seconds": round(time.monotonic() - catalog.loaded_at, 1) if catalog.source == "headwind" else None,
+            "ttl_seconds": self.ttl,
+            "refreshes": self.refreshes,
+            "last_error": self.last_error,
+        }
+
+
+_catalog: Optional[ConfigCatalog] = None
+
+
+def get_config_catalog() -> ConfigCatalog:
+    """Get de singleton configuratie catalogus"""
+    global _catalog
+    if _catalog is None:
+        _catalog = ConfigCatalog(
+            get_headwind_client(), CONFIG_CATALOG_FILE, CONFIG_CATALOG_TTL_SECONDS, bool(HEADWIND_BASE_URL)
+        )
+    return _catalog
@@ -0,0 +1,136 @@
+"""
+Config store voor /app/data/config.json.
+
+De geparste config blijft in het geheugen en wordt alleen opnieuw ingelezen
+als het bestand op disk verandert (inode, mtime of grootte). Omdat iedere
+uvicorn worker bij elke aanroep één `os.stat` doet, zien alle workers een
+wijziging van een andere worker direct. Schrijven gaat atomisch via een
+tijdelijk bestand + rename, zodat lezers nooit half geschreven JSON zien.
+"""
+import copy
+import fcntl
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from .settings import CONFIG_FILE
+
+DEFAULT_CONFIG = {
+    "apk_filename": None,
+    "apk_url": "https://portal.vastelijn.eu/api/public/apk",
+    "checksum": "Ytae8RlFLC6/iaNh93mGXLyB8tnayAGrgYSKnsXNbTQ=",
+    "package_name": "com.vastelijnphone",
+    "admin_receiver": "com.vastelijnphone/.admin.VasteLijnDeviceAdminReceiver",
+}
+
+
+def write_json_atomic(path: str, data, prefix: str = ".tmp-"):
+    """
+    Schrijf JSON atomisch weg: temp bestand in dezelfde directory, fsync en
+    rename, zodat lezers nooit een half geschreven bestand zien.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=prefix, suffix=".tmp")
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ConfigStore:
+    """In-memory cache van een JSON config bestand met stat-invalidatie"""
+
+    def __init__(self, path: str, defaults: dict):
+        self.path = path
+        self.defaults = defaults
+        self._lock = threading.Lock()
+        self._key: Optional[tuple] = None
+        self._config: dict = copy.deepcopy(defaults)
+        self._version = "default"
+
+    def _stat_key(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        key = self._stat_key()
+        if key == self._key:
+            return
+        with self._lock:
+            key = self._stat_key()
+            if key == self._key:
+                return
+            if key is None:
+                config = copy.deepcopy(self.defaults)
+                version = "default"
+            else:
+                with open(self.path, "r") as f:
+                    config = json.load(f)
+                version = "%x-%x-%x" % key
+            self._config = config
+            self._version = version
+            self._key = key
+
+    def snapshot(self) -> Tuple[str, dict]:
+        """
+        Geef (versie, config) terug zonder te kopiëren.
+        De dict is gedeeld tussen requests en mag NIET aangepast worden.
+        """
+        self._refresh()
+        with self._lock:
+            return self._version, self._config
+
+    @property
+    def version(self) -> str:
+        return self.snapshot()[0]
+
+    def load(self) -> dict:
+        """Geef een eigen kopie van de config terug (veilig om aan te passen)"""
+        return copy.deepcopy(self.snapshot()[1])
+
+    def save(self, config: dict):
+        """Schrijf de config atomisch weg (temp bestand + fsync + rename)"""
+        write_json_atomic(self.path, config, prefix=".config-")
+        self._refresh()
+
+    @contextmanager
+    def edit(self):
+        """
+        Read-modify-write onder een exclusieve file lock, zodat twee workers
+        die tegelijk de config aanpassen elkaars wijziging niet overschrijven.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                config = self.load()
+                yield config
+                self.save(config)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Singleton instance
+_store: Optional[ConfigStore] = None
+
+
+def get_config_store() -> ConfigStore:
+    """Get de singleton config store"""
+    global _store
+    if _store is None:
+        _store = ConfigStore(CONFIG_FILE, DEFAULT_CONFIG)
+    return _store
@@ -1,43 +1,143 @@
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from .models import User, Device
-from .auth import hash_pw, verify_pw
-from .headwind_client import get_headwind_client, CONFIGURATIONS
+from .auth import hash_pw_async, verify_and_update_async, invalidate_user
+from .config_catalog import DEFAULT_CONFIG_KEY, get_config_catalog
 
 
-def create_user(db: Session, email: str, password: str, role: str = "customer"):
-    u = User(email=email.lower().strip(), password_hash=hash_pw(password), role=role)
+async def create_user(db: AsyncSession, email: str, password: str, role: str = "customer"):
+    password_hash = await hash_pw_async(password)
+    u = User(email=email.lower().strip(), password_hash=password_hash, role=role)
     db.add(u)
-    db.commit()
-    db.refresh(u)
+    await db.commit()
+    await db.refresh(u)
     return u
 
 
-def authenticate(db: Session, email: str, password: str):
-    u = db.query(User).filter(User.email == email.lower().strip()).first()
-    if not u or not verify_pw(password, u.password_hash):
+async def count_users(db: AsyncSession) -> int:
+    return (await db.execute(select(func.count()).select_from(User))).scalar() or 0
+
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(User).where(User.email == email.lower().strip()))
+    return result.scalars().first()
+
+
+async def authenticate(db: AsyncSession, email: str, password: str):
+    u = await get_user_by_email(db, email)
+    if not u:
+        return None
+    ok, new_hash = await verify_and_update_async(password, u.password_hash)
+    if not ok:
+        return None
+    # Transparant rehashen als BCRYPT_ROUNDS gewijzigd is
+    if new_hash:
+        u.password_hash = new_hash
+        await db.commit()
+    return u
+
+
+async def set_user_role(db: AsyncSession, user_id: int, role: str):
+    u = await db.get(User, user_id)
+    if not u:
         return None
+    u.role = role
+    await db.commit()
+    invalidate_user(user_id)
     return u
 
 
-def list_devices(db: Session, owner_id: int):
-    return (
-        db.query(Device)
-        .filter(Device.owner_id == owner_id)
-        .order_by(Device.id.desc())
-        .all()
+async def delete_user(db: AsyncSession, user_id: int) -> bool:
+    u = await db.get(User, user_id)
+    if not u:
+        return False
+    # Geen lazy load van u.devices in async; devices direct verwijderen
+    await db.execute(delete(Device).where(Device.owner_id == user_id))
+    await db.delete(u)
+    await db.commit()
+    invalidate_user(user_id)
+    return True
+
+
+async def list_devices(db: AsyncSession, owner_id: int):
+    result = await db.execute(
+        select(Device).where(Device.owner_id == owner_id).order_by(Device.id.desc())
+    )
+    return result.scalars().all()
+
+
+DEVICE_LIST_COLUMNS = (
+    Device.id,
+    Device.label,
+    Device.config_key,
+    Device.status,
+    Device.created_at,
+)
+
+
+async def list_devices_page(
+    db: AsyncSession,
+    owner_id: int,
+    limit: int = 50,
+    before_id: Optional[int] = None,
+    status: Optional[str] = None,
+    config_key: Optional[str] = None,
+):
+    """
+    Eén pagina devices (nieuwste eerst) via keyset paginatie op id.
+
+    Alleen de lijstkolommen worden opgehaald (geen ORM objecten, geen
+    qr_payload). Er wordt één rij extra gelezen om te weten of er nog een
+    volgende pagina is.
+
+    Returns:
+        (rows, next_before_id) waarbij next_before_id None is op de laatste pagina
+    """
+    q = select(*DEVICE_LIST_COLUMNS).where(Device.owner_id == owner_id)
+    if status:
+        q = q.where(Device.status == status)
+    if config_key:
+        q = q.where(Device.config_key == config_key)
+    if before_id is not None:
+        q = q.where(Device.id < before_id)
+    q = q.order_by(Device.id.desc()).limit(limit + 1)
+
+    rows = [dict(r) for r in (await db.execute(q)).mappings()]
+    next_before_id = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_before_id = rows[-1]["id"]
+    return rows, next_before_id
+
+
+async def count_devices_by_status(db: AsyncSession, owner_id: int) -> dict:
+    """Aantal devices per status (covering index ix_devices_owner_status)"""
+    rows = await db.execute(
+        select(Device.status, func.count())
+        .where(Device.owner_id == owner_id)
+        .group_by(Device.status)
     )
+    return {status or "pending": n for status, n in rows}
 
 
-def create_device(db: Session, owner_id: int, label: str, config_key: str):
+def device_qr_payload(config_key: str) -> str:
+    """Headwind QR enrollment URL voor een configuratie"""
+    config = get_config_catalog().get(config_key)
+    if config is None:
+        raise ValueError(f"Onbekende configuratie: {config_key}")
+    return f"https://android.vastelijn.eu/#/qr/{config['qr_key']}"
+
+
+async def create_device(db: AsyncSession, owner_id: int, label: str, config_key: str):
     """Maak een nieuw device aan met Headwind QR provisioning URL"""
     # Valideer config_key
-    if config_key not in CONFIGURATIONS:
-        config_key = "vastelijn_alleen"
+    if config_key not in get_config_catalog():
+        config_key = DEFAULT_CONFIG_KEY
 
-    # Haal de QR URL op van Headwind
-    client = get_headwind_client()
-    config = CONFIGURATIONS[config_key]
-    qr_payload = f"https://android.vastelijn.eu/#/qr/{config['qr_key']}"
+    # QR URL uit de configuratie catalogus
+    qr_payload = device_qr_payload(config_key)
 
     # Mode is nu gebaseerd op config (legacy support)
     mode = "kiosk"
@@ -50,14 +150,52 @@ def create_device(db: Session, owner_id: int, label: str, config_key: str):
         qr_payload=qr_payload,
     )
     db.add(d)
-    db.commit()
-    db.refresh(d)
+    await db.commit()
+    await db.refresh(d)
     return d
 
 
-def get_device(db: Session, owner_id: int, device_id: int):
-    return (
-        db.query(Device)
-        .filter(Device.owner_id == owner_id, Device.id == device_id)
-        .first()
+async def get_device(db: AsyncSession, owner_id: int, device_id: int):
+    result = await db.execute(
+        select(Device).where(Device.owner_id == owner_id, Device.id == device_id)
+    )
+    return result.scalars().first()
+
+
+async def bulk_create_devices(db: AsyncSession, owner_id: int, items: list) -> list:
+    """
+    Maak veel devices in één transactie aan (bulk insert).
+
+    Args:
+        items: lijst van (label, config_key, headwind_number); config_keys
+            moeten al gevalideerd zijn
+
+    Returns:
+        Lijst van dicts met id, label, config_key en qr_payload
+    """
+    now = datetime.utcnow()
+    rows = [
+        {
+            "owner_id": owner_id,
+            "label": label,
+            "mode": "kiosk",
+            "config_key": config_key,
+            "status": "pending",
+            "qr_payload": device_qr_payload(config_key),
+            "created_at": now,
+            "headwind_number": headwind_number,
+        }
+        for label, config_key, headwind_number in items
+    ]
+    if not rows:
+        return []
+    result = await db.execute(
+        insert(Device).returning(Device.id, Device.label, Device.config_key, Device.qr_payload),
+        rows,
     )
+    created = [
+        {"id": r.id, "label": r.label, "config_key": r.config_key, "qr_payload": r.qr_payload}
+        for r in result
+    ]
+    await db.commit()
+    return sorted(created, key=lambda d: d["id"])
@@ -0,0 +1,394 @@
+"""
+Device status sync met Headwind.
+
+Een achtergrond taak haalt periodiek de devices uit Headwind op
+(`/rest/private/devices/search`, gesorteerd op lastUpdate aflopend) en
+vergelijkt ze met de lokale `devices` rijen, gekoppeld via
+`headwind_number`. Alleen rijen waarvan status of last_seen veranderd is
+worden (in één batch UPDATE) weggeschreven.
+
+- Incrementeel: er wordt gepagineerd tot de `lastUpdate` watermark van de
+  vorige run bereikt is, dus meestal is één pagina genoeg.
+- Volledig (eerste run en daarna elke HEADWIND_SYNC_FULL_SECONDS): alle
+  pagina's, met maximaal HEADWIND_SYNC_CONCURRENCY tegelijk.
+- Offline: een device dat al DEVICE_OFFLINE_AFTER_SECONDS niets van zich
+  heeft laten horen verandert in Headwind niet; dat zetten we lokaal met één
+  UPDATE op (status, last_seen) op offline.
+
+Een non-blocking file lock zorgt dat maar één uvicorn worker tegelijk synct;
+de tijdstempel van de laatste run staat in `sync_state`, zodat de andere
+workers een run overslaan als die net gedaan is.
+"""
+import asyncio
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, select, update
+from starlette.concurrency import run_in_threadpool
+
+from .db import engine, upsert
+from .events import get_event_bus
+from .headwind_client import HeadwindClient, get_headwind_client
+from .models import Device, SyncState
+from .settings import (
+    DB_PATH,
+    DEVICE_OFFLINE_AFTER_SECONDS,
+    HEADWIND_BASE_URL,
+    HEADWIND_SYNC_CONCURRENCY,
+    HEADWIND_SYNC_FULL_SECONDS,
+    HEADWIND_SYNC_INTERVAL_SECONDS,
+    HEADWIND_SYNC_PAGE_SIZE,
+)
+
+SEARCH_PATH = "/rest/private/devices/search"
+WATERMARK_KEY = "headwind_devices.last_update"
+LAST_RUN_KEY = "headwind_devices.last_run_at"
+LAST_FULL_KEY = "headwind_devices.last_full_at"
+LOCK_PATH = DB_PATH + ".sync.lock"
+IN_CHUNK = 500
+# Maximaal aantal device wijzigingen in één SSE event (daarna alleen tellers)
+MAX_EVENT_DEVICES = 200
+
+
+class SyncBusy(Exception):
+    """Er draait al een sync (in deze of een andere worker)"""
+
+
+@dataclass
+class SyncResult:
+    mode: str = "incremental"
+    pages: int = 0
+    fetched: int = 0
+    matched: int = 0
+    changed: int = 0
+    marked_offline: int = 0
+    watermark: Optional[int] = None
+    seconds: float = 0.0
+    changes: List[dict] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data.pop("changes")
+        return data
+
+
+def _from_millis(ms) -> Optional[datetime]:
+    try:
+        return datetime.utcfromtimestamp(int(ms) / 1000) if ms else None
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def parse_search_response(data) -> Tuple[List[dict], int]:
+    """Haal (items, totaal) uit een Headwind devices/search antwoord"""
+    payload = data.get("data", data) if isinstance(data, dict) else {}
+    devices = payload.get("devices", payload) if isinstance(payload, dict) else {}
+    if not isinstance(devices, dict):
+        return [], 0
+    items = devices.get("items") or []
+    return items, int(devices.get("totalItemsCount") or len(items))
+
+
+def device_status(last_seen: Optional[datetime], now: datetime, offline_after: float) -> str:
+    """Status van een device dat in Headwind bekend is"""
+    if last_seen is None:
+        return "enrolled"
+    if (now - last_seen).total_seconds() < offline_after:
+        return "online"
+    return "offline"
+
+
+def write_state(conn, key: str, value: str):
+    stmt = upsert(conn, SyncState.__table__).values(
+        key=key, value=value, updated_at=datetime.utcnow()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"value": stmt.excluded.value, "updated_at": stmt.excluded.updated_at},
+    )
+    conn.execute(stmt)
+
+
+@contextmanager
+def sync_lock():
+    """Non-blocking lock over alle workers; raises SyncBusy als bezet"""
+    os.makedirs(os.path.dirname(LOCK_PATH) or ".", exist_ok=True)
+    with open(LOCK_PATH, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise SyncBusy("Device sync draait al")
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class DeviceSync:
+    """Haalt Headwind devices op en past alleen de verschillen lokaal toe"""
+
+    def __init__(
+        self,
+        client: HeadwindClient,
+        page_size: int = HEADWIND_SYNC_PAGE_SIZE,
+        concurrency: int = HEADWIND_SYNC_CONCURRENCY,
+        offline_after: float = DEVICE_OFFLINE_AFTER_SECONDS,
+        db_engine=None,
+    ):
+        self.client = client
+        self.page_size = page_size
+        self.concurrency = max(1, concurrency)
+        self.offline_after = offline_after
+        self.engine = db_engine or engine
+        self._running = asyncio.Lock()
+
+    async def fetch_page(self, page_num: int) -> Tuple[List[dict], int]:
+        data = await self.client.post_json(
+            SEARCH_PATH,
+            {
+                "pageNum": page_num,
+                "pageSize": self.page_size,
+                "sortBy": "lastUpdate",
+                "sortDir": "DESC",
+            },
+        )
+        return parse_search_response(data)
+
+    async def fetch_all(self, result: SyncResult) -> List[dict]:
+        """Alle pagina's; na de eerste (voor het totaal) gelijktijdig"""
+        items, total = await self.fetch_page(1)
+        result.pages = 1
+        pages = -(-total // self.page_size) if total else 1
+        if pages > 1:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def fetch(page_num: int) -> List[dict]:
+                async with semaphore:
+                    page_items, _ = await self.fetch_page(page_num)
+                    return page_items
+
+            for page_items in await asyncio.gather(*[fetch(n) for n in range(2, pages + 1)]):
+                items.extend(page_items)
+            result.pages = pages
+        return items
+
+    async def fetch_since(self, watermark: int, result: SyncResult) -> List[dict]:
+        """Pagineer (nieuwste eerst) tot de watermark bereikt is"""
+        items: List[dict] = []
+        page_num = 1
+        while True:
+            page_items, total = await self.fetch_page(page_num)
+            result.pages = page_num
+            items.extend(page_items)
+            oldest = min((int(i.get("lastUpdate") or 0) for i in page_items), default=0)
+            if (
+                len(page_items) < self.page_size
+                or oldest <= watermark
+                or page_num * self.page_size >= total
+            ):
+                return items
+            page_num += 1
+
+    def apply(self, items: List[dict], now: datetime, result: SyncResult, state: Dict[str, str]):
+        """Vergelijk met de lokale rijen en schrijf alleen de wijzigingen weg"""
+        remote: Dict[str, Optional[datetime]] = {}
+        max_update = int(state.get(WATERMARK_KEY) or 0)
+        for item in items:
+            number = item.get("number")
+            if not number:
+                continue
+            remote[str(number)] = _from_millis(item.get("lastUpdate"))
+            max_update = max(max_update, int(item.get("lastUpdate") or 0))
+
+        table = Device.__table__
+        with self.engine.begin() as conn:
+            numbers = list(remote)
+            updates = []
+            for i in range(0, len(numbers), IN_CHUNK):
+                rows = conn.execute(
+                    select(table.c.id, table.c.owner_id, table.c.headwind_number, table.c.status, table.c.last_seen)
+                    .where(table.c.headwind_number.in_(numbers[i:i + IN_CHUNK]))
+                )
+                for row in rows:
+                    result.matched += 1
+                    last_seen = remote[row.headwind_number]
+                    if row.last_seen and (last_seen is None or last_seen < row.last_seen):
+                        last_seen = row.last_seen
+                    status = device_status(last_seen, now, self.offline_after)
+                    if status == row.status and last_seen == row.last_seen:
+                        continue
+                    updates.append({"_id": row.id, "_status": status, "_last_seen": last_seen})
+                    if status != row.status:
+                        result.changes.append({
+                            "id": row.id,
+                            "owner_id": row.owner_id,
+                            "status": status,
+                            "previous": row.status or "pending",
+                        })
+
+            if updates:
+                conn.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("_id"))
+                    .values(status=bindparam("_status"), last_seen=bindparam("_last_seen")),
+                    updates,
+                )
+            result.changed = len(result.changes)
+
+            # Devices die te lang stil zijn: lokaal offline zetten
+            cutoff = now - timedelta(seconds=self.offline_after)
+            stale = and_(table.c.status == "online", table.c.last_seen < cutoff)
+            gone = conn.execute(select(table.c.id, table.c.owner_id).where(stale)).all()
+            if gone:
+                conn.execute(update(table).where(stale).values(status="offline"))
+                result.marked_offline = len(gone)
+                result.changes.extend(
+                    {"id": r.id, "owner_id": r.owner_id, "status": "offline", "previous": "online"}
+                    for r in gone
+                )
+
+            result.watermark = max_update or None
+            if max_update:
+                write_state(conn, WATERMARK_KEY, str(max_update))
+            write_state(conn, LAST_RUN_KEY, now.isoformat())
+            if result.mode == "full":
+                write_state(conn, LAST_FULL_KEY, now.isoformat())
+
+    def load_state(self) -> Dict[str, str]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(SyncState.key, SyncState.value))
+            return {key: value for key, value in rows}
+
+    async def run(self, full: bool = False, min_interval: float = 0.0) -> Optional[SyncResult]:
+        """
+        Eén sync run. Returns None als een andere worker net gesynct heeft
+        (binnen `min_interval`); raises SyncBusy als er al een sync draait.
+        """
+        if self._running.locked():
+            raise SyncBusy("Device sync draait al")
+        async with self._running:
+            with sync_lock():
+                started = time.perf_counter()
+                now = datetime.utcnow()
+                state = await run_in_threadpool(self.load_state)
+
+                last_run = state.get(LAST_RUN_KEY)
+                if min_interval and last_run:
+                    if (now - datetime.fromisoformat(last_run)).total_seconds() < min_interval:
+                        return None
+
+                watermark = int(state.get(WATERMARK_KEY) or 0)
+                last_full = state.get(LAST_FULL_KEY)
+                full = (
+                    full
+                    or not watermark
+                    or not last_full
+                    or (now - datetime.fromisoformat(last_full)).total_seconds() >= HEADWIND_SYNC_FULL_SECONDS
+                )
+                result = SyncResult(mode="full" if full else "incremental")
+                if full:
+                    items = await self.fetch_all(result)
+                else:
+                    items = await self.fetch_since(watermark, result)
+                result.fetched = len(items)
+
+                await run_in_threadpool(self.apply, items, now, result, state)
+                result.seconds = round(time.perf_counter() - started, 3)
+                return result
+
+
+def publish_changes(result: SyncResult):
+    """Stuur de status wijzigingen per eigenaar naar de event bus"""
+    by_owner: Dict[int, List[dict]] = {}
+    for change in result.changes:
+        by_owner.setdefault(change["owner_id"], []).append(change)
+    bus = get_event_bus()
+    for owner_id, changes in by_owner.items():
+        counts: Dict[str, int] = {}
+        for change in changes:
+            counts[change["status"]] = counts.get(change["status"], 0) + 1
+            counts[change["previous"]] = counts.get(change["previous"], 0) - 1
+        bus.publish(
+            "device_status",
+            {
+                "devices": [
+                    {"id": c["id"], "status": c["status"]} for c in changes[:MAX_EVENT_DEVICES]
+                ],
+                "total": len(changes),
+                "count_delta": counts,
+            },
+            owner_id=owner_id,
+        )
+
+
+class SyncWorker:
+    """Periodieke sync als asyncio taak binnen de app lifespan"""
+
+    def __init__(self, sync: DeviceSync, interval: float):
+        self.sync = sync
+        self.interval = interval
+        self.last_result: Optional[SyncResult] = None
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.interval > 0 and HEADWIND_BASE_URL:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self, full: bool = False, min_interval: float = 0.0) -> Optional[SyncResult]:
+        try:
+            result = await self.sync.run(full=full, min_interval=min_interval)
+        except SyncBusy:
+            raise
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        if result is not None:
+            self.last_result = result
+            self.last_error = None
+            publish_changes(result)
+        return result
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # Andere workers die net gesynct hebben: deze ronde overslaan
+                await self.run_once(min_interval=self.interval * 0.9)
+            except SyncBusy:
+                pass
+            except Exception as e:
+                print(f"Headwind device sync mislukt: {e}")
+
+    def status(self) -> dict:
+        return {
+            "enabled": self._task is not None,
+            "interval_seconds": self.interval,
+            "last_result": self.last_result.to_dict() if self.last_result else None,
+            "last_error": self.last_error,
+        }
+
+
+_worker: Optional[SyncWorker] = None
+
+
+def get_sync_worker() -> SyncWorker:
+    """Get de singleton sync worker"""
+    global _worker
+    if _worker is None:
+        _worker = SyncWorker(DeviceSync(get_headwind_client()), HEADWIND_SYNC_INTERVAL_SECONDS)
+    return _worker
@@ -0,0 +1,119 @@
+"""
+Bulk device enrollment: invoer parsen/valideren en een ZIP met QR codes
+streamen.
+
+De ZIP wordt per device opgebouwd en direct doorgestuurd (geen seekable
+buffer), zodat het geheugengebruik niet meegroeit met de batch grootte.
+Devices met dezelfde configuratie delen dezelfde QR afbeelding uit de
+render cache.
+"""
+import csv
+import io
+import json
+import re
+import zipfile
+from typing import Iterator, List, Optional, Tuple
+
+from .config_catalog import get_config_catalog
+from .qr_render import get_qr_image
+
+QR_SIZE = 512
+MAX_LABEL_LENGTH = 200
+
+
+class EnrollmentError(ValueError):
+    """Ongeldige bulk enrollment invoer"""
+
+
+def parse_items(body: bytes, content_type: str) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Parse CSV (kolommen `label,config_key[,headwind_number]`) of JSON
+    (`{"devices": [{"label": ..., "config_key": ...}]}` of een lijst).
+    Het optionele `headwind_number` koppelt het device voor de status sync.
+    """
+    if "csv" in content_type:
+        reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+        if not reader.fieldnames or "label" not in reader.fieldnames:
+            raise EnrollmentError("CSV moet een header met 'label' en 'config_key' hebben")
+        raw = list(reader)
+    else:
+        try:
+            data = json.loads(body or b"null")
+        except ValueError:
+            raise EnrollmentError("Ongeldige JSON")
+        raw = data.get("devices") if isinstance(data, dict) else data
+        if not isinstance(raw, list):
+            raise EnrollmentError("Verwacht een lijst 'devices'")
+
+    items = []
+    for i, row in enumerate(raw, start=1):
+        if not isinstance(row, dict):
+            raise EnrollmentError(f"Rij {i}: verwacht een object met label en config_key")
+        label = str(row.get("label") or "").strip()
+        config_key = str(row.get("config_key") or "").strip()
+        headwind_number = str(row.get("headwind_number") or "").strip() or None
+        items.append((i, label, config_key, headwind_number))
+    return validate_items(items)
+
+
+def validate_items(items: List[tuple]) -> List[Tuple[str, str, Optional[str]]]:
+    """Check labels en config_keys tegen de configuratie catalogus; verzamel alle fouten"""
+    configs = get_config_catalog().current().configs
+    errors = []
+    for row, label, config_key, _ in items:
+        if not label:
+            errors.append(f"Rij {row}: label ontbreekt")
+        elif len(label) > MAX_LABEL_LENGTH:
+            errors.append(f"Rij {row}: label is langer dan {MAX_LABEL_LENGTH} tekens")
+        if config_key not in configs:
+            errors.append(f"Rij {row}: onbekende config_key '{config_key}'")
+    if errors:
+        raise EnrollmentError("; ".join(errors[:20]) + (" ..." if len(errors) > 20 else ""))
+    return [(label, config_key, headwind_number) for _, label, config_key, headwind_number in items]
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Niet-seekable schrijfbuffer die na elk ZIP entry geleegd wordt"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _safe_name(label: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", label).strip("_")[:60] or "device"
+
+
+def stream_qr_zip(devices: List[dict]) -> Iterator[bytes]:
+    """Genereer een ZIP met manifest.csv en per device een QR PNG"""
+    buf = _StreamBuffer()
+    with zipfile.ZipFile(buf, mode="w") as zf:
+        manifest = io.StringIO()
+        writer = csv.writer(manifest)
+        writer.writerow(["id", "label", "config_key", "qr_file", "qr_payload"])
+        names = []
+        for d in devices:
+            name = f"qr/{d['id']:06d}-{_safe_name(d['label'])}.png"
+            names.append(name)
+            writer.writerow([d["id"], d["label"], d["config_key"], name, d["qr_payload"]])
+        zf.writestr("manifest.csv", manifest.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+        del manifest
+        yield buf.drain()
+
+        for d, name in zip(devices, names):
+            png, _ = get_qr_image(d["qr_payload"], "png", QR_SIZE, "m")
+            # PNG is al gecomprimeerd
+            zf.writestr(name, png, compress_type=zipfile.ZIP_STORED)
+            yield buf.drain()
+    yield buf.drain()
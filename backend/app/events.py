@@ -0,0 +1,139 @@
+"""
+In-process pub/sub voor live events naar het admin dashboard (SSE).
+
+Publishers (download log, device sync) roepen `publish()` aan vanuit de
+event loop; dat blokkeert nooit. Elke verbonden tab heeft een eigen,
+begrensde wachtrij. Loopt een client achter dan vallen de oudste events
+weg en krijgt die client één `resync` event, waarna het dashboard de
+stats eenmalig opnieuw ophaalt in plaats van events te missen.
+
+Een korte ring buffer van recente events maakt het mogelijk om na een
+reconnect (`Last-Event-ID`) de gemiste events na te sturen.
+
+Let op: de bus is per uvicorn worker. Bij meerdere workers ziet een tab
+alleen de events van de worker waarmee hij verbonden is.
+"""
+import asyncio
+import json
+from collections import deque
+from typing import AsyncIterator, Optional, Set
+
+from .settings import EVENTS_HEARTBEAT_SECONDS, EVENTS_MAX_SUBSCRIBERS, EVENTS_QUEUE_SIZE
+
+
+def format_sse(event_id: int, event: str, data: dict) -> bytes:
+    payload = json.dumps(data, separators=(",", ":"), default=str)
+    return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n".encode()
+
+
+class Subscriber:
+    """Eén verbonden client met een begrensde wachtrij"""
+
+    def __init__(self, owner_id: Optional[int], max_queue: int):
+        self.owner_id = owner_id
+        self.max_queue = max_queue
+        self.queue: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.dropped = 0
+        self.needs_resync = False
+
+    def offer(self, item: tuple):
+        if len(self.queue) >= self.max_queue:
+            self.queue.popleft()
+            self.dropped += 1
+            self.needs_resync = True
+        self.queue.append(item)
+        self.wakeup.set()
+
+
+class EventBus:
+    def __init__(self, max_queue: int, max_subscribers: int, heartbeat: float):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        self._subscribers: Set[Subscriber] = set()
+        self._recent: deque = deque(maxlen=max_queue)
+        self._seq = 0
+        self._closed = False
+        self.published = 0
+
+    def publish(self, event: str, data: dict, owner_id: Optional[int] = None):
+        """
+        Stuur een event naar alle subscribers (of alleen naar de tabs van
+        `owner_id`). Moet vanuit de event loop aangeroepen worden.
+        """
+        self._seq += 1
+        item = (self._seq, event, data, owner_id)
+        self._recent.append(item)
+        self.published += 1
+        for sub in self._subscribers:
+            if owner_id is None or sub.owner_id == owner_id:
+                sub.offer(item)
+
+    def full(self) -> bool:
+        return len(self._subscribers) >= self.max_subscribers
+
+    def subscribe(self, owner_id: Optional[int], last_event_id: Optional[int] = None) -> Subscriber:
+        sub = Subscriber(owner_id, self.max_queue)
+        if last_event_id is not None:
+            oldest = self._recent[0][0] if self._recent else self._seq + 1
+            if last_event_id > self._seq or oldest > last_event_id + 1:
+                # Server herstart of niet alles zit nog in de buffer
+                sub.needs_resync = True
+            for item in self._recent:
+                if item[0] > last_event_id and (item[3] is None or item[3] == owner_id):
+                    sub.offer(item)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        self._subscribers.discard(sub)
+
+    def close(self):
+        """Bij shutdown: laat alle open streams netjes eindigen"""
+        self._closed = True
+        for sub in self._subscribers:
+            sub.wakeup.set()
+
+    async def stream(self, owner_id: Optional[int], last_event_id: Optional[int] = None) -> AsyncIterator[bytes]:
+        """SSE bytes voor één client, met heartbeat comments"""
+        sub = self.subscribe(owner_id, last_event_id)
+        try:
+            yield b"retry: 3000\n: verbonden\n\n"
+            while not self._closed:
+                if not sub.queue and not sub.needs_resync:
+                    sub.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(sub.wakeup.wait(), self.heartbeat)
+                    except asyncio.TimeoutError:
+                        yield b": ping\n\n"
+                        continue
+                if sub.needs_resync:
+                    sub.needs_resync = False
+                    # De client haalt alles opnieuw op; de wachtrij is dan overbodig
+                    sub.queue.clear()
+                    yield format_sse(self._seq, "resync", {"dropped": sub.dropped})
+                    continue
+                seq, event, data, _ = sub.queue.popleft()
+                yield format_sse(seq, event, data)
+        finally:
+            self.unsubscribe(sub)
+
+    def metrics(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "queued": sum(len(s.queue) for s in self._subscribers),
+            "dropped": sum(s.dropped for s in self._subscribers),
+        }
+
+
+_bus: Optional[EventBus] = None
+
+
+def get_event_bus() -> EventBus:
+    """Get de singleton event bus"""
+    global _bus
+    if _bus is None:
+        _bus = EventBus(EVENTS_QUEUE_SIZE, EVENTS_MAX_SUBSCRIBERS, EVENTS_HEARTBEAT_SECONDS)
+    return _bus
@@ -0,0 +1,226 @@
+"""
+Bestanden serveren met Range/If-Range, strong ETag en zero-copy.
+
+- Een enkele `Range: bytes=...` wordt als 206 Partial Content beantwoord,
+  zodat afgebroken APK downloads kunnen hervatten.
+- Als de ASGI server de `http.response.zerocopysend` extensie ondersteunt
+  gaat de file descriptor direct naar de server (sendfile); anders wordt
+  in chunks gelezen.
+- In X-Accel-Redirect modus stuurt de API alleen headers en serveert nginx
+  de bytes zelf (met sendfile en eigen Range support).
+"""
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from .http_cache import etag_matches
+from .metrics import APK_BYTES_SENT
+
+CHUNK_SIZE = 256 * 1024
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse een Range header naar (start, end) inclusief.
+    Returns None als de header ontbreekt, ongeldig is of meerdere ranges
+    vraagt (dan wordt het hele bestand gestuurd, wat RFC 9110 toestaat).
+    """
+    if not header:
+        return None
+    m = RANGE_RE.match(header.strip().replace(" ", ""))
+    if not m:
+        return None
+    first, last = m.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        suffix = int(last)
+        if suffix == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def parse_range_safe(header: Optional[str], size: int) -> Optional[int]:
+    """Geef alleen de startpositie van een Range header, of None"""
+    try:
+        byte_range = parse_range(header, size)
+    except RangeNotSatisfiable:
+        return None
+    return byte_range[0] if byte_range else None
+
+
+def if_range_allows(header: Optional[str], etag: str, mtime: float) -> bool:
+    """
+    Check de If-Range conditie (strong ETag of HTTP datum). Een datum moet
+    exact gelijk zijn aan Last-Modified (RFC 9110 §13.1.5), niet later.
+    """
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        return header == etag
+    try:
+        return int(parsedate_to_datetime(header).timestamp()) == int(mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+class RangeFileResponse(Response):
+    """Stuurt (een deel van) een bestand, zero-copy als de server dat kan"""
+
+    def __init__(
+        self,
+        path: str,
+        start: int,
+        length: int,
+        status_code: int,
+        headers: dict,
+        media_type: str,
+        send_body: bool = True,
+        background: Optional[BackgroundTask] = None,
+    ):
+        self.path = path
+        self.start = start
+        self.length = length
+        self.send_body = send_body
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = background
+        self.body = b""
+        self.init_headers(headers)
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.fileno(),
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            APK_BYTES_SENT.labels("zerocopy").inc(self.length)
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as f:
+                await f.seek(self.start)
+                remaining = self.length
+                while remaining > 0:
+                    chunk = await f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    APK_BYTES_SENT.labels("chunked").inc(len(chunk))
+                    await send({
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": remaining > 0,
+                    })
+                if remaining > 0:
+                    # Bestand is korter geworden tijdens het lezen
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
+
+
+def serve_file(
+    request: Request,
+    path: str,
+    filename: str,
+    etag: str,
+    media_type: str,
+    accel_path: Optional[str] = None,
+    extra_headers: Optional[dict] = None,
+    background: Optional[BackgroundTask] = None,
+) -> Response:
+    """
+    Bouw de response voor een bestand met ETag, Range en optioneel
+    X-Accel-Redirect. `background` draait alleen als er echt bytes vanaf
+    het begin van het bestand verstuurd worden (geen 304/HEAD/hervatting).
+    """
+    st = os.stat(path)
+    size = st.st_size
+    quoted = quote(filename)
+    if quoted != filename:
+        disposition = f"attachment; filename*=utf-8''{quoted}"
+    else:
+        disposition = f'attachment; filename="{filename}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": disposition,
+    }
+    if extra_headers:
+        headers.update(extra_headers)
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    is_head = request.method == "HEAD"
+
+    if accel_path:
+        # nginx serveert het bestand zelf (inclusief Range requests)
+        headers["X-Accel-Redirect"] = accel_path
+        first_range = parse_range_safe(request.headers.get("range"), size)
+        return Response(
+            status_code=200,
+            headers=headers,
+            media_type=media_type,
+            background=background if not is_head and first_range in (None, 0) else None,
+        )
+
+    byte_range = None
+    if if_range_allows(request.headers.get("if-range"), etag, st.st_mtime):
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+
+    if byte_range is None:
+        start, length, status_code = 0, size, 200
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    return RangeFileResponse(
+        path,
+        start=start,
+        length=length,
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type,
+        send_body=not is_head,
+        background=background if not is_head and start == 0 else None,
+    )
+
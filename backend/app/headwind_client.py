@@ -1,12 +1,42 @@
 """
 Headwind MDM API Client voor VasteLijn Portal
-Haalt QR provisioning payloads op voor device enrollment.
+Geauthenticeerde calls naar de Headwind REST API (configuraties, devices).
+
+Alle calls gaan via één gedeelde httpx.AsyncClient (keep-alive connection
+pool), die via de FastAPI lifespan geopend en gesloten wordt. Het JWT token
+wordt vóór het verlopen ververst, en gelijktijdige callers delen één login.
+Mislukte calls worden met jitter opnieuw geprobeerd; bij aanhoudende fouten
+gaat een circuit breaker open zodat we Headwind niet blijven bestoken.
 """
+import asyncio
+import hashlib
+import random
+import time
 import httpx
+from jose import jwt
 from typing import Optional
-from .settings import HEADWIND_BASE_URL, HEADWIND_ADMIN_USER, HEADWIND_ADMIN_PASS
+from .metrics import observe_headwind
+from .settings import (
+    HEADWIND_BASE_URL,
+    HEADWIND_ADMIN_USER,
+    HEADWIND_ADMIN_PASS,
+    HEADWIND_TIMEOUT_SECONDS,
+    HEADWIND_MAX_CONNECTIONS,
+    HEADWIND_RETRIES,
+    HEADWIND_BREAKER_THRESHOLD,
+    HEADWIND_BREAKER_RESET_SECONDS,
+)
+
+# Ververs het token als het binnen deze marge verloopt
+TOKEN_REFRESH_MARGIN = 60.0
+# Als het token geen `exp` claim heeft gaan we uit van deze levensduur
+DEFAULT_TOKEN_TTL = 3600.0
+RETRY_STATUS = {429, 502, 503, 504}
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 5.0
 
-# Beschikbare configuraties met hun QR keys
+# Ingebouwde configuraties met hun QR keys. Fallback voor de catalogus uit
+# Headwind (zie config_catalog) als die nog nooit opgehaald is.
 CONFIGURATIONS = {
     # === KLANT POLICIES ===
     "vastelijn_alleen": {
@@ -49,6 +79,53 @@ CONFIGURATIONS = {
 }
 
 
+class HeadwindError(Exception):
+    """Headwind API call mislukt"""
+
+
+class HeadwindUnavailable(HeadwindError):
+    """Circuit breaker staat open; Headwind wordt tijdelijk niet aangeroepen"""
+
+
+class CircuitBreaker:
+    """Simpele closed -> open -> half-open circuit breaker"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
 class HeadwindClient:
     """Client voor Headwind MDM REST API"""
 
@@ -57,111 +134,151 @@ class HeadwindClient:
         self.username = HEADWIND_ADMIN_USER
         self.password = HEADWIND_ADMIN_PASS
         self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._http: Optional[httpx.AsyncClient] = None
+        self._login_lock: Optional[asyncio.Lock] = None
+        self.breaker = CircuitBreaker(HEADWIND_BREAKER_THRESHOLD, HEADWIND_BREAKER_RESET_SECONDS)
+
+    async def open(self):
+        """Open de gedeelde connection pool (vanuit de lifespan)"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                verify=False,
+                timeout=HEADWIND_TIMEOUT_SECONDS,
+                limits=httpx.Limits(
+                    max_connections=HEADWIND_MAX_CONNECTIONS,
+                    max_keepalive_connections=HEADWIND_MAX_CONNECTIONS,
+                    keepalive_expiry=30.0,
+                ),
+            )
+        self._login_lock = asyncio.Lock()
+
+    async def close(self):
+        """Sluit de connection pool"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            await self.open()
+        return self._http
+
+    def _token_valid(self) -> bool:
+        return bool(self._token) and time.time() < self._token_expires_at - TOKEN_REFRESH_MARGIN
 
     async def _login(self) -> str:
         """Login naar Headwind en krijg JWT token"""
-        async with httpx.AsyncClient(verify=False) as client:
-            # Headwind gebruikt MD5 hash van wachtwoord voor login
-            import hashlib
-            password_hash = hashlib.md5(self.password.encode()).hexdigest()
+        client = await self._client()
+        # Headwind gebruikt MD5 hash van wachtwoord voor login
+        password_hash = hashlib.md5(self.password.encode()).hexdigest()
 
+        started = time.perf_counter()
+        try:
             response = await client.post(
-                f"{self.base_url}/rest/public/jwt/login",
+                "/rest/public/jwt/login",
                 json={"login": self.username, "password": password_hash},
-                timeout=10.0,
             )
-            if response.status_code == 200:
-                data = response.json()
-                self._token = data.get("token")
-                return self._token
-            else:
-                raise Exception(f"Headwind login failed: {response.status_code} - {response.text}")
+        except httpx.TransportError:
+            observe_headwind("POST", "/rest/public/jwt/login", "error", time.perf_counter() - started)
+            raise
+        observe_headwind("POST", "/rest/public/jwt/login", str(response.status_code), time.perf_counter() - started)
+        if response.status_code != 200:
+            raise HeadwindError(f"Headwind login failed: {response.status_code} - {response.text}")
+
+        data = response.json()
+        token = data.get("token") or data.get("id_token")
+        if not token:
+            raise HeadwindError("Headwind login gaf geen token terug")
+        try:
+            exp = float(jwt.get_unverified_claims(token).get("exp") or 0)
+        except Exception:
+            exp = 0
+        self._token = token
+        self._token_expires_at = exp or time.time() + DEFAULT_TOKEN_TTL
+        return token
 
     async def get_token(self) -> str:
-        """Get of refresh de JWT token"""
-        if not self._token:
-            await self._login()
+        """Get of refresh de JWT token (één login tegelijk)"""
+        if self._token_valid():
+            return self._token
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            if not self._token_valid():
+                await self._login()
         return self._token
 
-    async def get_qr_provisioning_url(self, config_key: str) -> str:
+    def invalidate_token(self):
+        self._token = None
+        self._token_expires_at = 0.0
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """
+        Geauthenticeerde call naar de Headwind REST API, met retries
+        (exponentiële backoff met jitter) en circuit breaker.
         """
-        Genereer de QR provisioning URL voor een configuratie.
+        if not self.breaker.allow():
+            raise HeadwindUnavailable("Headwind tijdelijk niet bereikbaar (circuit open)")
 
-        Args:
-            config_key: Een van 'vastelijn_alleen', 'vastelijn_telegram', 'vastelijn_whatsapp'
+        last_error: Optional[Exception] = None
+        reauthenticated = False
+        attempt = 0
+        try:
+            client = await self._client()
+            while attempt <= HEADWIND_RETRIES:
+                try:
+                    token = await self.get_token()
+                    started = time.perf_counter()
+                    try:
+                        response = await client.request(
+                            method, path, headers={"Authorization": f"Bearer {token}"}, **kwargs
+                        )
+                    except httpx.TransportError:
+                        observe_headwind(method, path, "error", time.perf_counter() - started)
+                        raise
+                    observe_headwind(method, path, str(response.status_code), time.perf_counter() - started)
+                    if response.status_code == 401 and not reauthenticated:
+                        # Token ingetrokken of verlopen: één keer opnieuw inloggen
+                        self.invalidate_token()
+                        reauthenticated = True
+                        continue
+                    if response.status_code not in RETRY_STATUS and response.status_code < 500:
+                        self.breaker.record_success()
+                        return response
+                    last_error = HeadwindError(f"Headwind {method} {path}: {response.status_code}")
+                except (httpx.TransportError, HeadwindError) as e:
+                    last_error = e
 
-        Returns:
-            De volledige URL voor QR code scanning
-        """
-        if config_key not in CONFIGURATIONS:
-            raise ValueError(f"Onbekende configuratie: {config_key}")
+                if attempt < HEADWIND_RETRIES:
+                    await asyncio.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+                attempt += 1
+        except BaseException:
+            # Ook bij annulering of een onverwachte fout (bijv. ongeldige JSON
+            # bij de login): anders blijft een half-open proefcall hangen
+            self.breaker.record_failure()
+            raise
 
-        config = CONFIGURATIONS[config_key]
-        qr_key = config["qr_key"]
+        self.breaker.record_failure()
+        raise HeadwindError(str(last_error)) from last_error
 
-        # Headwind QR URL formaat
-        return f"{self.base_url}/#/qr/{qr_key}"
+    @staticmethod
+    def _json(response: httpx.Response):
+        """JSON body van een geslaagd antwoord; een 4xx of geen JSON wordt een HeadwindError"""
+        request = response.request
+        if response.is_error:
+            raise HeadwindError(f"Headwind {request.method} {request.url.path}: {response.status_code}")
+        try:
+            return response.json()
+        except ValueError as e:
+            raise HeadwindError(f"Headwind {request.method} {request.url.path}: geen geldige JSON") from e
 
-    async def get_qr_payload(self, config_key: str) -> dict:
-        """
-        Haal de volledige QR provisioning payload op voor een configuratie.
+    async def get_json(self, path: str, **kwargs):
+        return self._json(await self.request("GET", path, **kwargs))
 
-        Returns:
-            Dict met enrollment_url, qr_content, en installatie instructies
-        """
-        if config_key not in CONFIGURATIONS:
-            raise ValueError(f"Onbekende configuratie: {config_key}")
-
-        config = CONFIGURATIONS[config_key]
-        qr_key = config["qr_key"]
-
-        # Bouw de provisioning payload
-        # Dit is het formaat dat Android Enterprise QR provisioning verwacht
-        enrollment_url = f"{self.base_url}/#/qr/{qr_key}"
-
-        # Android Enterprise provisioning payload
-        # Ref: https://developers.google.com/android/management/provision-device
-        provisioning_payload = {
-            "android.app.extra.PROVISIONING_DEVICE_ADMIN_COMPONENT_NAME":
-                "com.hmdm.launcher/com.hmdm.launcher.AdminReceiver",
-            "android.app.extra.PROVISIONING_DEVICE_ADMIN_PACKAGE_DOWNLOAD_LOCATION":
-                f"{self.base_url}/files/hmdm-{config['id']}.apk",
-            "android.app.extra.PROVISIONING_LEAVE_ALL_SYSTEM_APPS_ENABLED": True,
-            "android.app.extra.PROVISIONING_ADMIN_EXTRAS_BUNDLE": {
-                "com.hmdm.DEVICE_ID": "",
-                "com.hmdm.BASE_URL": self.base_url,
-                "com.hmdm.SERVER_PROJECT": qr_key,
-            }
-        }
-
-        return {
-            "config_id": config["id"],
-            "config_name": config["name"],
-            "config_description": config["description"],
-            "enrollment_url": enrollment_url,
-            "qr_content": enrollment_url,  # Voor simpele QR code
-            "provisioning_payload": provisioning_payload,
-            "instructions": [
-                "1. Factory reset het Android apparaat",
-                "2. Tik 6x op het welkomstscherm om QR setup te starten",
-                "3. Verbind met WiFi",
-                "4. Scan de QR code",
-                "5. Volg de installatie instructies",
-                "6. Het apparaat wordt automatisch geconfigureerd",
-            ],
-        }
-
-    def list_configurations(self) -> list:
-        """Lijst alle beschikbare configuraties"""
-        return [
-            {
-                "key": key,
-                "id": config["id"],
-                "name": config["name"],
-                "description": config["description"],
-            }
-            for key, config in CONFIGURATIONS.items()
-        ]
+    async def post_json(self, path: str, body: dict, **kwargs):
+        return self._json(await self.request("POST", path, json=body, **kwargs))
 
 
 # Singleton instance
@@ -0,0 +1,28 @@
+"""
+Kleine helpers voor HTTP caching (ETag / If-None-Match).
+"""
+from typing import Optional
+
+
+def make_etag(value: str) -> str:
+    """Maak een strong ETag van een (hex) hash"""
+    return f'"{value}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """
+    Check of een If-None-Match header de ETag bevat.
+    Weak vergelijking zoals RFC 9110 voorschrijft voor If-None-Match.
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
@@ -0,0 +1,238 @@
+"""
+Achtergrond jobs voor APK verwerking.
+
+Zware stappen (zoals de signing certificate checksum bepalen) draaien in een
+eigen thread pool, buiten het request pad. De status staat in de `apk_jobs`
+tabel zodat elke uvicorn worker een job kan opvragen. Resultaten worden per
+`file_hash` hergebruikt: dezelfde APK opnieuw uploaden verifieert niet
+opnieuw.
+
+Delta jobs maken na een upload de binaire delta's vanaf de vorige versies
+(zie apk_delta); hun status staat in de `apk_deltas` tabel.
+"""
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from .apk_channels import collect_garbage, set_version_checksum
+from .apk_delta import deltas_enabled, make_delta
+from .apk_signing import extract_cert_checksum
+from .db import SessionLocal
+from .models import ApkDelta, ApkJob, ApkVersion
+from .settings import APK_DELTA_SOURCES, JOB_WORKERS
+
+# Een pending/running job die ouder is dan dit wordt als verloren beschouwd
+# (bv. na een herstart van de worker) en niet meer hergebruikt.
+STALE_AFTER = timedelta(minutes=5)
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Get de singleton job executor"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="apk-job")
+    return _executor
+
+
+def shutdown():
+    """Stop de executor; lopende jobs mogen afronden"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+def job_to_dict(job: ApkJob) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "file_hash": job.file_hash,
+        "status": job.status,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def apply_cert_checksum(file_hash: str, checksum: str):
+    """Bewaar de checksum bij de versie en in de channels die (nog) naar die APK wijzen"""
+    db = SessionLocal()
+    try:
+        set_version_checksum(db, file_hash, checksum)
+    finally:
+        db.close()
+
+
+def _run_cert_job(job_id: str, apk_path: str):
+    db = SessionLocal()
+    try:
+        job = db.get(ApkJob, job_id)
+        job.status = "running"
+        db.commit()
+
+        try:
+            checksum = extract_cert_checksum(apk_path)
+        except Exception as e:
+            checksum = None
+            job.error = str(e)
+
+        if checksum:
+            job.status = "done"
+            job.result = checksum
+        else:
+            job.status = "failed"
+            job.error = job.error or "Geen signing certificaat gevonden. Voer handmatig de checksum in."
+        job.finished_at = datetime.utcnow()
+        db.commit()
+
+        if checksum:
+            apply_cert_checksum(job.file_hash, checksum)
+    except Exception as e:
+        print(f"APK job {job_id} mislukt: {e}")
+    finally:
+        db.close()
+
+
+def submit_cert_job(db, file_hash: str, apk_path: str) -> ApkJob:
+    """
+    Start (of hergebruik) een job die de cert checksum van een APK bepaalt.
+    Een eerder geslaagde of nog lopende job voor dezelfde file_hash wordt
+    teruggegeven in plaats van opnieuw te verifiëren.
+    """
+    existing = (
+        db.query(ApkJob)
+        .filter(ApkJob.kind == "cert", ApkJob.file_hash == file_hash)
+        .order_by(ApkJob.created_at.desc())
+        .all()
+    )
+    fresh = datetime.utcnow() - STALE_AFTER
+    for job in existing:
+        if job.status == "done":
+            return job
+        if job.status in ("pending", "running") and job.created_at >= fresh:
+            return job
+
+    job = ApkJob(id=uuid.uuid4().hex, kind="cert", file_hash=file_hash, status="pending")
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    get_executor().submit(_run_cert_job, job.id, apk_path)
+    return job
+
+
+def delta_to_dict(delta: ApkDelta) -> dict:
+    return {
+        "from_hash": delta.from_hash,
+        "to_hash": delta.to_hash,
+        "status": delta.status,
+        "size": delta.size,
+        "error": delta.error,
+        "created_at": delta.created_at.isoformat() if delta.created_at else None,
+        "finished_at": delta.finished_at.isoformat() if delta.finished_at else None,
+    }
+
+
+def _run_delta_job(from_hash: str, to_hash: str):
+    db = SessionLocal()
+    try:
+        delta = db.get(ApkDelta, (from_hash, to_hash))
+        if delta is None:
+            return  # versie is intussen door de GC opgeruimd
+        delta.status = "running"
+        db.commit()
+
+        try:
+            size = make_delta(from_hash, to_hash)
+            delta.status = "ready" if size is not None else "skipped"
+            delta.size = size
+            delta.error = None
+        except Exception as e:
+            delta.status = "failed"
+            delta.error = str(e)
+        delta.finished_at = datetime.utcnow()
+        db.commit()
+    except Exception as e:
+        print(f"APK delta {from_hash[:12]} -> {to_hash[:12]} mislukt: {e}")
+    finally:
+        db.close()
+
+
+def delta_sources(db, to_hash: str, previous: Optional[str] = None) -> List[str]:
+    """De versie waar het channel eerst naar wees plus de laatst geüploade versies"""
+    recent = (
+        db.query(ApkVersion.file_hash)
+        .filter(ApkVersion.file_hash != to_hash)
+        .order_by(ApkVersion.uploaded_at.desc())
+        .limit(APK_DELTA_SOURCES)
+        .all()
+    )
+    sources = [row.file_hash for row in recent]
+    if previous and previous != to_hash and previous not in sources:
+        sources = [previous] + sources[: APK_DELTA_SOURCES - 1]
+    return sources
+
+
+def submit_delta_jobs(db, to_hash: str, previous: Optional[str] = None) -> List[ApkDelta]:
+    """
+    Start delta jobs naar `to_hash` vanaf de vorige versies. Bestaande
+    delta's (ook overgeslagen) worden hergebruikt, alleen mislukte en
+    vastgelopen jobs worden opnieuw gestart.
+    """
+    if not deltas_enabled():
+        return []
+    fresh = datetime.utcnow() - STALE_AFTER
+    result = []
+    for from_hash in delta_sources(db, to_hash, previous):
+        delta = db.get(ApkDelta, (from_hash, to_hash))
+        if delta is not None:
+            stuck = delta.status in ("pending", "running") and delta.created_at < fresh
+            if delta.status != "failed" and not stuck:
+                result.append(delta)
+                continue
+            delta.status = "pending"
+            delta.error = None
+            delta.created_at = datetime.utcnow()
+        else:
+            delta = ApkDelta(from_hash=from_hash, to_hash=to_hash, status="pending")
+            db.add(delta)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Een andere worker was net eerder
+            db.rollback()
+            continue
+        get_executor().submit(_run_delta_job, from_hash, to_hash)
+        result.append(delta)
+    return result
+
+
+def list_deltas(db, to_hash: Optional[str] = None) -> List[dict]:
+    query = db.query(ApkDelta).order_by(ApkDelta.created_at.desc())
+    if to_hash:
+        query = query.filter(ApkDelta.to_hash == to_hash)
+    return [delta_to_dict(d) for d in query.all()]
+
+
+def _run_gc():
+    try:
+        result = collect_garbage()
+        if result["removed_versions"] or result["removed_files"]:
+            print(f"APK GC: {result}")
+    except Exception as e:
+        print(f"APK GC mislukt: {e}")
+
+
+def submit_gc():
+    """Ruim APK versies waar geen channel meer naar wijst op de achtergrond op"""
+    get_executor().submit(_run_gc)
+
+
+def get_job(db, job_id: str) -> Optional[ApkJob]:
+    return db.get(ApkJob, job_id)
@@ -0,0 +1,419 @@
+"""
+Retentie van de download log met gecomprimeerde archief segmenten.
+
+Regels in `download_logs` ouder dan DOWNLOAD_LOG_RETENTION_DAYS worden
+periodiek in batches (op id) naar een archief segment per maand verplaatst:
+`DOWNLOAD_LOG_ARCHIVE_DIR/<jjjj-mm>.jsonl.gz`, één JSON object per regel.
+Elke batch wordt als eigen gzip member achteraan toegevoegd; een segment
+wordt dus nooit herschreven en blijft met gewone tools (zcat) leesbaar.
+
+`index.json` houdt per segment het aantal regels, de gecommitte grootte en
+de min/max `downloaded_at` bij. Lezers lezen nooit verder dan de
+gecommitte grootte en slaan segmenten buiten hun periode over.
+
+Een batch verloopt zo:
+
+1. het index krijgt een `pending` blok met de nieuwe stand per segment
+2. de gzip members worden toegevoegd (fsync)
+3. de regels worden in één transactie uit de tabel verwijderd
+4. de nieuwe stand wordt in het index vastgelegd
+
+Crasht het proces halverwege, dan kijkt de volgende run of de eerste regel
+van de pending batch nog in de tabel staat: zo ja, dan worden de segmenten
+terug afgekapt op hun gecommitte grootte; zo nee, dan wordt de pending
+stand overgenomen. Er gaan geen regels verloren en er komen er geen dubbel
+in het archief.
+
+Na het verplaatsen geeft `PRAGMA incremental_vacuum` de vrijgekomen pagina's
+in kleine stappen terug aan het filesystem (vereist auto_vacuum=INCREMENTAL,
+zie migratie 8). De rollups blijven onaangeroerd, dus de statistieken
+blijven kloppen.
+
+Een file lock zorgt dat maar één worker tegelijk archiveert; exports
+houden een gedeelde lock vast zodat ze geen regels missen of dubbel zien.
+"""
+import asyncio
+import fcntl
+import gzip
+import io
+import json
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from starlette.concurrency import run_in_threadpool
+
+from .db import engine
+from .models import DownloadLog
+from .settings import (
+    DB_PATH,
+    DOWNLOAD_LOG_ARCHIVE_BATCH_SIZE,
+    DOWNLOAD_LOG_ARCHIVE_DIR,
+    DOWNLOAD_LOG_ARCHIVE_INTERVAL_SECONDS,
+    DOWNLOAD_LOG_RETENTION_DAYS,
+    SQLITE_VACUUM_PAGES,
+)
+
+INDEX_PATH = os.path.join(DOWNLOAD_LOG_ARCHIVE_DIR, "index.json")
+LOCK_PATH = DB_PATH + ".archive.lock"
+COLUMNS = (DownloadLog.id, DownloadLog.ip_address, DownloadLog.user_agent, DownloadLog.downloaded_at)
+DELETE_CHUNK = 500
+
+
+class ArchiveBusy(Exception):
+    """Er draait al een archivering of export (in deze of een andere worker)"""
+
+
+@dataclass
+class RetentionResult:
+    cutoff: Optional[str] = None
+    archived: int = 0
+    batches: int = 0
+    segments: List[str] = field(default_factory=list)
+    vacuumed_pages: int = 0
+    seconds: float = 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@contextmanager
+def archive_lock(shared: bool = False):
+    """Exclusief voor archiveren, gedeeld voor lezen; raises ArchiveBusy als bezet"""
+    os.makedirs(os.path.dirname(LOCK_PATH) or ".", exist_ok=True)
+    with open(LOCK_PATH, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ArchiveBusy()
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def segment_name(dt: datetime) -> str:
+    return dt.strftime("%Y-%m")
+
+
+def segment_path(name: str) -> str:
+    return os.path.join(DOWNLOAD_LOG_ARCHIVE_DIR, f"{name}.jsonl.gz")
+
+
+def load_index() -> dict:
+    try:
+        with open(INDEX_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"segments": {}, "pending": None}
+
+
+def _write_index(index: dict):
+    os.makedirs(DOWNLOAD_LOG_ARCHIVE_DIR, exist_ok=True)
+    tmp_path = INDEX_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, INDEX_PATH)
+
+
+def _truncate(name: str, size: int):
+    path = segment_path(name)
+    if not os.path.exists(path):
+        return
+    if size:
+        os.truncate(path, size)
+    else:
+        os.remove(path)
+
+
+def recover(index: dict) -> dict:
+    """Rond een door een crash onderbroken batch af (zie module docstring)"""
+    pending = index.get("pending")
+    if not pending:
+        return index
+    with engine.connect() as conn:
+        still_live = conn.execute(
+            select(DownloadLog.id).where(DownloadLog.id == pending["probe_id"])
+        ).first()
+    if still_live:
+        for name in pending["segments"]:
+            _truncate(name, index["segments"].get(name, {}).get("bytes", 0))
+    else:
+        index["segments"].update(pending["segments"])
+    index["pending"] = None
+    _write_index(index)
+    return index
+
+
+def _encode(row) -> dict:
+    return {
+        "id": row.id,
+        "ip_address": row.ip_address,
+        "user_agent": row.user_agent,
+        "downloaded_at": row.downloaded_at.isoformat(),
+    }
+
+
+def _append(name: str, member: bytes, committed: int):
+    path = segment_path(name)
+    with open(path, "ab") as f:
+        # Restant van een eerdere, afgebroken append eerst weghalen
+        if f.tell() != committed:
+            f.truncate(committed)
+            f.seek(committed)
+        f.write(member)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def archive_batch(index: dict, cutoff: datetime, batch_size: int) -> Tuple[int, List[str]]:
+    """Verplaats één batch regels ouder dan `cutoff`; returns (aantal, geraakte segmenten)"""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(*COLUMNS)
+            .where(DownloadLog.downloaded_at < cutoff)
+            .order_by(DownloadLog.id)
+            .limit(batch_size)
+        ).all()
+    if not rows:
+        return 0, []
+
+    by_segment: Dict[str, list] = {}
+    for row in rows:
+        by_segment.setdefault(segment_name(row.downloaded_at), []).append(row)
+
+    members: Dict[str, bytes] = {}
+    pending: Dict[str, dict] = {}
+    for name, seg_rows in by_segment.items():
+        lines = "".join(json.dumps(_encode(r), separators=(",", ":")) + "\n" for r in seg_rows)
+        members[name] = gzip.compress(lines.encode(), compresslevel=6, mtime=0)
+        current = index["segments"].get(name) or {"rows": 0, "bytes": 0, "min_time": None, "max_time": None}
+        times = [r.downloaded_at.isoformat() for r in seg_rows]
+        pending[name] = {
+            "rows": current["rows"] + len(seg_rows),
+            "bytes": current["bytes"] + len(members[name]),
+            "min_time": min([t for t in (current["min_time"], *times) if t]),
+            "max_time": max([t for t in (current["max_time"], *times) if t]),
+        }
+
+    index["pending"] = {"probe_id": rows[0].id, "segments": pending}
+    _write_index(index)
+    for name, member in members.items():
+        _append(name, member, index["segments"].get(name, {}).get("bytes", 0))
+
+    ids = [row.id for row in rows]
+    with engine.begin() as conn:
+        for i in range(0, len(ids), DELETE_CHUNK):
+            conn.execute(delete(DownloadLog).where(DownloadLog.id.in_(ids[i:i + DELETE_CHUNK])))
+
+    index["segments"].update(pending)
+    index["pending"] = None
+    _write_index(index)
+    return len(rows), list(pending)
+
+
+def incremental_vacuum(pages: int = SQLITE_VACUUM_PAGES) -> int:
+    """Geef vrije pagina's in stappen terug; returns het aantal vrijgegeven pagina's"""
+    if engine.dialect.name != "sqlite":
+        return 0
+    raw = engine.raw_connection()
+    try:
+        sqlite_conn = raw.driver_connection
+        if sqlite_conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        freed = 0
+        while True:
+            before = sqlite_conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not before:
+                return freed
+            # execute() stapt de pragma maar één keer (één pagina); executescript
+            # voert hem helemaal uit, als eigen korte schrijftransactie
+            sqlite_conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            after = sqlite_conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if after >= before:
+                return freed
+            freed += before - after
+    finally:
+        raw.close()
+
+
+def run_retention(
+    days: int = DOWNLOAD_LOG_RETENTION_DAYS,
+    batch_size: int = DOWNLOAD_LOG_ARCHIVE_BATCH_SIZE,
+    now: Optional[datetime] = None,
+) -> RetentionResult:
+    """Archiveer alle regels ouder dan `days` dagen (blokkerend; raises ArchiveBusy)"""
+    started = time.perf_counter()
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    result = RetentionResult(cutoff=cutoff.isoformat())
+    touched = set()
+    with archive_lock():
+        index = recover(load_index())
+        while True:
+            count, names = archive_batch(index, cutoff, batch_size)
+            if not count:
+                break
+            result.archived += count
+            result.batches += 1
+            touched.update(names)
+        if result.archived:
+            result.vacuumed_pages = incremental_vacuum()
+    result.segments = sorted(touched)
+    result.seconds = round(time.perf_counter() - started, 3)
+    return result
+
+
+class _Limited(io.RawIOBase):
+    """Leest een bestand tot een vaste grootte (de gecommitte stand van een segment)"""
+
+    def __init__(self, f, size: int):
+        self.f = f
+        self.remaining = size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.remaining <= 0:
+            return 0
+        view = memoryview(buffer)[: self.remaining]
+        n = self.f.readinto(view)
+        self.remaining -= n or 0
+        return n or 0
+
+
+def _segment_rows(name: str, size: int) -> Iterator[dict]:
+    with open(segment_path(name), "rb") as f:
+        reader = io.BufferedReader(_Limited(f, size), buffer_size=256 * 1024)
+        with gzip.GzipFile(fileobj=reader) as gz:
+            for line in gz:
+                yield json.loads(line)
+
+
+def _overlaps(meta: dict, start: Optional[str], end: Optional[str]) -> bool:
+    if not meta.get("rows"):
+        return False
+    if start and meta["max_time"] < start:
+        return False
+    if end and meta["min_time"] >= end:
+        return False
+    return True
+
+
+def iter_archived(start: Optional[datetime] = None, end: Optional[datetime] = None) -> Iterator[dict]:
+    """Gearchiveerde downloads in [start, end), alleen uit segmenten die de periode raken"""
+    start_s = start.isoformat() if start else None
+    end_s = end.isoformat() if end else None
+    index = load_index()
+    for name in sorted(index["segments"]):
+        meta = index["segments"][name]
+        if not _overlaps(meta, start_s, end_s):
+            continue
+        for row in _segment_rows(name, meta["bytes"]):
+            at = row["downloaded_at"]
+            if (start_s is None or at >= start_s) and (end_s is None or at < end_s):
+                yield row
+
+
+def iter_downloads(start: Optional[datetime] = None, end: Optional[datetime] = None) -> Iterator[dict]:
+    """
+    Stream alle downloads in [start, end): eerst het archief (per maand),
+    daarna de live tabel. Houdt de gedeelde archief lock vast zolang de
+    generator loopt; raises ArchiveBusy tijdens een archivering.
+    """
+    with archive_lock(shared=True):
+        if load_index().get("pending"):
+            raise ArchiveBusy()
+        yield from iter_archived(start, end)
+
+        query = select(*COLUMNS).order_by(DownloadLog.id)
+        if start is not None:
+            query = query.where(DownloadLog.downloaded_at >= start)
+        if end is not None:
+            query = query.where(DownloadLog.downloaded_at < end)
+        with engine.connect() as conn:
+            for row in conn.execution_options(yield_per=1000).execute(query):
+                yield _encode(row)
+
+
+def archive_status() -> dict:
+    index = load_index()
+    segments = [{"name": name, **meta} for name, meta in sorted(index["segments"].items())]
+    return {
+        "retention_days": DOWNLOAD_LOG_RETENTION_DAYS,
+        "archived_rows": sum(s["rows"] for s in segments),
+        "archived_bytes": sum(s["bytes"] for s in segments),
+        "segments": segments,
+    }
+
+
+class RetentionWorker:
+    """Periodieke archivering als asyncio taak binnen de app lifespan"""
+
+    def __init__(self, days: int, interval: float):
+        self.days = days
+        self.interval = interval
+        self.last_result: Optional[RetentionResult] = None
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.days > 0 and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> RetentionResult:
+        try:
+            result = await run_in_threadpool(run_retention, self.days)
+        except ArchiveBusy:
+            raise
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        self.last_result = result
+        self.last_error = None
+        return result
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except ArchiveBusy:
+                pass
+            except Exception as e:
+                print(f"Download log archivering mislukt: {e}")
+
+    def status(self) -> dict:
+        return {
+            "enabled": self._task is not None,
+            "interval_seconds": self.interval,
+            "last_result": self.last_result.to_dict() if self.last_result else None,
+            "last_error": self.last_error,
+            **archive_status(),
+        }
+
+
+_worker: Optional[RetentionWorker] = None
+
+
+def get_retention_worker() -> RetentionWorker:
+    """Get de singleton retentie worker"""
+    global _worker
+    if _worker is None:
+        _worker = RetentionWorker(DOWNLOAD_LOG_RETENTION_DAYS, DOWNLOAD_LOG_ARCHIVE_INTERVAL_SECONDS)
+    return _worker
@@ -0,0 +1,160 @@
+"""
+Gebufferde writer voor de download_logs tabel.
+
+Downloads worden in het geheugen in een wachtrij gezet en door een
+achtergrond thread in bulk weggeschreven (één transactie, executemany) zodra
+de batch vol is of het flush interval verstreken is. Zo kost een download
+geen eigen commit/fsync op het request pad en blijft SQLite vrij van
+"database is locked" fouten onder concurrency.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import insert
+
+from .db import engine
+from .models import DownloadLog
+from .stats import add_to_rollups
+from .settings import (
+    DOWNLOAD_LOG_BATCH_SIZE,
+    DOWNLOAD_LOG_FLUSH_SECONDS,
+    DOWNLOAD_LOG_MAX_QUEUE,
+)
+
+
+class DownloadLogSink:
+    """Thread-safe wachtrij + flusher voor DownloadLog regels"""
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.flush_errors = 0
+        self.last_flush_seconds = 0.0
+
+    def submit(self, ip_address: Optional[str], user_agent: Optional[str]) -> bool:
+        """Zet een download in de wachtrij; False als de wachtrij vol is"""
+        row = {
+            "ip_address": ip_address,
+            "user_agent": user_agent,
+            "downloaded_at": datetime.utcnow(),
+        }
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return False
+            self._queue.append(row)
+            self.enqueued += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="download-log-sink", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop de flusher en schrijf alles wat nog in de wachtrij staat weg"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        while True:
+            deadline = time.monotonic() + self.flush_interval
+            with self._cond:
+                while not self._stopping and len(self._queue) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+            self.flush()
+
+    def _drain(self) -> list:
+        with self._cond:
+            rows = list(self._queue)
+            self._queue.clear()
+        return rows
+
+    def _requeue(self, rows: list):
+        with self._cond:
+            room = self.max_queue - len(self._queue)
+            if room < len(rows):
+                self.dropped += len(rows) - max(room, 0)
+                rows = rows[:max(room, 0)]
+            self._queue.extendleft(reversed(rows))
+
+    def write_batch(self, conn, rows: list):
+        """Schrijf een batch (plus rollup tellers) binnen een bestaande transactie"""
+        conn.execute(insert(DownloadLog.__table__), rows)
+        add_to_rollups(conn, rows)
+
+    def flush(self) -> int:
+        """Schrijf de hele wachtrij weg in één transactie"""
+        with self._flush_lock:
+            rows = self._drain()
+            if not rows:
+                return 0
+            started = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    self.write_batch(conn, rows)
+            except Exception as e:
+                self.flush_errors += 1
+                print(f"Download log flush mislukt ({len(rows)} regels): {e}")
+                self._requeue(rows)
+                return 0
+            self.last_flush_seconds = time.perf_counter() - started
+            self.written += len(rows)
+            self.batches += 1
+            return len(rows)
+
+    def metrics(self) -> dict:
+        with self._cond:
+            depth = len(self._queue)
+        return {
+            "queue_depth": depth,
+            "max_queue": self.max_queue,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "flush_errors": self.flush_errors,
+            "last_flush_seconds": round(self.last_flush_seconds, 6),
+        }
+
+
+# Singleton instance
+_sink: Optional[DownloadLogSink] = None
+
+
+def get_download_log_sink() -> DownloadLogSink:
+    """Get de singleton download log sink"""
+    global _sink
+    if _sink is None:
+        _sink = DownloadLogSink(
+            DOWNLOAD_LOG_BATCH_SIZE, DOWNLOAD_LOG_FLUSH_SECONDS, DOWNLOAD_LOG_MAX_QUEUE
+        )
+    return _sink
@@ -1,26 +1,109 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request
+from fastapi import FastAPI, Depends, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import text, func
+from fastapi.responses import PlainTextResponse, RedirectResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, EmailStr
 from typing import Optional
-from datetime import datetime, timedelta
-import os
-import hashlib
-import base64
-import subprocess
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
 import json
+import os
 
-from .db import Base, engine, get_db
-from .settings import APP_NAME
-from .crud import create_user, authenticate
-from .auth import create_token, get_current_user
-from .models import User, DownloadLog
-
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title=APP_NAME)
+from .db import async_engine, engine, get_async_db
+from .migrations import run_migrations
+from .settings import (
+    APP_NAME,
+    APK_DIR,
+    APK_ACCEL_REDIRECT,
+    APK_MAX_BYTES,
+    BULK_MAX_DEVICES,
+    EVENTS_TICKET_TTL_SECONDS,
+    LOGIN_MAX_PER_IP,
+    LOGIN_IP_WINDOW_SECONDS,
+    LOGIN_MAX_PER_EMAIL,
+    LOGIN_EMAIL_WINDOW_SECONDS,
+)
+from .config_store import get_config_store
+from .provisioning import get_provisioning_cache
+from .http_cache import etag_matches, make_etag
+from .qr_render import FORMATS, get_qr_image, key_etag, render_key, validate_params
+from .headwind_client import HeadwindError, get_headwind_client
+from .config_catalog import get_config_catalog
+from .apk_store import ApkTooLarge, MultipartFile, UploadError, blob_path, blob_relpath, is_file_hash, save_stream
+from .apk_delta import delta_path, delta_relpath
+from .apk_channels import (
+    CHANNELS,
+    STABLE,
+    channel_for_config,
+    channel_pointers,
+    collect_garbage,
+    list_versions,
+    register_version,
+    set_channel,
+    set_version_checksum,
+)
+from .file_response import serve_file
+from .crud import (
+    create_user,
+    authenticate,
+    bulk_create_devices,
+    count_devices_by_status,
+    count_users,
+    delete_user,
+    list_devices_page,
+    set_user_role,
+)
+from .enrollment import EnrollmentError, parse_items, stream_qr_zip
+from .auth import create_stream_ticket, create_token, get_current_principal, get_stream_principal, Principal
+from .models import ApkVersion, DownloadLog
+from . import jobs
+from .log_sink import get_download_log_sink
+from .log_archive import ArchiveBusy, get_retention_worker, iter_downloads
+from . import stats
+from .ratelimit import SlidingWindowLimiter
+from .device_sync import SyncBusy, get_sync_worker
+from .events import get_event_bus
+from prometheus_client import CONTENT_TYPE_LATEST
+from .metrics import MetricsMiddleware, render as render_metrics
+from .profiler import get_profiler
+from .site_cache import UpstreamUnavailable, get_site_cache, site_cache_enabled
+
+download_log_sink = get_download_log_sink()
+SITE_CACHE = site_cache_enabled()
+login_ip_limiter = SlidingWindowLimiter(LOGIN_MAX_PER_IP, LOGIN_IP_WINDOW_SECONDS)
+login_email_limiter = SlidingWindowLimiter(LOGIN_MAX_PER_EMAIL, LOGIN_EMAIL_WINDOW_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    run_migrations(engine)
+    download_log_sink.start()
+    await get_headwind_client().open()
+    get_config_catalog().start()
+    get_sync_worker().start()
+    get_retention_worker().start()
+    if SITE_CACHE:
+        # Gespiegelde blobs hebben geen apk_versions rij; de site cache ruimt zelf op
+        await get_site_cache().open()
+    else:
+        jobs.submit_gc()
+    yield
+    get_event_bus().close()
+    await get_sync_worker().stop()
+    await get_config_catalog().stop()
+    await get_retention_worker().stop()
+    await get_headwind_client().close()
+    if SITE_CACHE:
+        await get_site_cache().close()
+    jobs.shutdown()
+    download_log_sink.stop()
+    await async_engine.dispose()
+
+
+app = FastAPI(title=APP_NAME, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,41 +112,23 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Buitenste middleware: meet ook de tijd in CORS
+app.add_middleware(MetricsMiddleware)
 
 # Directory voor APK opslag
-APK_DIR = "/app/data/apk"
-CONFIG_FILE = "/app/data/config.json"
 os.makedirs(APK_DIR, exist_ok=True)
+config_store = get_config_store()
+provisioning_cache = get_provisioning_cache()
 
-def load_config():
-    """Laad de huidige configuratie"""
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
-    return {
-        "apk_filename": None,
-        "apk_url": "https://portal.vastelijn.eu/api/public/apk",
-        "checksum": "Ytae8RlFLC6/iaNh93mGXLyB8tnayAGrgYSKnsXNbTQ=",
-        "package_name": "com.vastelijnphone",
-        "admin_receiver": "com.vastelijnphone/.admin.VasteLijnDeviceAdminReceiver",
-    }
 
+def load_config():
+    """Laad de huidige configuratie (kopie uit de in-memory cache)"""
+    return config_store.load()
 
-def to_url_safe_base64(checksum: str) -> str:
-    """
-    Converteer standaard Base64 naar URL-safe Base64 voor Android provisioning.
-    - Vervang + door -
-    - Vervang / door _
-    - Verwijder = padding
-    """
-    if not checksum:
-        return checksum
-    return checksum.replace("+", "-").replace("/", "_").rstrip("=")
 
 def save_config(config):
-    """Sla configuratie op"""
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(config, f, indent=2)
+    """Sla configuratie atomisch op"""
+    config_store.save(config)
 
 
 class RegisterIn(BaseModel):
@@ -83,6 +148,13 @@ class ConfigUpdate(BaseModel):
     admin_receiver: Optional[str] = None
 
 
+class RoleUpdate(BaseModel):
+    role: str
+
+
+ROLES = ("admin", "customer")
+
+
 # ============ PUBLIEKE ENDPOINTS (geen login nodig) ============
 
 @app.get("/api/health")
@@ -90,225 +162,763 @@ def health():
     return {"ok": True, "name": APP_NAME}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Prometheus metrics van deze worker. Staat buiten /api, dus nginx
+    proxiet hem niet naar buiten; scrape de API poort direct.
+    """
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+def _check_channel(channel: str) -> str:
+    if channel not in CHANNELS:
+        raise HTTPException(400, f"channel moet een van {', '.join(CHANNELS)} zijn")
+    return channel
+
+
+def _upstream_error(e: UpstreamUnavailable) -> HTTPException:
+    if e.status == 404:
+        return HTTPException(404, "Niet gevonden op de upstream portal")
+    return HTTPException(502, str(e))
+
+
+async def _provisioning(request: Request, channel: str):
+    """(data, body, etag) van de eigen config, of in site cache modus van de upstream"""
+    channel = _check_channel(channel)
+    if not SITE_CACHE:
+        return provisioning_cache.get(channel)
+    try:
+        return await get_site_cache().provisioning(channel, str(request.base_url))
+    except UpstreamUnavailable as e:
+        raise _upstream_error(e)
+
+
+async def _site_current_hash(channel: str) -> str:
+    try:
+        file_hash = await get_site_cache().current_hash(_check_channel(channel))
+    except UpstreamUnavailable as e:
+        raise _upstream_error(e)
+    if not file_hash:
+        raise HTTPException(404, "Geen APK beschikbaar")
+    return file_hash
+
+
+async def _site_blob(file_hash: str) -> str:
+    try:
+        return await get_site_cache().blob(file_hash)
+    except UpstreamUnavailable as e:
+        raise _upstream_error(e)
+
+
+def _require_portal_mode():
+    if SITE_CACHE:
+        raise HTTPException(409, "Dit is een site cache; beheer APK's op de upstream portal")
+
+
 @app.get("/api/public/provisioning")
-def get_provisioning():
+async def get_provisioning(request: Request, channel: str = STABLE):
     """
     Publiek endpoint - Haalt de QR provisioning data op.
     Dit is zichtbaar voor iedereen zonder login.
+    De body wordt per config versie gecached; pollers krijgen 304 via ETag.
     """
-    config = load_config()
-
-    if not config.get("apk_url") or not config.get("checksum"):
-        return {
-            "configured": False,
-            "message": "APK nog niet geconfigureerd. Admin moet eerst een APK uploaden.",
-            "qr_json": None,
-            "instructions": [],
-        }
-
-    # Converteer checksum naar URL-safe Base64 (Android vereiste)
-    url_safe_checksum = to_url_safe_base64(config["checksum"])
-
-    # Bouw de QR JSON payload (Variant B - direct APK download)
-    qr_payload = {
-        "android.app.extra.PROVISIONING_DEVICE_ADMIN_COMPONENT_NAME": config["admin_receiver"],
-        "android.app.extra.PROVISIONING_DEVICE_ADMIN_PACKAGE_DOWNLOAD_LOCATION": config["apk_url"],
-        "android.app.extra.PROVISIONING_DEVICE_ADMIN_SIGNATURE_CHECKSUM": url_safe_checksum,
-        "android.app.extra.PROVISIONING_SKIP_ENCRYPTION": True,
-        "android.app.extra.PROVISIONING_LEAVE_ALL_SYSTEM_APPS_ENABLED": True,
-    }
+    _, body, etag = await _provisioning(request, channel)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
 
-    instructions = [
-        "1. Factory reset het Android apparaat",
-        "2. Kies taal en verbind met WiFi",
-        "3. Tik 6x op het welkomstscherm om QR setup te starten",
-        "4. Scan de QR code hieronder",
-        "5. Wacht tot de app is gedownload en geinstalleerd",
-        "6. De VasteLijn app start automatisch in kiosk mode",
-    ]
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
 
-    return {
-        "configured": True,
-        "qr_json": json.dumps(qr_payload),
-        "qr_payload": qr_payload,
-        "apk_url": config["apk_url"],
-        "instructions": instructions,
-    }
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
-@app.get("/api/public/apk")
-def download_apk(request: Request, db: Session = Depends(get_db)):
-    """Publiek endpoint - Download de APK"""
-    config = load_config()
-    if not config.get("apk_filename"):
-        raise HTTPException(404, "Geen APK beschikbaar")
+def qr_response(request: Request, content: str, fmt: str, size: int, ec: str) -> Response:
+    """Geef een (gecachte) QR afbeelding terug, of 304 als de client hem al heeft"""
+    try:
+        fmt, size, ec = validate_params(fmt, size, ec)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    etag = key_etag(render_key(content, fmt, size, ec))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    data, _ = get_qr_image(content, fmt, size, ec)
+    return Response(content=data, media_type=FORMATS[fmt], headers=headers)
+
+
+@app.get("/api/public/provisioning/qr.{fmt}")
+async def get_provisioning_qr(request: Request, fmt: str, size: int = 300, ec: str = "m", channel: str = STABLE):
+    """Publiek endpoint - QR code afbeelding (png/svg) van de provisioning JSON"""
+    data, _, _ = await _provisioning(request, channel)
+    if not data["configured"]:
+        raise HTTPException(404, "APK nog niet geconfigureerd")
+    return await run_in_threadpool(qr_response, request, data["qr_json"], fmt, size, ec)
+
+
+async def log_download(ip_address: Optional[str], user_agent: str):
+    """Zet een download in de log wachtrij (draait na het versturen van de response)"""
+    download_log_sink.submit(ip_address, user_agent)
+    get_event_bus().publish(
+        "download",
+        {
+            "downloaded_at": datetime.utcnow().isoformat(),
+            "ip_address": ip_address,
+            "user_agent_family": stats.ua_family(user_agent),
+        },
+    )
 
-    apk_path = os.path.join(APK_DIR, config["apk_filename"])
-    if not os.path.exists(apk_path):
-        raise HTTPException(404, "APK bestand niet gevonden")
 
-    # Log de download
-    log_entry = DownloadLog(
-        ip_address=request.client.host if request.client else None,
-        user_agent=request.headers.get("user-agent", "")[:500],
+def _download_task(request: Request) -> BackgroundTask:
+    # Log de download pas nadat de response verstuurd is
+    return BackgroundTask(
+        log_download,
+        request.client.host if request.client else None,
+        request.headers.get("user-agent", "")[:500],
     )
-    db.add(log_entry)
-    db.commit()
 
-    return FileResponse(
+
+@app.api_route("/api/public/apk", methods=["GET", "HEAD"])
+async def download_apk(request: Request):
+    """
+    Publiek endpoint - Download de APK van het stable channel.
+    Ondersteunt Range/If-Range zodat afgebroken downloads hervat kunnen worden.
+    Wisselt de versie tijdens een download, dan faalt de If-Range check en
+    krijgt de client de nieuwe versie in zijn geheel.
+    """
+    if SITE_CACHE:
+        file_hash = await _site_current_hash(STABLE)
+        apk_path = await _site_blob(file_hash)
+        filename = f"vastelijn-{file_hash[:12]}.apk"
+    else:
+        _, config = config_store.snapshot()
+        file_hash = config.get("file_hash")
+        if not config.get("apk_filename") or not file_hash:
+            raise HTTPException(404, "Geen APK beschikbaar")
+        apk_path = blob_path(file_hash)
+        if not os.path.exists(apk_path):
+            raise HTTPException(404, "APK bestand niet gevonden")
+        filename = config["apk_filename"]
+
+    return serve_file(
+        request,
         apk_path,
+        filename=filename,
+        etag=make_etag(file_hash),
         media_type="application/vnd.android.package-archive",
-        filename=config["apk_filename"],
+        accel_path=APK_ACCEL_REDIRECT + blob_relpath(file_hash) if APK_ACCEL_REDIRECT else None,
+        extra_headers={"Cache-Control": "no-cache"},
+        background=_download_task(request),
+    )
+
+
+@app.api_route("/api/public/apk/{file_hash}.apk", methods=["GET", "HEAD"])
+async def download_apk_version(request: Request, file_hash: str):
+    """
+    Publiek endpoint - Download een vaste APK versie (op SHA-256).
+    De inhoud achter deze URL verandert nooit en mag dus eeuwig gecached worden.
+    """
+    if not is_file_hash(file_hash):
+        raise HTTPException(404, "Onbekende APK versie")
+    apk_path = blob_path(file_hash)
+    if SITE_CACHE:
+        apk_path = await _site_blob(file_hash)
+    elif not os.path.exists(apk_path):
+        raise HTTPException(404, "Onbekende APK versie")
+
+    _, config = config_store.snapshot()
+    filename = f"vastelijn-{file_hash[:12]}.apk"
+    for entry in (config.get("channels") or {}).values():
+        if entry and entry.get("file_hash") == file_hash and entry.get("filename"):
+            filename = entry["filename"]
+            break
+
+    return serve_file(
+        request,
+        apk_path,
+        filename=filename,
+        etag=make_etag(file_hash),
+        media_type="application/vnd.android.package-archive",
+        accel_path=APK_ACCEL_REDIRECT + blob_relpath(file_hash) if APK_ACCEL_REDIRECT else None,
+        extra_headers={"Cache-Control": "public, max-age=31536000, immutable"},
+        background=_download_task(request),
+    )
+
+
+@app.api_route("/api/public/apk/delta/{from_hash}", methods=["GET", "HEAD"])
+async def download_apk_delta(request: Request, from_hash: str, channel: str = STABLE):
+    """
+    Publiek endpoint - Binaire delta van de APK die het device heeft
+    (`from_hash`) naar de huidige APK van het channel. Is er (nog) geen
+    delta, dan volgt een 303 naar de volledige APK. `X-Apk-Hash` is de
+    SHA-256 van de APK die de client na het toepassen moet hebben.
+    """
+    if SITE_CACHE:
+        # Delta's worden niet gespiegeld; op het LAN is de volledige APK goedkoop
+        to_hash = await _site_current_hash(channel)
+        return RedirectResponse(f"/api/public/apk/{to_hash}.apk", status_code=303, headers={"X-Apk-Hash": to_hash})
+
+    _, config = config_store.snapshot()
+    to_hash = channel_pointers(config).get(_check_channel(channel))
+    if not to_hash or not os.path.exists(blob_path(to_hash)):
+        raise HTTPException(404, "Geen APK beschikbaar")
+
+    headers = {"X-Apk-Hash": to_hash, "Cache-Control": "no-cache"}
+    if from_hash == to_hash:
+        return Response(status_code=204, headers=headers)
+    path = delta_path(from_hash, to_hash) if is_file_hash(from_hash) else None
+    if path is None or not os.path.exists(path):
+        return RedirectResponse(f"/api/public/apk/{to_hash}.apk", status_code=303, headers=headers)
+
+    return serve_file(
+        request,
+        path,
+        filename=f"vastelijn-{from_hash[:12]}-{to_hash[:12]}.zst",
+        etag=make_etag(f"{from_hash}_{to_hash}"),
+        media_type="application/zstd",
+        accel_path=APK_ACCEL_REDIRECT + delta_relpath(from_hash, to_hash) if APK_ACCEL_REDIRECT else None,
+        extra_headers={**headers, "X-Delta-From": from_hash},
+        background=_download_task(request),
     )
 
 
 # ============ AUTH ENDPOINTS ============
 
 @app.post("/api/auth/register")
-def register(body: RegisterIn, db: Session = Depends(get_db)):
-    existing = db.execute(text("SELECT COUNT(*) FROM users")).scalar()
-    if existing and existing > 0:
+async def register(body: RegisterIn, db: AsyncSession = Depends(get_async_db)):
+    existing = await count_users(db)
+    if existing > 0:
         raise HTTPException(403, "Registratie is uitgeschakeld. Admin account bestaat al.")
-    u = create_user(db, body.email, body.password, role="admin")
+    u = await create_user(db, body.email, body.password, role="admin")
     return {"id": u.id, "email": u.email, "role": u.role}
 
 
+def _throttle(limiter: SlidingWindowLimiter, key: str):
+    retry_after = limiter.hit(key)
+    if retry_after is not None:
+        raise HTTPException(
+            429,
+            "Te veel login pogingen, probeer het later opnieuw",
+            headers={"Retry-After": str(int(retry_after) + 1)},
+        )
+
+
 @app.post("/api/auth/login")
-def login(body: LoginIn, db: Session = Depends(get_db)):
-    u = authenticate(db, body.email, body.password)
+async def login(body: LoginIn, request: Request, db: AsyncSession = Depends(get_async_db)):
+    _throttle(login_ip_limiter, request.client.host if request.client else "unknown")
+    _throttle(login_email_limiter, body.email.lower().strip())
+    u = await authenticate(db, body.email, body.password)
     if not u:
         raise HTTPException(401, "Onjuiste login")
     return {"access_token": create_token(u.id, u.role), "token_type": "bearer"}
 
 
 @app.get("/api/me")
-def me(user: User = Depends(get_current_user)):
+async def me(user: Principal = Depends(get_current_principal)):
     return {"id": user.id, "email": user.email, "role": user.role}
 
 
 # ============ ADMIN ENDPOINTS (login vereist) ============
 
+def _require_admin(user: Principal, user_id: int):
+    """Alleen admins beheren users, en niet zichzelf (geen buitensluiten)"""
+    if user.role != "admin":
+        raise HTTPException(403, "Alleen voor admins")
+    if user.id == user_id:
+        raise HTTPException(400, "Je kunt je eigen account niet wijzigen of verwijderen")
+
+
+@app.put("/api/admin/users/{user_id}/role")
+async def update_user_role(
+    user_id: int,
+    body: RoleUpdate,
+    user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Admin: Wijzig de rol van een user; zijn tokens zien de nieuwe rol direct"""
+    _require_admin(user, user_id)
+    if body.role not in ROLES:
+        raise HTTPException(400, f"Onbekende rol (kies uit {', '.join(ROLES)})")
+    u = await set_user_role(db, user_id, body.role)
+    if u is None:
+        raise HTTPException(404, "User niet gevonden")
+    return {"id": u.id, "email": u.email, "role": u.role}
+
+
+@app.delete("/api/admin/users/{user_id}")
+async def remove_user(
+    user_id: int,
+    user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Admin: Verwijder een user en zijn devices; zijn tokens werken direct niet meer"""
+    _require_admin(user, user_id)
+    if not await delete_user(db, user_id):
+        raise HTTPException(404, "User niet gevonden")
+    return {"ok": True}
+
+
 @app.get("/api/admin/config")
-def get_config(user: User = Depends(get_current_user)):
+def get_config(user: Principal = Depends(get_current_principal)):
     """Admin: Haal huidige configuratie op"""
     return load_config()
 
 
 @app.put("/api/admin/config")
-def update_config(body: ConfigUpdate, user: User = Depends(get_current_user)):
+def update_config(body: ConfigUpdate, user: Principal = Depends(get_current_principal)):
     """Admin: Update configuratie (APK URL, checksum, etc)"""
-    config = load_config()
-
-    if body.apk_url is not None:
-        config["apk_url"] = body.apk_url
-    if body.checksum is not None:
-        config["checksum"] = body.checksum
-    if body.package_name is not None:
-        config["package_name"] = body.package_name
-    if body.admin_receiver is not None:
-        config["admin_receiver"] = body.admin_receiver
-
-    save_config(config)
+    with config_store.edit() as config:
+        if body.apk_url is not None:
+            config["apk_url"] = body.apk_url
+        if body.checksum is not None:
+            config["checksum"] = body.checksum
+        if body.package_name is not None:
+            config["package_name"] = body.package_name
+        if body.admin_receiver is not None:
+            config["admin_receiver"] = body.admin_receiver
+
+    provisioning_cache.invalidate()
     return config
 
 
-@app.post("/api/admin/upload-apk")
-async def upload_apk(file: UploadFile = File(...), user: User = Depends(get_current_user)):
-    """
-    Admin: Upload een nieuwe APK.
-    De checksum wordt automatisch berekend als apksigner beschikbaar is.
-    """
-    if not file.filename.endswith(".apk"):
-        raise HTTPException(400, "Bestand moet een .apk zijn")
-
-    # Sla APK op
-    apk_path = os.path.join(APK_DIR, file.filename)
-    content = await file.read()
-
-    with open(apk_path, "wb") as f:
-        f.write(content)
+# Ruimte voor de multipart boundaries en headers naast de APK zelf
+MULTIPART_OVERHEAD = 64 * 1024
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
 
-    # Bereken SHA-256 van het bestand (voor verificatie)
-    file_hash = hashlib.sha256(content).hexdigest()
 
-    # Probeer signing certificate checksum te berekenen met apksigner
-    cert_checksum = None
+@app.post("/api/admin/upload-apk", openapi_extra=UPLOAD_OPENAPI)
+async def upload_apk(
+    request: Request,
+    channel: Optional[str] = STABLE,
+    user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Admin: Upload een nieuwe APK (multipart veld `file`) en zet hem op een
+    channel (standaard stable; `?channel=` leeg = alleen uploaden). Identieke
+    uploads worden niet opnieuw opgeslagen. De checksum en de delta's vanaf
+    de vorige versies worden op de achtergrond berekend; volg de job via
+    /api/admin/jobs/{id}.
+    """
+    _require_portal_mode()
+    if channel:
+        _check_channel(channel)
+    # Te grote uploads weigeren voordat er één byte gelezen is
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > APK_MAX_BYTES + MULTIPART_OVERHEAD:
+        raise HTTPException(413, f"APK is groter dan {APK_MAX_BYTES // (1024 * 1024)} MB")
+
+    # Parse de multipart body vanaf de socket en stream de APK (met SHA-256)
+    # direct naar de blob store, zonder tussenkopie in een temp bestand
     try:
-        result = subprocess.run(
-            ["apksigner", "verify", "--print-certs", apk_path],
-            capture_output=True,
-            text=True,
-            timeout=30,
-        )
-        if result.returncode == 0:
-            # Zoek SHA-256 digest in output
-            for line in result.stdout.split("\n"):
-                if "SHA-256 digest" in line:
-                    hex_hash = line.split(":")[-1].strip()
-                    # Converteer hex naar bytes en dan naar base64
-                    hash_bytes = bytes.fromhex(hex_hash)
-                    cert_checksum = base64.b64encode(hash_bytes).decode()
-                    break
-    except Exception as e:
-        print(f"apksigner niet beschikbaar of fout: {e}")
-
-    # Update config
-    config = load_config()
-    config["apk_filename"] = file.filename
-    config["file_hash"] = file_hash
+        upload = MultipartFile(request.stream(), request.headers.get("content-type", ""))
+        filename = os.path.basename(await upload.open())
+        if not filename.endswith(".apk"):
+            raise HTTPException(400, "Bestand moet een .apk zijn")
+        _, file_hash, size, created = await save_stream(upload.chunks())
+    except UploadError as e:
+        raise HTTPException(400, str(e))
+    except ApkTooLarge as e:
+        raise HTTPException(413, str(e))
+
+    # De sync helpers draaien via run_sync op de async sessie (geen thread)
+    version = await db.run_sync(register_version, file_hash, filename, size)
+    previous = None
+    if channel:
+        previous = channel_pointers(config_store.snapshot()[1]).get(channel)
+        await db.run_sync(set_channel, channel, version)
+
+    # Signing certificate checksum bepalen in een achtergrond job
+    job = await db.run_sync(jobs.submit_cert_job, file_hash, blob_path(file_hash))
+    cert_checksum = job.result if job.status == "done" else None
     if cert_checksum:
-        config["checksum"] = cert_checksum
-    save_config(config)
+        await db.run_sync(set_version_checksum, file_hash, cert_checksum)
+    deltas = await db.run_sync(jobs.submit_delta_jobs, file_hash, previous)
+    jobs.submit_gc()
 
     return {
-        "filename": file.filename,
+        "filename": version.filename,
         "file_hash": file_hash,
+        "size": size,
+        "deduplicated": not created,
+        "channel": channel or None,
         "cert_checksum": cert_checksum,
-        "message": "APK geupload" + (" en checksum berekend" if cert_checksum else ". Voer handmatig de checksum in."),
+        "job_id": job.id,
+        "job_status": job.status,
+        "deltas": [jobs.delta_to_dict(d) for d in deltas],
+        "message": "APK geupload" + (" en checksum berekend" if cert_checksum else ". Checksum wordt op de achtergrond berekend."),
     }
 
 
+@app.get("/api/admin/jobs/{job_id}")
+async def get_job(job_id: str, user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_async_db)):
+    """Admin: Status van een achtergrond job (bv. checksum berekening)"""
+    job = await db.run_sync(jobs.get_job, job_id)
+    if not job:
+        raise HTTPException(404, "Job niet gevonden")
+    return jobs.job_to_dict(job)
+
+
 @app.delete("/api/admin/apk")
-def delete_apk(user: User = Depends(get_current_user)):
-    """Admin: Verwijder de huidige APK"""
-    config = load_config()
+async def delete_apk(user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_async_db)):
+    """
+    Admin: Haal de APK van het stable channel af. Het bestand zelf wordt
+    door de GC verwijderd zodra er geen channel meer naar wijst.
+    """
+    _require_portal_mode()
+    await db.run_sync(set_channel, STABLE, None)
+    jobs.submit_gc()
+    return {"message": "APK verwijderd"}
 
-    if config.get("apk_filename"):
-        apk_path = os.path.join(APK_DIR, config["apk_filename"])
-        if os.path.exists(apk_path):
-            os.remove(apk_path)
 
-    config["apk_filename"] = None
-    config["file_hash"] = None
-    save_config(config)
+@app.get("/api/admin/apk/versions")
+async def get_apk_versions(user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_async_db)):
+    """Admin: Alle APK versies in de store, met de channels die ernaar wijzen"""
+    return {"channels": list(CHANNELS), "versions": await db.run_sync(list_versions)}
+
+
+class ChannelUpdate(BaseModel):
+    file_hash: Optional[str] = None
+
+
+@app.put("/api/admin/apk/channels/{channel}")
+async def update_apk_channel(
+    channel: str,
+    body: ChannelUpdate,
+    user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Admin: Laat een channel naar een (eerder geüploade) versie wijzen, of leeg met null"""
+    _require_portal_mode()
+    _check_channel(channel)
+    version = None
+    if body.file_hash:
+        version = await db.get(ApkVersion, body.file_hash)
+        if version is None or not os.path.exists(blob_path(version.file_hash)):
+            raise HTTPException(404, "Onbekende APK versie")
+    previous = channel_pointers(config_store.snapshot()[1]).get(channel)
+    pointers = await db.run_sync(set_channel, channel, version)
+    if version is not None:
+        await db.run_sync(jobs.submit_delta_jobs, version.file_hash, previous)
+    jobs.submit_gc()
+    return {"channels": pointers}
+
+
+@app.get("/api/admin/apk/deltas")
+async def get_apk_deltas(
+    to_hash: Optional[str] = None,
+    user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Admin: Delta's tussen APK versies met hun status (`?to_hash=` voor één versie)"""
+    return {"deltas": await db.run_sync(jobs.list_deltas, to_hash)}
+
+
+@app.post("/api/admin/apk/gc")
+def run_apk_gc(user: Principal = Depends(get_current_principal)):
+    """Admin: Ruim nu APK versies op waar al langer dan de grace periode geen channel naar wijst"""
+    _require_portal_mode()
+    return collect_garbage()
+
+
+@app.get("/api/admin/site-cache")
+def site_cache_status(user: Principal = Depends(get_current_principal)):
+    """Admin: Status van de site cache (upstream, gespiegelde versies, hits/fetches)"""
+    return get_site_cache().metrics() if SITE_CACHE else {"enabled": False}
+
+
+@app.get("/api/admin/configurations")
+def list_configurations(user: Principal = Depends(get_current_principal)):
+    """Admin: Lijst van Headwind configuraties (met het bijbehorende APK channel)"""
+    return [
+        {**c, "apk_channel": channel_for_config(c["key"])}
+        for c in get_config_catalog().list_configurations()
+    ]
+
+
+@app.get("/api/admin/configurations/catalog")
+def configuration_catalog_status(user: Principal = Depends(get_current_principal)):
+    """Admin: Bron, leeftijd en laatste fout van de configuratie catalogus (deze worker)"""
+    return get_config_catalog().status()
+
+
+@app.post("/api/admin/configurations/refresh")
+async def refresh_configurations(user: Principal = Depends(get_current_principal)):
+    """Admin: Haal de configuraties nu bij Headwind op (bijv. na het toevoegen van een policy)"""
+    catalog = get_config_catalog()
+    if not catalog.enabled:
+        raise HTTPException(400, "Geen Headwind ingesteld (HEADWIND_BASE_URL)")
+    try:
+        await catalog.refresh()
+    except HeadwindError as e:
+        raise HTTPException(502, str(e))
+    return catalog.status()
+
+
+@app.get("/api/admin/configurations/{config_key}/qr.{fmt}")
+async def get_configuration_qr(
+    request: Request,
+    config_key: str,
+    fmt: str,
+    size: int = 300,
+    ec: str = "m",
+    user: Principal = Depends(get_current_principal),
+):
+    """Admin: QR code afbeelding (png/svg) voor een Headwind configuratie"""
+    try:
+        payload = get_config_catalog().qr_payload(config_key)
+    except ValueError as e:
+        raise HTTPException(404, str(e))
+    return qr_response(request, payload["qr_content"], fmt, size, ec)
+
+
+@app.get("/api/admin/download-log/metrics")
+def download_log_metrics(user: Principal = Depends(get_current_principal)):
+    """Admin: Wachtrij diepte en gedropte events van de download log writer"""
+    return download_log_sink.metrics()
+
+
+@app.get("/api/admin/download-log/archive")
+def download_log_archive_status(user: Principal = Depends(get_current_principal)):
+    """Admin: Retentie instellingen, archief segmenten en de laatste archivering"""
+    return get_retention_worker().status()
 
-    return {"message": "APK verwijderd"}
+
+@app.post("/api/admin/download-log/archive")
+async def run_download_log_archive(user: Principal = Depends(get_current_principal)):
+    """Admin: Verplaats nu de download log regels ouder dan de retentie naar het archief"""
+    worker = get_retention_worker()
+    if worker.days <= 0:
+        raise HTTPException(400, "Retentie staat uit (DOWNLOAD_LOG_RETENTION_DAYS=0)")
+    try:
+        result = await worker.run_once()
+    except ArchiveBusy:
+        raise HTTPException(409, "Er loopt al een archivering of export")
+    return result.to_dict()
+
+
+def _utc_naive(dt: datetime) -> datetime:
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo is not None else dt
+
+
+def _ndjson(first: Optional[dict], rows):
+    if first is not None:
+        yield json.dumps(first) + "\n"
+        for row in rows:
+            yield json.dumps(row) + "\n"
+
+
+@app.get("/api/admin/download-log/export")
+async def export_download_log(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user: Principal = Depends(get_current_principal),
+):
+    """
+    Admin: Alle downloads in [start, end) als NDJSON, uit het archief en de
+    live tabel samen (gestreamd, ook over periodes van jaren).
+    """
+    rows = iter_downloads(_utc_naive(start) if start else None, _utc_naive(end) if end else None)
+    try:
+        first = await run_in_threadpool(next, rows, None)
+    except ArchiveBusy:
+        raise HTTPException(409, "Er loopt een archivering, probeer het zo opnieuw", headers={"Retry-After": "10"})
+    return StreamingResponse(
+        _ndjson(first, rows),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="download-log.ndjson"'},
+    )
+
+
+DEVICE_STATUSES = ("pending", "enrolled", "online", "offline")
+
+
+@app.get("/api/admin/devices")
+async def list_devices(
+    status: Optional[str] = None,
+    config_key: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Admin: Devices van de ingelogde gebruiker, nieuwste eerst, per pagina.
+    Geef `next_cursor` uit het antwoord mee als `cursor` voor de volgende pagina.
+    """
+    if status is not None and status not in DEVICE_STATUSES:
+        raise HTTPException(400, f"status moet een van {', '.join(DEVICE_STATUSES)} zijn")
+    before_id = None
+    if cursor:
+        try:
+            before_id = int(cursor)
+        except ValueError:
+            raise HTTPException(400, "Ongeldige cursor")
+
+    rows, next_before_id = await list_devices_page(
+        db, user.id, limit=limit, before_id=before_id, status=status, config_key=config_key
+    )
+    for row in rows:
+        row["created_at"] = row["created_at"].isoformat() if row["created_at"] else None
+    return {
+        "devices": rows,
+        "next_cursor": str(next_before_id) if next_before_id is not None else None,
+    }
+
+
+@app.get("/api/admin/devices/status-counts")
+async def device_status_counts(user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_async_db)):
+    """Admin: Aantal devices per status"""
+    counts = await count_devices_by_status(db, user.id)
+    by_status = {status: counts.get(status, 0) for status in DEVICE_STATUSES}
+    return {"total": sum(counts.values()), "by_status": by_status}
+
+
+@app.get("/api/admin/devices/sync")
+def device_sync_status(user: Principal = Depends(get_current_principal)):
+    """Admin: Status van de Headwind device sync (deze worker)"""
+    return get_sync_worker().status()
+
+
+@app.post("/api/admin/devices/sync")
+async def run_device_sync(full: bool = False, user: Principal = Depends(get_current_principal)):
+    """Admin: Start direct een Headwind device sync (`?full=true` voor alle pagina's)"""
+    try:
+        result = await get_sync_worker().run_once(full=full)
+    except SyncBusy as e:
+        raise HTTPException(409, str(e))
+    except HeadwindError as e:
+        raise HTTPException(502, f"Headwind sync mislukt: {e}")
+    return result.to_dict()
+
+
+@app.post("/api/admin/devices/bulk")
+async def bulk_enroll_devices(
+    request: Request,
+    user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Admin: Meld een batch devices aan (CSV met `label,config_key` of JSON)
+    en krijg een ZIP terug met manifest.csv en een QR code per device.
+    """
+    body = await request.body()
+    try:
+        items = parse_items(body, request.headers.get("content-type", ""))
+    except EnrollmentError as e:
+        raise HTTPException(422, str(e))
+    if not items:
+        raise HTTPException(422, "Geen devices opgegeven")
+    if len(items) > BULK_MAX_DEVICES:
+        raise HTTPException(413, f"Maximaal {BULK_MAX_DEVICES} devices per batch")
+
+    devices = await bulk_create_devices(db, user.id, items)
+
+    filename = f"devices-{datetime.utcnow():%Y%m%d-%H%M%S}.zip"
+    return StreamingResponse(
+        stream_qr_zip(devices),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Device-Count": str(len(devices)),
+        },
+    )
+
+
+@app.post("/api/admin/events/ticket")
+def events_ticket(user: Principal = Depends(get_current_principal)):
+    """Admin: Kortlevend ticket voor `/api/admin/events?ticket=` (EventSource)"""
+    return {"ticket": create_stream_ticket(user.id), "expires_in": EVENTS_TICKET_TTL_SECONDS}
+
+
+@app.get("/api/admin/events")
+async def admin_events(
+    request: Request,
+    last_event_id: Optional[str] = Query(None),
+    user: Principal = Depends(get_stream_principal),
+):
+    """
+    Admin: Server-Sent Events stream met downloads (`download`) en device
+    status wijzigingen (`device_status`). Bij `resync` moet de client de
+    stats opnieuw ophalen. Authenticatie met een ticket als `?ticket=`
+    (EventSource); `?last_event_id=` hervat na een nieuwe verbinding.
+    """
+    bus = get_event_bus()
+    if bus.full():
+        raise HTTPException(503, "Te veel open event streams", headers={"Retry-After": "10"})
+    try:
+        last_event_id = int(request.headers.get("last-event-id") or last_event_id or "")
+    except ValueError:
+        last_event_id = None
+    return StreamingResponse(
+        bus.stream(user.id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/admin/events/metrics")
+def event_metrics(user: Principal = Depends(get_current_principal)):
+    """Admin: Aantal open streams en gedropte events"""
+    return get_event_bus().metrics()
+
+
+@app.post("/api/admin/profile")
+async def profile_process(
+    seconds: float = Query(5, gt=0, le=60),
+    user: Principal = Depends(get_current_principal),
+):
+    """
+    Admin: Sample alle threads van deze worker gedurende `seconds` en geef
+    de stacks terug in folded formaat (flamegraph.pl / speedscope).
+    """
+    profile = await run_in_threadpool(get_profiler().profile_process, seconds)
+    if profile is None:
+        raise HTTPException(409, "Er loopt al een profiler")
+    return PlainTextResponse(profile.folded, headers={"X-Profile-Id": profile.id})
+
+
+@app.get("/api/admin/profiles")
+def list_profiles(user: Principal = Depends(get_current_principal)):
+    """Admin: Bewaarde profielen van trage requests (`X-Profile` header)"""
+    return get_profiler().list()
+
+
+@app.get("/api/admin/profiles/{profile_id}")
+def get_profile(profile_id: str, user: Principal = Depends(get_current_principal)):
+    """Admin: Eén profiel in folded formaat"""
+    profile = get_profiler().get(profile_id)
+    if profile is None:
+        raise HTTPException(404, "Profiel niet gevonden")
+    return PlainTextResponse(profile.folded)
 
 
 @app.get("/api/admin/stats")
-def get_stats(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Admin: Haal download statistieken op"""
-    now = datetime.utcnow()
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    week_start = today_start - timedelta(days=7)
-
-    total_downloads = db.query(func.count(DownloadLog.id)).scalar() or 0
-    today_downloads = db.query(func.count(DownloadLog.id)).filter(
-        DownloadLog.downloaded_at >= today_start
-    ).scalar() or 0
-    week_downloads = db.query(func.count(DownloadLog.id)).filter(
-        DownloadLog.downloaded_at >= week_start
-    ).scalar() or 0
-
-    # Laatste 10 downloads
-    recent = db.query(DownloadLog).order_by(
-        DownloadLog.downloaded_at.desc()
-    ).limit(10).all()
+async def get_stats(user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_async_db)):
+    """Admin: Haal download statistieken op (uit de rollups)"""
+    summary = await db.run_sync(stats.summary)
+
+    # Laatste 10 downloads (via index op downloaded_at)
+    recent = (await db.execute(
+        select(DownloadLog).order_by(DownloadLog.downloaded_at.desc()).limit(10)
+    )).scalars().all()
 
     return {
-        "total_downloads": total_downloads,
-        "today_downloads": today_downloads,
-        "week_downloads": week_downloads,
+        **summary,
         "recent_downloads": [
             {
                 "id": r.id,
@@ -318,3 +928,34 @@ def get_stats(user: User = Depends(get_current_user), db: Session = Depends(get_
             for r in recent
         ],
     }
+
+
+@app.get("/api/admin/stats/downloads")
+async def get_download_stats(
+    start: datetime,
+    end: Optional[datetime] = None,
+    interval: Optional[str] = None,
+    user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Admin: Downloads in een willekeurige periode (UTC, op uur-resolutie),
+    uitgesplitst per user-agent familie. Met `interval=hour|day` ook een tijdreeks.
+    """
+    start = _utc_naive(start)
+    end = _utc_naive(end or datetime.utcnow())
+    if end <= start:
+        raise HTTPException(400, "end moet na start liggen")
+    if interval not in (None, stats.HOUR, stats.DAY):
+        raise HTTPException(400, "interval moet 'hour' of 'day' zijn")
+
+    by_family = await db.run_sync(stats.count_range, start, end)
+    result = {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "downloads": sum(by_family.values()),
+        "by_user_agent": dict(by_family.most_common()),
+    }
+    if interval:
+        result["series"] = await db.run_sync(stats.series, interval, start, end)
+    return result
@@ -0,0 +1,185 @@
+"""
+Prometheus metrics voor de API (exposed op `/metrics`).
+
+- `MetricsMiddleware` (pure ASGI, dus streaming en background tasks blijven
+  werken) meet per route template de latency tot de laatste body chunk,
+  het aantal requests per status en het aantal lopende requests.
+- SQLAlchemy events op `engine` meten de duur van elke query en hoe lang
+  een connectie uit de pool geleend is. De query tijd wordt ook per
+  request opgeteld (contextvar; threadpool threads erven de context).
+- De Headwind client, de APK file response en de threadpool rapporteren
+  via de functies en metrics hieronder.
+
+Let op: de metrics zijn per uvicorn worker (geen multiprocess mode).
+"""
+import time
+from contextvars import ContextVar
+from typing import List, Optional
+
+import anyio.to_thread
+from prometheus_client import Counter, Gauge, Histogram, disable_created_metrics, generate_latest
+from sqlalchemy import event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .profiler import get_profiler
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+UNMATCHED = "<unmatched>"
+
+# De `_created` series verdubbelen de output zonder dat we ze gebruiken
+disable_created_metrics()
+
+HTTP_REQUESTS = Counter(
+    "portal_http_requests_total", "HTTP requests per route en status", ["method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "portal_http_request_duration_seconds",
+    "Tijd tot de laatste body chunk per route",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge("portal_http_requests_in_flight", "Lopende HTTP requests")
+REQUEST_DB_TIME = Histogram(
+    "portal_http_request_db_seconds",
+    "Opgetelde query tijd per request",
+    ["route"],
+    buckets=DB_BUCKETS,
+)
+
+DB_QUERY_TIME = Histogram(
+    "portal_db_query_duration_seconds", "Duur van SQL statements", ["operation"], buckets=DB_BUCKETS
+)
+DB_CONNECTION_HOLD = Histogram(
+    "portal_db_connection_hold_seconds",
+    "Hoe lang een connectie uit de pool geleend is (sessie duur)",
+    buckets=DB_BUCKETS,
+)
+DB_CONNECTIONS_IN_USE = Gauge("portal_db_connections_in_use", "Uitgeleende pool connecties")
+
+HEADWIND_LATENCY = Histogram(
+    "portal_headwind_request_duration_seconds",
+    "Latency van Headwind API calls (per poging)",
+    ["method", "path", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+APK_BYTES_SENT = Counter(
+    "portal_apk_bytes_sent_total", "Door de API verstuurde APK bytes", ["mode"]
+)
+
+THREADPOOL_BUSY = Gauge("portal_threadpool_busy_threads", "Bezette threads in de Starlette threadpool")
+THREADPOOL_SIZE = Gauge("portal_threadpool_size", "Maximaal aantal threads in de Starlette threadpool")
+THREADPOOL_WAITING = Gauge(
+    "portal_threadpool_waiting_tasks", "Sync endpoints/calls die op een vrije thread wachten"
+)
+
+# Per request opgetelde query tijd; een lijst zodat threads hem kunnen ophogen
+_request_db_time: ContextVar[Optional[List[float]]] = ContextVar("request_db_time", default=None)
+
+
+def route_label(scope: Scope) -> str:
+    """Route template (bv. `/api/public/apk/{file_hash}.apk`) i.p.v. het echte pad"""
+    route = scope.get("route")
+    return getattr(route, "path_format", None) or getattr(route, "path", None) or UNMATCHED
+
+
+def sql_operation(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return word if word in ("SELECT", "INSERT", "UPDATE", "DELETE", "PRAGMA", "BEGIN", "COMMIT") else "OTHER"
+
+
+def instrument_engine(engine):
+    """Hang query- en pool timing aan een SQLAlchemy engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        DB_QUERY_TIME.labels(sql_operation(statement)).observe(elapsed)
+        total = _request_db_time.get()
+        if total is not None:
+            total[0] += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_conn, record, proxy):
+        record.info["checkout_at"] = time.perf_counter()
+        DB_CONNECTIONS_IN_USE.inc()
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_conn, record):
+        started = record.info.pop("checkout_at", None)
+        if started is not None:
+            DB_CONNECTION_HOLD.observe(time.perf_counter() - started)
+            DB_CONNECTIONS_IN_USE.dec()
+
+
+def observe_headwind(method: str, path: str, status: str, seconds: float):
+    HEADWIND_LATENCY.labels(method, path, status).observe(seconds)
+
+
+def update_threadpool_gauges():
+    """Lees de anyio thread limiter uit; moet vanuit de event loop"""
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    THREADPOOL_BUSY.set(limiter.borrowed_tokens)
+    THREADPOOL_SIZE.set(limiter.total_tokens)
+    THREADPOOL_WAITING.set(limiter.statistics().tasks_waiting)
+
+
+def render() -> bytes:
+    update_threadpool_gauges()
+    return generate_latest()
+
+
+class MetricsMiddleware:
+    """Latency, status en in-flight per route; start op verzoek de profiler"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = ["500"]
+        finished: List[float] = []
+        db_time = [0.0]
+        token = _request_db_time.set(db_time)
+        profile = get_profiler().start_request(scope)
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+                if profile is not None:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile.id.encode())]
+            elif not message.get("more_body", False) and not finished:
+                finished.append(time.perf_counter())
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            _request_db_time.reset(token)
+            route = route_label(scope)
+            elapsed = (finished[0] if finished else time.perf_counter()) - started
+            HTTP_REQUESTS.labels(method, route, status[0]).inc()
+            HTTP_LATENCY.labels(method, route).observe(elapsed)
+            REQUEST_DB_TIME.labels(route).observe(db_time[0])
+            if profile is not None:
+                get_profiler().finish_request(profile, f"{method} {route}", elapsed, db_time[0])
+
@@ -0,0 +1,180 @@
+"""
+Versioned database migraties.
+
+Vervangt de `create_all` bij import. Elke migratie draait één keer, in een
+eigen transactie, en wordt vastgelegd in de `schema_migrations` tabel. Een
+file lock zorgt ervoor dat maar één uvicorn worker tegelijk migreert; de
+andere workers wachten en zien daarna dat alles al gedaan is.
+
+Nieuwe migraties achteraan MIGRATIONS toevoegen, nooit bestaande wijzigen.
+"""
+import fcntl
+import os
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+
+from .db import Base
+from .apk_store import blob_path, import_file
+from .config_store import get_config_store
+from .models import User, Device, DownloadLog, ApkJob, DownloadRollup, SyncState, ApkVersion, ApkDelta
+from .settings import APK_DIR, DB_PATH
+from . import stats
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def create_index(conn, name: str, table: str, columns: str):
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def has_column(conn, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+
+def add_column(conn, table: str, column: str, ddl_type: str):
+    """ALTER TABLE ADD COLUMN, tenzij de kolom al bestaat (nieuwe database)"""
+    if not has_column(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def _m001_baseline(conn):
+    Base.metadata.create_all(
+        conn,
+        tables=[
+            User.__table__,
+            Device.__table__,
+            DownloadLog.__table__,
+            ApkJob.__table__,
+            DownloadRollup.__table__,
+        ],
+    )
+
+
+def _m002_indexes(conn):
+    create_index(conn, "ix_devices_owner_id", "devices", "owner_id")
+    create_index(conn, "ix_download_logs_downloaded_at", "download_logs", "downloaded_at")
+    create_index(conn, "ix_apk_jobs_file_hash", "apk_jobs", "file_hash")
+
+
+def _m003_rollup_backfill(conn):
+    has_rollups = conn.execute(select(DownloadRollup.count).limit(1)).first()
+    has_logs = conn.execute(select(DownloadLog.id).limit(1)).first()
+    if has_logs and not has_rollups:
+        stats.rebuild_rollups(conn)
+
+
+def _m004_device_list_indexes(conn):
+    create_index(conn, "ix_devices_owner_status", "devices", "owner_id, status")
+    create_index(conn, "ix_devices_owner_config_key", "devices", "owner_id, config_key")
+
+
+def _m005_headwind_sync(conn):
+    add_column(conn, "devices", "headwind_number", "VARCHAR")
+    add_column(conn, "devices", "last_seen", "DATETIME")
+    create_index(conn, "ix_devices_headwind_number", "devices", "headwind_number")
+    create_index(conn, "ix_devices_status_last_seen", "devices", "status, last_seen")
+    Base.metadata.create_all(conn, tables=[SyncState.__table__])
+
+
+def _m006_apk_blob_store(conn):
+    """Zet de bestaande APK (APK_DIR/<naam>) over naar de blob store als stable"""
+    Base.metadata.create_all(conn, tables=[ApkVersion.__table__])
+    store = get_config_store()
+    _, config = store.snapshot()
+    filename = config.get("apk_filename")
+    if not filename:
+        return
+    legacy = os.path.join(APK_DIR, filename)
+    if os.path.isfile(legacy):
+        uploaded_at = datetime.utcfromtimestamp(os.path.getmtime(legacy))
+        _, file_hash, size = import_file(legacy)
+    elif config.get("file_hash") and os.path.exists(blob_path(config["file_hash"])):
+        # Eerdere poging is halverwege gestopt
+        file_hash = config["file_hash"]
+        size = os.path.getsize(blob_path(file_hash))
+        uploaded_at = datetime.utcnow()
+    else:
+        return
+
+    exists = conn.execute(select(ApkVersion.file_hash).where(ApkVersion.file_hash == file_hash)).first()
+    if not exists:
+        conn.execute(
+            ApkVersion.__table__.insert().values(
+                file_hash=file_hash,
+                filename=filename,
+                size=size,
+                cert_checksum=config.get("checksum"),
+                uploaded_at=uploaded_at,
+                refcount=1,
+            )
+        )
+    with store.edit() as config:
+        config["file_hash"] = file_hash
+        config.setdefault("channels", {})["stable"] = {
+            "file_hash": file_hash,
+            "filename": filename,
+            "checksum": config.get("checksum"),
+        }
+
+
+def _m007_apk_deltas(conn):
+    Base.metadata.create_all(conn, tables=[ApkDelta.__table__])
+
+
+def _m008_incremental_vacuum(conn):
+    """
+    Zet auto_vacuum op INCREMENTAL zodat de retentie vrije pagina's terug kan
+    geven. Werkt pas na een volledige VACUUM (eenmalig, kan even duren); die
+    moet het eerste statement zijn, buiten een transactie.
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+
+
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "baseline tabellen", _m001_baseline),
+    (2, "indexen op devices.owner_id en download_logs.downloaded_at", _m002_indexes),
+    (3, "download rollups vullen vanuit bestaande log", _m003_rollup_backfill),
+    (4, "indexen voor device lijst per status en config_key", _m004_device_list_indexes),
+    (5, "headwind koppeling op devices en sync_state tabel", _m005_headwind_sync),
+    (6, "apk_versions tabel en bestaande APK naar de blob store", _m006_apk_blob_store),
+    (7, "apk_deltas tabel", _m007_apk_deltas),
+    (8, "auto_vacuum=INCREMENTAL voor de download log retentie", _m008_incremental_vacuum),
+]
+
+
+def run_migrations(engine):
+    """Voer alle nog niet toegepaste migraties uit (idempotent, multi-worker veilig)"""
+    lock_path = DB_PATH + ".migrate.lock"
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            _meta.create_all(engine)
+            with engine.connect() as conn:
+                applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+            for version, name, migrate in MIGRATIONS:
+                if version in applied:
+                    continue
+                with engine.begin() as conn:
+                    migrate(conn)
+                    conn.execute(
+                        schema_migrations.insert().values(
+                            version=version, name=name, applied_at=datetime.utcnow()
+                        )
+                    )
+                print(f"Migratie {version} toegepast: {name}")
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
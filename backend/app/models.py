@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .db import Base
@@ -18,20 +18,84 @@ class User(Base):
 class Device(Base):
     __tablename__ = "devices"
     id = Column(Integer, primary_key=True, index=True)
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     label = Column(String, nullable=False)
     mode = Column(String, nullable=False)  # kiosk|fallback (legacy)
     config_key = Column(String, default="vastelijn_alleen")  # vastelijn_alleen|vastelijn_telegram|vastelijn_whatsapp
     status = Column(String, default="pending")  # pending|enrolled|online|offline
     qr_payload = Column(Text, default="")  # Headwind QR enrollment URL
     created_at = Column(DateTime, default=datetime.utcnow)
+    headwind_number = Column(String, nullable=True)  # device nummer in Headwind (koppeling voor sync)
+    last_seen = Column(DateTime, nullable=True)  # laatste lastUpdate volgens Headwind
 
     owner = relationship("User", back_populates="devices")
 
+    # SQLite zet de rowid (= id) achteraan elke index, dus deze indexen
+    # dekken ook `ORDER BY id` en keyset paginatie binnen een filter.
+    __table_args__ = (
+        Index("ix_devices_owner_status", "owner_id", "status"),
+        Index("ix_devices_owner_config_key", "owner_id", "config_key"),
+        Index("ix_devices_headwind_number", "headwind_number"),
+        Index("ix_devices_status_last_seen", "status", "last_seen"),
+    )
+
 
 class DownloadLog(Base):
     __tablename__ = "download_logs"
     id = Column(Integer, primary_key=True, index=True)
     ip_address = Column(String, nullable=True)
     user_agent = Column(String, nullable=True)
-    downloaded_at = Column(DateTime, default=datetime.utcnow)
+    downloaded_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class DownloadRollup(Base):
+    """Download tellers per uur/dag (en totaal), bijgewerkt bij elke log flush"""
+    __tablename__ = "download_rollups"
+    granularity = Column(String, primary_key=True)  # hour|day|total
+    bucket_start = Column(DateTime, primary_key=True)  # total: 1970-01-01
+    user_agent_family = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class ApkJob(Base):
+    __tablename__ = "apk_jobs"
+    id = Column(String, primary_key=True)  # uuid hex
+    kind = Column(String, nullable=False, default="cert")  # cert
+    file_hash = Column(String, index=True, nullable=False)
+    status = Column(String, default="pending")  # pending|running|done|failed
+    result = Column(Text, nullable=True)  # cert: Base64 checksum
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class SyncState(Base):
+    """Watermarks en tijdstempels van achtergrond syncs (key/value)"""
+    __tablename__ = "sync_state"
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ApkVersion(Base):
+    """Een geüploade APK in de blob store (APK_DIR/blobs/..., op file_hash)"""
+    __tablename__ = "apk_versions"
+    file_hash = Column(String, primary_key=True)  # sha256 hex, tevens blob naam
+    filename = Column(String, nullable=False)  # originele bestandsnaam
+    size = Column(Integer, nullable=False)
+    cert_checksum = Column(Text, nullable=True)  # Base64, zodra de cert job klaar is
+    uploaded_at = Column(DateTime, default=datetime.utcnow)
+    refcount = Column(Integer, nullable=False, default=0)  # aantal channels dat ernaar wijst
+    unreferenced_at = Column(DateTime, nullable=True)  # sinds wanneer refcount 0 is (GC)
+
+
+class ApkDelta(Base):
+    """Binaire delta tussen twee APK versies (APK_DIR/deltas/..., zie apk_delta)"""
+    __tablename__ = "apk_deltas"
+    from_hash = Column(String, primary_key=True)
+    to_hash = Column(String, primary_key=True, index=True)
+    status = Column(String, default="pending")  # pending|running|ready|skipped|failed
+    size = Column(Integer, nullable=True)  # bytes, zodra ready
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
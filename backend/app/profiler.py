@@ -0,0 +1,197 @@
+"""
+Sampling profiler voor trage requests, met flame graph output.
+
+Een sampler thread leest elke PROFILE_INTERVAL_MS de stacks van alle
+threads uit (`sys._current_frames`) en telt ze in het "folded" formaat
+(`frame;frame;frame count`), dat direct door flamegraph.pl, speedscope
+of inferno ingelezen kan worden. Threads die alleen staan te wachten
+(idle workers, de selector van de event loop) worden overgeslagen.
+
+Twee manieren om te profilen:
+
+- Per request: stuur `X-Profile: <PROFILE_TOKEN>` mee. Is het request
+  trager dan PROFILE_SLOW_SECONDS, dan wordt het profiel bewaard en staat
+  het id in de `X-Profile-Id` response header.
+- Het hele proces gedurende N seconden via de admin API.
+
+Er draait maximaal één sampler tegelijk; de profiler is uit zolang
+PROFILE_TOKEN leeg is (de admin API werkt altijd).
+"""
+import hmac
+import itertools
+import sys
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Deque, List, Optional
+
+from .settings import PROFILE_INTERVAL_MS, PROFILE_KEEP, PROFILE_SLOW_SECONDS, PROFILE_TOKEN
+
+MAX_DEPTH = 128
+# Leaf frames waarin een thread alleen staat te wachten. Met uvloop draait
+# de event loop in C; een idle loop eindigt dan in asyncio/runners.py.
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("runners.py", "run"),
+    ("profiler.py", "profile_process"),
+}
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    for marker in ("/site-packages/", "/app/", "/lib/python"):
+        if marker in filename:
+            filename = filename.split(marker, 1)[1]
+            break
+    return f"{code.co_name} ({filename}:{frame.f_lineno})"
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (code.co_filename.rsplit("/", 1)[-1], code.co_name) in IDLE_LEAVES
+
+
+class Sampler:
+    """Telt gefolde stacks van alle threads (behalve zichzelf) tot stop()"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> "Sampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> "Sampler":
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own or _is_idle(frame):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+@dataclass
+class Profile:
+    id: str
+    started_at: datetime = field(default_factory=datetime.utcnow)
+    label: str = ""
+    duration: float = 0.0
+    db_seconds: float = 0.0
+    samples: int = 0
+    folded: str = ""
+    sampler: Optional[Sampler] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "started_at": self.started_at.isoformat(),
+            "label": self.label,
+            "duration": round(self.duration, 4),
+            "db_seconds": round(self.db_seconds, 4),
+            "samples": self.samples,
+        }
+
+
+class Profiler:
+    def __init__(self, token: str, interval: float, slow_seconds: float, keep: int):
+        self.token = token
+        self.interval = interval
+        self.slow_seconds = slow_seconds
+        self._busy = threading.Lock()
+        self._ids = itertools.count(1)
+        self._profiles: Deque[Profile] = deque(maxlen=keep)
+
+    def _new_id(self) -> str:
+        return f"{int(time.time())}-{next(self._ids)}"
+
+    def requested(self, scope) -> bool:
+        if not self.token:
+            return False
+        for name, value in scope.get("headers", ()):
+            if name == b"x-profile":
+                return hmac.compare_digest(value, self.token.encode())
+        return False
+
+    def start_request(self, scope) -> Optional[Profile]:
+        """Start een sampler als het request erom vraagt en er geen andere loopt"""
+        if not self.requested(scope) or not self._busy.acquire(blocking=False):
+            return None
+        return Profile(id=self._new_id(), sampler=Sampler(self.interval).start())
+
+    def finish_request(self, profile: Profile, label: str, duration: float, db_seconds: float):
+        sampler = profile.sampler.stop()
+        profile.sampler = None
+        self._busy.release()
+        if duration < self.slow_seconds:
+            return
+        profile.label = label
+        profile.duration = duration
+        profile.db_seconds = db_seconds
+        profile.samples = sampler.samples
+        profile.folded = sampler.folded()
+        self._profiles.append(profile)
+
+    def profile_process(self, seconds: float) -> Optional[Profile]:
+        """Sample het hele proces (blokkerend; draai in een thread). None als er al een sampler loopt"""
+        if not self._busy.acquire(blocking=False):
+            return None
+        try:
+            profile = Profile(id=self._new_id(), label="process")
+            started = time.perf_counter()
+            sampler = Sampler(self.interval).start()
+            time.sleep(seconds)
+            sampler.stop()
+            profile.duration = time.perf_counter() - started
+            profile.samples = sampler.samples
+            profile.folded = sampler.folded()
+        finally:
+            self._busy.release()
+        self._profiles.append(profile)
+        return profile
+
+    def list(self) -> List[dict]:
+        return [p.to_dict() for p in reversed(self._profiles)]
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        for profile in self._profiles:
+            if profile.id == profile_id:
+                return profile
+        return None
+
+
+_profiler: Optional[Profiler] = None
+
+
+def get_profiler() -> Profiler:
+    """Get de singleton profiler"""
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(PROFILE_TOKEN, PROFILE_INTERVAL_MS / 1000, PROFILE_SLOW_SECONDS, PROFILE_KEEP)
+    return _profiler
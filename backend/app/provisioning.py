@@ -0,0 +1,139 @@
+"""
+Provisioning payload voor /api/public/provisioning.
+
+De complete response body (inclusief de geserialiseerde `qr_json`) wordt
+één keer per config versie (en channel) opgebouwd en als bytes met ETag
+bewaard.
+
+Wijst `apk_url` naar de eigen portal (`.../api/public/apk`), dan krijgt de
+QR code de onveranderlijke URL van de exacte versie
+(`.../api/public/apk/<file_hash>.apk`). Een device dat midden in de
+provisioning zit blijft zo dezelfde APK downloaden, ook als het channel
+intussen naar een nieuwe versie wijst.
+"""
+import hashlib
+import json
+import threading
+from typing import Dict, Optional, Tuple
+
+from .config_store import get_config_store
+from .http_cache import make_etag
+
+INSTRUCTIONS = [
+    "1. Factory reset het Android apparaat",
+    "2. Kies taal en verbind met WiFi",
+    "3. Tik 6x op het welkomstscherm om QR setup te starten",
+    "4. Scan de QR code hieronder",
+    "5. Wacht tot de app is gedownload en geinstalleerd",
+    "6. De VasteLijn app start automatisch in kiosk mode",
+]
+
+
+def to_url_safe_base64(checksum: str) -> str:
+    """
+    Converteer standaard Base64 naar URL-safe Base64 voor Android provisioning.
+    - Vervang + door -
+    - Vervang / door _
+    - Verwijder = padding
+    """
+    if not checksum:
+        return checksum
+    return checksum.replace("+", "-").replace("/", "_").rstrip("=")
+
+
+PORTAL_APK_PATH = "/api/public/apk"
+DOWNLOAD_LOCATION = "android.app.extra.PROVISIONING_DEVICE_ADMIN_PACKAGE_DOWNLOAD_LOCATION"
+
+NOT_CONFIGURED = {
+    "configured": False,
+    "message": "APK nog niet geconfigureerd. Admin moet eerst een APK uploaden.",
+    "qr_json": None,
+    "instructions": [],
+}
+
+
+def versioned_apk_url(apk_url: str, file_hash: Optional[str]) -> Optional[str]:
+    """
+    Vervang de generieke portal download URL door die van een vaste versie.
+    Returns None voor een externe `apk_url` (die kent geen versies).
+    """
+    base = (apk_url or "").rstrip("/")
+    if file_hash and base.endswith(PORTAL_APK_PATH):
+        return f"{base}/{file_hash}.apk"
+    return None
+
+
+def build_provisioning(config: dict, channel: str = "stable") -> dict:
+    """Bouw de provisioning response op basis van de config (en een channel)"""
+    if channel == "stable":
+        file_hash = config.get("file_hash")
+        checksum = config.get("checksum")
+        apk_url = versioned_apk_url(config.get("apk_url"), file_hash) or config.get("apk_url")
+    else:
+        # Andere channels kunnen alleen via de eigen portal geserveerd worden
+        entry = (config.get("channels") or {}).get(channel) or {}
+        file_hash = entry.get("file_hash")
+        checksum = entry.get("checksum") or config.get("checksum")
+        apk_url = versioned_apk_url(config.get("apk_url"), file_hash)
+
+    if not apk_url or not checksum:
+        return dict(NOT_CONFIGURED)
+
+    # Converteer checksum naar URL-safe Base64 (Android vereiste)
+    url_safe_checksum = to_url_safe_base64(checksum)
+
+    # Bouw de QR JSON payload (Variant B - direct APK download)
+    qr_payload = {
+        "android.app.extra.PROVISIONING_DEVICE_ADMIN_COMPONENT_NAME": config["admin_receiver"],
+        DOWNLOAD_LOCATION: apk_url,
+        "android.app.extra.PROVISIONING_DEVICE_ADMIN_SIGNATURE_CHECKSUM": url_safe_checksum,
+        "android.app.extra.PROVISIONING_SKIP_ENCRYPTION": True,
+        "android.app.extra.PROVISIONING_LEAVE_ALL_SYSTEM_APPS_ENABLED": True,
+    }
+
+    return {
+        "configured": True,
+        "qr_json": json.dumps(qr_payload),
+        "qr_payload": qr_payload,
+        "apk_url": apk_url,
+        "channel": channel,
+        "instructions": INSTRUCTIONS,
+    }
+
+
+class ProvisioningCache:
+    """Houdt de geserialiseerde provisioning body per config versie en channel vast"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[str, dict, bytes, str]] = {}
+
+    def get(self, channel: str = "stable") -> Tuple[dict, bytes, str]:
+        """Geef (data, body, etag) voor de huidige config versie"""
+        version, config = get_config_store().snapshot()
+        entry = self._entries.get(channel)
+        if entry is not None and entry[0] == version:
+            return entry[1], entry[2], entry[3]
+
+        data = build_provisioning(config, channel)
+        body = json.dumps(data, separators=(",", ":")).encode()
+        etag = make_etag(hashlib.sha256(body).hexdigest())
+        with self._lock:
+            self._entries[channel] = (version, data, body, etag)
+        return data, body, etag
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Singleton instance
+_cache: Optional[ProvisioningCache] = None
+
+
+def get_provisioning_cache() -> ProvisioningCache:
+    """Get de singleton provisioning cache"""
+    global _cache
+    if _cache is None:
+        _cache = ProvisioningCache()
+    return _cache
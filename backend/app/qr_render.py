@@ -0,0 +1,132 @@
+"""
+Server-side QR code rendering (PNG/SVG) met een LRU render cache.
+
+Afbeeldingen worden gecached op (payload hash, formaat, grootte, error
+correction) binnen een byte budget. De ETag wordt uit diezelfde sleutel
+afgeleid, zodat een 304 antwoord zonder opnieuw renderen kan.
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import segno
+
+from .http_cache import make_etag
+
+FORMATS = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+ERROR_LEVELS = ("l", "m", "q", "h")
+MIN_SIZE = 64
+MAX_SIZE = 2048
+BORDER = 4
+
+# Verhoog bij wijzigingen in de rendering zodat oude ETags ongeldig worden
+RENDER_VERSION = "1"
+
+
+class QRRenderCache:
+    """Thread-safe LRU cache van gerenderde QR afbeeldingen met byte budget"""
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: tuple, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def validate_params(fmt: str, size: int, ec: str) -> Tuple[str, int, str]:
+    """Valideer formaat, grootte en error correction level"""
+    fmt = fmt.lower()
+    ec = ec.lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Onbekend formaat: {fmt}")
+    if ec not in ERROR_LEVELS:
+        raise ValueError(f"Onbekend error correction level: {ec}")
+    if not MIN_SIZE <= size <= MAX_SIZE:
+        raise ValueError(f"Grootte moet tussen {MIN_SIZE} en {MAX_SIZE} pixels liggen")
+    return fmt, size, ec
+
+
+def render_key(content: str, fmt: str, size: int, ec: str) -> tuple:
+    payload_hash = hashlib.sha256(content.encode()).hexdigest()
+    return (payload_hash, fmt, size, ec)
+
+
+def key_etag(key: tuple) -> str:
+    raw = "|".join((RENDER_VERSION,) + tuple(str(k) for k in key))
+    return make_etag(hashlib.sha256(raw.encode()).hexdigest())
+
+
+def render_qr(content: str, fmt: str, size: int, ec: str) -> bytes:
+    """Render een QR code; `size` is de gewenste breedte in pixels"""
+    qr = segno.make(content, error=ec, micro=False, boost_error=False)
+    width, _ = qr.symbol_size(border=BORDER)
+    scale = max(1, size // width)
+    out = io.BytesIO()
+    if fmt == "svg":
+        qr.save(out, kind="svg", scale=scale, border=BORDER, xmldecl=False)
+    else:
+        qr.save(out, kind="png", scale=scale, border=BORDER)
+    return out.getvalue()
+
+
+# Singleton instance
+_cache: Optional[QRRenderCache] = None
+
+
+def get_qr_cache() -> QRRenderCache:
+    """Get de singleton QR render cache"""
+    global _cache
+    if _cache is None:
+        _cache = QRRenderCache()
+    return _cache
+
+
+def get_qr_image(content: str, fmt: str, size: int, ec: str) -> Tuple[bytes, str]:
+    """Geef (image bytes, etag), uit de cache of vers gerenderd"""
+    key = render_key(content, fmt, size, ec)
+    cache = get_qr_cache()
+    data = cache.get(key)
+    if data is None:
+        data = render_qr(content, fmt, size, ec)
+        cache.put(key, data)
+    return data, key_etag(key)
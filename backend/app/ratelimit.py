@@ -0,0 +1,49 @@
+"""
+In-memory sliding window rate limiter (per worker).
+"""
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+
+class SlidingWindowLimiter:
+    """Maximaal `limit` hits per `window` seconden per sleutel"""
+
+    def __init__(self, limit: int, window: float, max_keys: int = 100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._hits: Dict[str, Deque[float]] = {}
+
+    def hit(self, key: str) -> Optional[float]:
+        """
+        Registreer een poging. Returns None als het mag, anders het aantal
+        seconden tot er weer een poging vrijkomt.
+        """
+        now = time.monotonic()
+        cutoff = now - self.window
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                if len(self._hits) >= self.max_keys:
+                    self._sweep(cutoff)
+                hits = self._hits[key] = deque()
+            while hits and hits[0] <= cutoff:
+                hits.popleft()
+            if len(hits) >= self.limit:
+                return max(hits[0] - cutoff, 0.0)
+            hits.append(now)
+            return None
+
+    def _sweep(self, cutoff: float):
+        for key in [k for k, h in self._hits.items() if not h or h[-1] <= cutoff]:
+            del self._hits[key]
+        # Nog steeds vol: gooi de oudste sleutels weg
+        while len(self._hits) >= self.max_keys:
+            del self._hits[next(iter(self._hits))]
+
+    def reset(self, key: str):
+        with self._lock:
+            self._hits.pop(key, None)
@@ -4,7 +4,114 @@ APP_NAME = os.getenv("APP_NAME", "VasteLijn Portal")
 JWT_SECRET = os.getenv("JWT_SECRET", "CHANGE_ME")
 JWT_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", "10080"))
 DB_PATH = os.getenv("DB_PATH", "/app/data/portal.db")
+# sqlite:///... of postgresql://...; de async driver (aiosqlite/asyncpg) wordt
+# er automatisch bij gekozen. Lock bestanden blijven naast DB_PATH staan.
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+APK_DIR = os.getenv("APK_DIR", os.path.join(DATA_DIR, "apk"))
+CONFIG_FILE = os.getenv("CONFIG_FILE", os.path.join(DATA_DIR, "config.json"))
+
+# "portal" (standaard) of "site_cache": een site cache op het LAN van een
+# klant spiegelt provisioning en APK's van de portal op UPSTREAM_URL
+PORTAL_MODE = os.getenv("PORTAL_MODE", "portal")
+UPSTREAM_URL = os.getenv("UPSTREAM_URL", "")
+# Basis URL waarop devices de site cache bereiken (leeg = host uit het request)
+SITE_PUBLIC_URL = os.getenv("SITE_PUBLIC_URL", "")
+SITE_CACHE_REVALIDATE_SECONDS = float(os.getenv("SITE_CACHE_REVALIDATE_SECONDS", "30"))
+SITE_CACHE_KEEP_VERSIONS = int(os.getenv("SITE_CACHE_KEEP_VERSIONS", "3"))
+SITE_CACHE_TIMEOUT_SECONDS = float(os.getenv("SITE_CACHE_TIMEOUT_SECONDS", "30"))
 
 HEADWIND_BASE_URL = os.getenv("HEADWIND_BASE_URL", "")
 HEADWIND_ADMIN_USER = os.getenv("HEADWIND_ADMIN_USER", "")
 HEADWIND_ADMIN_PASS = os.getenv("HEADWIND_ADMIN_PASS", "")
+
+APK_MAX_BYTES = int(os.getenv("APK_MAX_BYTES", str(200 * 1024 * 1024)))
+# Hoe lang een APK versie waar geen channel meer naar wijst nog bewaard
+# wordt (lopende en hervatte downloads)
+APK_GC_GRACE_SECONDS = float(os.getenv("APK_GC_GRACE_SECONDS", str(24 * 3600)))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Binaire delta's (zstd) naar een nieuwe APK vanaf de laatste N versies
+# (0 = uit); alleen bewaard als ze kleiner zijn dan MAX_RATIO van de APK
+APK_DELTA_SOURCES = int(os.getenv("APK_DELTA_SOURCES", "3"))
+APK_DELTA_LEVEL = int(os.getenv("APK_DELTA_LEVEL", "19"))
+APK_DELTA_MAX_RATIO = float(os.getenv("APK_DELTA_MAX_RATIO", "0.5"))
+
+# Laat nginx de APK serveren via X-Accel-Redirect (bv. "/_apk/"); leeg = uit
+APK_ACCEL_REDIRECT = os.getenv("APK_ACCEL_REDIRECT", "")
+
+# Download log wordt gebufferd en in batches weggeschreven
+DOWNLOAD_LOG_BATCH_SIZE = int(os.getenv("DOWNLOAD_LOG_BATCH_SIZE", "500"))
+DOWNLOAD_LOG_FLUSH_SECONDS = float(os.getenv("DOWNLOAD_LOG_FLUSH_SECONDS", "1.0"))
+DOWNLOAD_LOG_MAX_QUEUE = int(os.getenv("DOWNLOAD_LOG_MAX_QUEUE", "50000"))
+# Retentie: regels ouder dan N dagen gaan naar gecomprimeerde archief
+# segmenten (0 = uit); de rollups (statistieken) blijven volledig
+DOWNLOAD_LOG_RETENTION_DAYS = int(os.getenv("DOWNLOAD_LOG_RETENTION_DAYS", "90"))
+DOWNLOAD_LOG_ARCHIVE_DIR = os.getenv("DOWNLOAD_LOG_ARCHIVE_DIR", os.path.join(DATA_DIR, "archive", "download_logs"))
+DOWNLOAD_LOG_ARCHIVE_INTERVAL_SECONDS = float(os.getenv("DOWNLOAD_LOG_ARCHIVE_INTERVAL_SECONDS", "3600"))
+DOWNLOAD_LOG_ARCHIVE_BATCH_SIZE = int(os.getenv("DOWNLOAD_LOG_ARCHIVE_BATCH_SIZE", "5000"))
+# Pagina's per PRAGMA incremental_vacuum stap (korte schrijf locks)
+SQLITE_VACUUM_PAGES = int(os.getenv("SQLITE_VACUUM_PAGES", "2000"))
+
+# SQLite tuning (per connectie) en connection pool
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+# Starlette's threadpool heeft standaard 40 threads per worker
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "40"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Async engine op SQLite: elke aiosqlite connectie is een eigen thread en
+# SQLite laat één schrijver tegelijk toe; meer connecties geven alleen
+# GIL- en lock-contentie. Requests wachten in de (FIFO) pool, hoogstens
+# ASYNC_DB_POOL_TIMEOUT seconden.
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "4"))
+ASYNC_DB_POOL_TIMEOUT = float(os.getenv("ASYNC_DB_POOL_TIMEOUT", "30"))
+
+# Headwind client: connection pool, retries en circuit breaker
+HEADWIND_TIMEOUT_SECONDS = float(os.getenv("HEADWIND_TIMEOUT_SECONDS", "10"))
+HEADWIND_MAX_CONNECTIONS = int(os.getenv("HEADWIND_MAX_CONNECTIONS", "20"))
+HEADWIND_RETRIES = int(os.getenv("HEADWIND_RETRIES", "3"))
+HEADWIND_BREAKER_THRESHOLD = int(os.getenv("HEADWIND_BREAKER_THRESHOLD", "5"))
+HEADWIND_BREAKER_RESET_SECONDS = float(os.getenv("HEADWIND_BREAKER_RESET_SECONDS", "30"))
+
+# Cache van geverifieerde tokens (0 = uit)
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+# Password hashing (bcrypt) en login throttling
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "16"))
+LOGIN_MAX_PER_IP = int(os.getenv("LOGIN_MAX_PER_IP", "20"))
+LOGIN_IP_WINDOW_SECONDS = float(os.getenv("LOGIN_IP_WINDOW_SECONDS", "60"))
+LOGIN_MAX_PER_EMAIL = int(os.getenv("LOGIN_MAX_PER_EMAIL", "10"))
+LOGIN_EMAIL_WINDOW_SECONDS = float(os.getenv("LOGIN_EMAIL_WINDOW_SECONDS", "300"))
+
+# Maximaal aantal devices per bulk enrollment
+BULK_MAX_DEVICES = int(os.getenv("BULK_MAX_DEVICES", "5000"))
+
+# Headwind device status sync (interval 0 = uit)
+HEADWIND_SYNC_INTERVAL_SECONDS = float(os.getenv("HEADWIND_SYNC_INTERVAL_SECONDS", "60"))
+HEADWIND_SYNC_FULL_SECONDS = float(os.getenv("HEADWIND_SYNC_FULL_SECONDS", "3600"))
+HEADWIND_SYNC_PAGE_SIZE = int(os.getenv("HEADWIND_SYNC_PAGE_SIZE", "500"))
+HEADWIND_SYNC_CONCURRENCY = int(os.getenv("HEADWIND_SYNC_CONCURRENCY", "4"))
+DEVICE_OFFLINE_AFTER_SECONDS = float(os.getenv("DEVICE_OFFLINE_AFTER_SECONDS", "900"))
+
+# Catalogus van Headwind configuraties: verversen na de TTL, laatst goede
+# lijst op disk als fallback
+CONFIG_CATALOG_TTL_SECONDS = float(os.getenv("CONFIG_CATALOG_TTL_SECONDS", "300"))
+CONFIG_CATALOG_FILE = os.getenv("CONFIG_CATALOG_FILE", os.path.join(DATA_DIR, "configurations.json"))
+
+# Server-Sent Events voor het admin dashboard
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "200"))
+# Geldigheid van een stream ticket (`?ticket=` op /api/admin/events)
+EVENTS_TICKET_TTL_SECONDS = int(os.getenv("EVENTS_TICKET_TTL_SECONDS", "60"))
+
+# Sampling profiler: header `X-Profile: <token>` profileert een request
+# (leeg = uit); alleen requests trager dan PROFILE_SLOW_SECONDS worden bewaard
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "0.5"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
@@ -0,0 +1,307 @@
+"""
+Site cache modus (PORTAL_MODE=site_cache).
+
+Dezelfde app draait dan op het LAN van een klant en spiegelt de publieke
+endpoints van de portal op UPSTREAM_URL, zodat niet elk device de APK over
+de WAN verbinding van de site haalt:
+
+- `/api/public/provisioning` (per channel) staat in het geheugen. Na
+  SITE_CACHE_REVALIDATE_SECONDS wordt hij met `If-None-Match` bij de
+  upstream gerevalideerd; meestal is dat een 304 zonder body. Is de
+  upstream onbereikbaar, dan blijft de laatst bekende versie in gebruik.
+- `apk_url` en de download URL in de QR payload wijzen naar de
+  onveranderlijke URL van dezelfde versie op de site cache zelf. De
+  signature checksum blijft geldig: het zijn dezelfde bytes.
+- APK's staan in de gewone blob store op file_hash. Een miss haalt de blob
+  één keer bij de upstream op, ook als honderd devices tegelijk vragen
+  (single-flight per proces, plus een file lock tussen workers), en de
+  SHA-256 moet kloppen voordat hij gebruikt wordt. Verschijnt er een nieuwe
+  versie in de provisioning, dan wordt die meteen op de achtergrond gehaald.
+
+De gespiegelde data staat niet in de database. Oude blobs worden opgeruimd
+tot er SITE_CACHE_KEEP_VERSIONS over zijn, plus de versies waar de
+provisioning nu naar wijst.
+"""
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from .apk_store import BLOB_DIR, CHUNK_SIZE, ApkHashMismatch, ApkTooLarge, blob_path, save_stream
+from .http_cache import make_etag
+from .provisioning import DOWNLOAD_LOCATION, PORTAL_APK_PATH
+from .settings import (
+    APK_DIR,
+    PORTAL_MODE,
+    SITE_CACHE_KEEP_VERSIONS,
+    SITE_CACHE_REVALIDATE_SECONDS,
+    SITE_CACHE_TIMEOUT_SECONDS,
+    SITE_PUBLIC_URL,
+    UPSTREAM_URL,
+)
+
+SITE_CACHE_MODE = "site_cache"
+HASH_URL_RE = re.compile(r"/api/public/apk/([0-9a-f]{64})\.apk$")
+FETCH_LOCK_PATH = os.path.join(APK_DIR, ".site-fetch.lock")
+# Bodies per basis URL (Host header); begrensd tegen rare Host headers
+MAX_BODIES = 8
+
+
+class UpstreamUnavailable(Exception):
+    """De upstream portal gaf geen bruikbaar antwoord (en er is niets gecached)"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+def site_cache_enabled() -> bool:
+    return PORTAL_MODE == SITE_CACHE_MODE
+
+
+def file_hash_from_url(url: Optional[str]) -> Optional[str]:
+    """file_hash uit een onveranderlijke portal APK URL, anders None"""
+    m = HASH_URL_RE.search(url or "")
+    return m.group(1) if m else None
+
+
+def localize(data: dict, base_url: str, file_hash: Optional[str]) -> dict:
+    """Laat de provisioning naar de APK op de site cache wijzen"""
+    if not data.get("configured") or not file_hash:
+        return data
+    apk_url = f"{base_url}{PORTAL_APK_PATH}/{file_hash}.apk"
+    payload = {**data["qr_payload"], DOWNLOAD_LOCATION: apk_url}
+    return {**data, "apk_url": apk_url, "qr_payload": payload, "qr_json": json.dumps(payload)}
+
+
+@dataclass
+class _Provisioning:
+    data: dict
+    etag: Optional[str]
+    file_hash: Optional[str]
+    checked_at: float
+    bodies: Dict[str, Tuple[dict, bytes, str]] = field(default_factory=dict)
+
+
+def _acquire_fetch_lock():
+    lock_file = open(FETCH_LOCK_PATH, "a")
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+
+def _release_fetch_lock(lock_file):
+    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    lock_file.close()
+
+
+class SiteCache:
+    def __init__(self, upstream_url: str, public_url: str, revalidate_seconds: float, keep_versions: int):
+        self.upstream_url = upstream_url.rstrip("/")
+        self.public_url = public_url.rstrip("/")
+        self.revalidate_seconds = revalidate_seconds
+        self.keep_versions = keep_versions
+        self.stats: Counter = Counter()
+        self.last_error: Optional[str] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._entries: Dict[str, _Provisioning] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._fetches: Dict[str, asyncio.Task] = {}
+
+    async def open(self):
+        """Open de connection pool naar de upstream (vanuit de lifespan)"""
+        if not self.upstream_url:
+            raise RuntimeError("PORTAL_MODE=site_cache vereist UPSTREAM_URL")
+        if self._http is None:
+            self._http = httpx.AsyncClient(base_url=self.upstream_url, timeout=SITE_CACHE_TIMEOUT_SECONDS)
+        os.makedirs(APK_DIR, exist_ok=True)
+
+    async def close(self):
+        for task in list(self._fetches.values()):
+            task.cancel()
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            await self.open()
+        return self._http
+
+    # ============ PROVISIONING ============
+
+    async def _revalidate(self, channel: str) -> _Provisioning:
+        entry = self._entries.get(channel)
+        if entry is not None and time.monotonic() - entry.checked_at < self.revalidate_seconds:
+            return entry
+
+        lock = self._locks.setdefault(channel, asyncio.Lock())
+        async with lock:
+            # Een gelijktijdige caller heeft net gerevalideerd
+            entry = self._entries.get(channel)
+            if entry is not None and time.monotonic() - entry.checked_at < self.revalidate_seconds:
+                return entry
+
+            headers = {"If-None-Match": entry.etag} if entry is not None and entry.etag else {}
+            client = await self._client()
+            try:
+                response = await client.get("/api/public/provisioning", params={"channel": channel}, headers=headers)
+            except httpx.HTTPError as e:
+                response = None
+                error = f"Upstream onbereikbaar: {e}"
+            else:
+                error = f"Upstream gaf status {response.status_code}"
+
+            if response is not None and response.status_code == 304 and entry is not None:
+                self.stats["revalidated_304"] += 1
+                entry.checked_at = time.monotonic()
+                return entry
+            if response is None or response.status_code != 200:
+                self.last_error = error
+                if entry is None:
+                    raise UpstreamUnavailable(error, response.status_code if response is not None else None)
+                # Stale serveren; pas na het interval opnieuw proberen
+                self.stats["served_stale"] += 1
+                entry.checked_at = time.monotonic()
+                return entry
+
+            self.stats["revalidated_200"] += 1
+            data = response.json()
+            file_hash = file_hash_from_url(data.get("apk_url"))
+            entry = _Provisioning(
+                data=data,
+                etag=response.headers.get("etag"),
+                file_hash=file_hash,
+                checked_at=time.monotonic(),
+            )
+            self._entries[channel] = entry
+            if file_hash:
+                self.prefetch(file_hash)
+            return entry
+
+    async def provisioning(self, channel: str, base_url: str) -> Tuple[dict, bytes, str]:
+        """(data, body, etag) zoals de portal, maar met de APK op de site cache"""
+        entry = await self._revalidate(channel)
+        base = self.public_url or base_url.rstrip("/")
+        cached = entry.bodies.get(base)
+        if cached is None:
+            data = localize(entry.data, base, entry.file_hash)
+            body = json.dumps(data, separators=(",", ":")).encode()
+            cached = (data, body, make_etag(hashlib.sha256(body).hexdigest()))
+            if len(entry.bodies) >= MAX_BODIES:
+                entry.bodies.clear()
+            entry.bodies[base] = cached
+        return cached
+
+    async def current_hash(self, channel: str) -> Optional[str]:
+        """file_hash van de APK waar de upstream provisioning van een channel naar wijst"""
+        return (await self._revalidate(channel)).file_hash
+
+    # ============ APK BLOBS ============
+
+    async def blob(self, file_hash: str) -> str:
+        """Pad van een lokale blob; haalt hem (één keer) bij de upstream op als hij ontbreekt"""
+        path = blob_path(file_hash)
+        if os.path.exists(path):
+            self.stats["blob_hit"] += 1
+            return path
+        task = self._fetches.get(file_hash)
+        if task is None:
+            task = self._start_fetch(file_hash)
+        else:
+            self.stats["blob_coalesced"] += 1
+        # shield: een afgebroken download van één device stopt de fetch niet
+        return await asyncio.shield(task)
+
+    def prefetch(self, file_hash: str):
+        if file_hash not in self._fetches and not os.path.exists(blob_path(file_hash)):
+            self._start_fetch(file_hash)
+
+    def _start_fetch(self, file_hash: str) -> asyncio.Task:
+        task = asyncio.create_task(self._fetch(file_hash))
+        self._fetches[file_hash] = task
+        task.add_done_callback(lambda t: self._fetch_done(file_hash, t))
+        return task
+
+    def _fetch_done(self, file_hash: str, task: asyncio.Task):
+        self._fetches.pop(file_hash, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.last_error = f"APK {file_hash[:12]} ophalen mislukt: {task.exception()}"
+
+    async def _fetch(self, file_hash: str) -> str:
+        lock_file = await run_in_threadpool(_acquire_fetch_lock)
+        try:
+            # Een andere worker kan hem intussen opgehaald hebben
+            path = blob_path(file_hash)
+            if os.path.exists(path):
+                return path
+            self.stats["blob_fetch"] += 1
+            client = await self._client()
+            started = time.perf_counter()
+            try:
+                async with client.stream("GET", f"{PORTAL_APK_PATH}/{file_hash}.apk") as response:
+                    if response.status_code != 200:
+                        raise UpstreamUnavailable(f"Upstream gaf status {response.status_code}", response.status_code)
+                    path, _, size, _ = await save_stream(response.aiter_bytes(CHUNK_SIZE), expected_hash=file_hash)
+            except (httpx.HTTPError, ApkHashMismatch, ApkTooLarge) as e:
+                # Verbinding weg, afgebroken of een APK die niet klopt: voor devices een 502
+                raise UpstreamUnavailable(f"APK ophalen bij upstream mislukt: {e}") from e
+            self.stats["bytes_fetched"] += size
+            print(f"Site cache: APK {file_hash[:12]} opgehaald ({size} bytes, {time.perf_counter() - started:.1f}s)")
+        finally:
+            await run_in_threadpool(_release_fetch_lock, lock_file)
+        await run_in_threadpool(self.prune)
+        return path
+
+    def prune(self):
+        """Ruim blobs op buiten de nieuwste SITE_CACHE_KEEP_VERSIONS en de huidige versies"""
+        keep = {entry.file_hash for entry in self._entries.values() if entry.file_hash}
+        blobs = []
+        for root, _, files in os.walk(BLOB_DIR):
+            for name in files:
+                path = os.path.join(root, name)
+                blobs.append((os.path.getmtime(path), name[:-4], path))
+        blobs.sort(reverse=True)
+        for _, file_hash, path in blobs[self.keep_versions:]:
+            if file_hash not in keep and file_hash not in self._fetches:
+                try:
+                    os.remove(path)
+                    self.stats["blob_pruned"] += 1
+                except FileNotFoundError:
+                    pass
+
+    def metrics(self) -> dict:
+        return {
+            "enabled": True,
+            "upstream_url": self.upstream_url,
+            "channels": {
+                channel: {
+                    "file_hash": entry.file_hash,
+                    "upstream_etag": entry.etag,
+                    "age_seconds": round(time.monotonic() - entry.checked_at, 1),
+                }
+                for channel, entry in self._entries.items()
+            },
+            "fetching": sorted(self._fetches),
+            "stats": dict(self.stats),
+            "last_error": self.last_error,
+        }
+
+
+_cache: Optional[SiteCache] = None
+
+
+def get_site_cache() -> SiteCache:
+    """Get de singleton site cache"""
+    global _cache
+    if _cache is None:
+        _cache = SiteCache(UPSTREAM_URL, SITE_PUBLIC_URL, SITE_CACHE_REVALIDATE_SECONDS, SITE_CACHE_KEEP_VERSIONS)
+    return _cache
@@ -0,0 +1,179 @@
+"""
+Download statistieken op basis van rollups.
+
+Bij elke flush van de download log worden per uur, per dag en totaal
+tellers bijgewerkt (per user-agent familie), in dezelfde transactie als de
+log regels zelf. De stats endpoints lezen alleen deze rollups en hoeven de
+(groeiende) download_logs tabel dus nooit te scannen.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+
+from .db import hour_bucket, upsert
+from .log_archive import iter_archived
+from .models import DownloadLog, DownloadRollup
+
+HOUR = "hour"
+DAY = "day"
+TOTAL = "total"
+TOTAL_BUCKET = datetime(1970, 1, 1)
+
+
+def ua_family(user_agent: Optional[str]) -> str:
+    """Deel een user-agent in bij een kleine, vaste set families"""
+    if not user_agent:
+        return "unknown"
+    ua = user_agent.lower()
+    if "androiddownloadmanager" in ua:
+        return "android-downloadmanager"
+    if "dalvik" in ua:
+        return "android-dalvik"
+    if "okhttp" in ua:
+        return "okhttp"
+    if "curl" in ua or "wget" in ua or "httpie" in ua or "python" in ua:
+        return "cli"
+    if "android" in ua:
+        return "android-browser"
+    if "mozilla" in ua:
+        return "desktop-browser"
+    return "other"
+
+
+def floor_hour(dt: datetime) -> datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(dt: datetime) -> datetime:
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil(dt: datetime, floor, step: timedelta) -> datetime:
+    floored = floor(dt)
+    return floored if floored == dt else floored + step
+
+
+def rollup_counts(events: Iterable[Tuple[datetime, Optional[str], int]]) -> Counter:
+    """Tel (tijdstip, user-agent, aantal) events op per rollup sleutel"""
+    counts: Counter = Counter()
+    for downloaded_at, user_agent, n in events:
+        family = ua_family(user_agent)
+        counts[(HOUR, floor_hour(downloaded_at), family)] += n
+        counts[(DAY, floor_day(downloaded_at), family)] += n
+        counts[(TOTAL, TOTAL_BUCKET, family)] += n
+    return counts
+
+
+def _upsert_rows(counts: Counter) -> List[dict]:
+    return [
+        {"granularity": g, "bucket_start": b, "user_agent_family": f, "count": n}
+        for (g, b, f), n in counts.items()
+    ]
+
+
+def add_to_rollups(conn, rows: List[dict]):
+    """Verhoog de rollup tellers voor een batch download log regels"""
+    counts = rollup_counts((r["downloaded_at"], r.get("user_agent"), 1) for r in rows)
+    if not counts:
+        return
+    stmt = upsert(conn, DownloadRollup.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["granularity", "bucket_start", "user_agent_family"],
+        set_={"count": DownloadRollup.__table__.c.count + stmt.excluded.count},
+    )
+    conn.execute(stmt, _upsert_rows(counts))
+
+
+def rebuild_rollups(conn):
+    """
+    Herbereken alle rollups uit download_logs plus het archief.
+    De DELETE opent de schrijftransactie, zodat de SELECT daarna een
+    consistente stand ziet en concurrent flushes moeten wachten.
+    """
+
+    conn.execute(delete(DownloadRollup.__table__))
+    hour = hour_bucket(conn, DownloadLog.downloaded_at)
+    result = conn.execute(
+        select(hour, DownloadLog.user_agent, func.count())
+        .where(DownloadLog.downloaded_at.is_not(None))
+        .group_by(hour, DownloadLog.user_agent)
+    )
+    counts = rollup_counts(
+        (h if isinstance(h, datetime) else datetime.strptime(h, "%Y-%m-%d %H:%M:%S"), ua, n)
+        for h, ua, n in result
+    )
+    counts += rollup_counts(
+        (datetime.fromisoformat(row["downloaded_at"]), row["user_agent"], 1) for row in iter_archived()
+    )
+    if counts:
+        conn.execute(DownloadRollup.__table__.insert(), _upsert_rows(counts))
+
+
+def _sum_by_family(db, granularity: str, start: datetime, end: datetime) -> Counter:
+    """Som per familie over buckets in [start, end)"""
+    counts: Counter = Counter()
+    if start >= end:
+        return counts
+    rows = db.execute(
+        select(DownloadRollup.user_agent_family, func.sum(DownloadRollup.count))
+        .where(
+            DownloadRollup.granularity == granularity,
+            DownloadRollup.bucket_start >= start,
+            DownloadRollup.bucket_start < end,
+        )
+        .group_by(DownloadRollup.user_agent_family)
+    )
+    for family, n in rows:
+        counts[family] += n or 0
+    return counts
+
+
+def count_range(db, start: datetime, end: datetime) -> Counter:
+    """
+    Aantal downloads per user-agent familie in [start, end), op uur-resolutie.
+    Hele dagen komen uit de dag-rollups, de randen uit de uur-rollups.
+    """
+    start = floor_hour(start)
+    end = _ceil(end, floor_hour, timedelta(hours=1))
+    first_day = _ceil(start, floor_day, timedelta(days=1))
+    last_day = floor_day(end)
+    if first_day >= last_day:
+        return _sum_by_family(db, HOUR, start, end)
+    counts = _sum_by_family(db, HOUR, start, first_day)
+    counts += _sum_by_family(db, DAY, first_day, last_day)
+    counts += _sum_by_family(db, HOUR, last_day, end)
+    return counts
+
+
+def count_total(db) -> Counter:
+    return _sum_by_family(db, TOTAL, TOTAL_BUCKET, TOTAL_BUCKET + timedelta(seconds=1))
+
+
+def series(db, granularity: str, start: datetime, end: datetime) -> List[dict]:
+    """Tijdreeks van downloads per uur of dag in [start, end)"""
+    rows = db.execute(
+        select(DownloadRollup.bucket_start, func.sum(DownloadRollup.count))
+        .where(
+            DownloadRollup.granularity == granularity,
+            DownloadRollup.bucket_start >= start,
+            DownloadRollup.bucket_start < end,
+        )
+        .group_by(DownloadRollup.bucket_start)
+        .order_by(DownloadRollup.bucket_start)
+    )
+    return [{"bucket": b.isoformat(), "downloads": n} for b, n in rows]
+
+
+def summary(db, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Totaal / vandaag / afgelopen week (zelfde definitie als voorheen)"""
+    now = now or datetime.utcnow()
+    today_start = floor_day(now)
+    week_start = today_start - timedelta(days=7)
+    tomorrow = today_start + timedelta(days=1)
+    return {
+        "total_downloads": sum(count_total(db).values()),
+        "today_downloads": sum(_sum_by_family(db, DAY, today_start, tomorrow).values()),
+        "week_downloads": sum(_sum_by_family(db, DAY, week_start, tomorrow).values()),
+    }
@@ -0,0 +1,182 @@
+"""
+Benchmark: sync sessies in de threadpool vs de async database route.
+
+Draait een gemengde workload zoals de admin endpoints die doen (device
+pagina + status telling lezen, devices aanmaken en status bijwerken) met
+N gelijktijdige "requests" tegen een tijdelijke SQLite database:
+
+- sync:  zoals vroeger; elke operatie met een sync Session via
+  run_in_threadpool (Starlette's threadpool, standaard 40 threads)
+- async: AsyncSession op aiosqlite, zonder threadpool, met de pool van
+  de app (ASYNC_DB_POOL_SIZE connecties, FIFO)
+
+Beide routes voeren per write dezelfde statements in één transactie uit.
+
+Tegelijk meet een probe hoe lang een triviale call op een vrije thread uit
+de threadpool moet wachten: dat is de vertraging die andere sync endpoints
+(QR rendering, config) oplopen zolang de DB de threads bezet houdt.
+
+    cd backend && python -m bench.bench_async_db --concurrency 200 --seconds 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from typing import List
+
+_tmp = tempfile.mkdtemp(prefix="bench-async-db-")
+os.environ.setdefault("DATA_DIR", _tmp)
+os.environ.setdefault("DB_PATH", os.path.join(_tmp, "portal.db"))
+
+import anyio.to_thread  # noqa: E402
+from sqlalchemy import func, insert, select, update  # noqa: E402
+from starlette.concurrency import run_in_threadpool  # noqa: E402
+
+from app.crud import (  # noqa: E402
+    DEVICE_LIST_COLUMNS,
+    count_devices_by_status,
+    list_devices_page,
+)
+from app.db import AsyncSessionLocal, SessionLocal, async_engine, engine  # noqa: E402
+from app.migrations import run_migrations  # noqa: E402
+from app.models import Device, User  # noqa: E402
+
+STATUSES = ("pending", "enrolled", "online", "offline")
+
+
+def seed(devices: int) -> int:
+    with engine.begin() as conn:
+        owner_id = conn.execute(
+            insert(User).values(email="bench@example.com", password_hash="x", role="admin")
+        ).inserted_primary_key[0]
+        conn.execute(
+            insert(Device.__table__),
+            [
+                {
+                    "owner_id": owner_id,
+                    "label": f"Device {i}",
+                    "mode": "kiosk",
+                    "config_key": "vastelijn_alleen",
+                    "status": STATUSES[i % len(STATUSES)],
+                }
+                for i in range(devices)
+            ],
+        )
+    return owner_id
+
+
+# ============ SYNC (oude route) ============
+
+def sync_read(owner_id: int):
+    db = SessionLocal()
+    try:
+        db.execute(
+            select(*DEVICE_LIST_COLUMNS).where(Device.owner_id == owner_id).order_by(Device.id.desc()).limit(51)
+        ).all()
+        db.execute(
+            select(Device.status, func.count()).where(Device.owner_id == owner_id).group_by(Device.status)
+        ).all()
+    finally:
+        db.close()
+
+
+def sync_write(owner_id: int):
+    db = SessionLocal()
+    try:
+        db.execute(insert(Device).values(owner_id=owner_id, label="nieuw", mode="kiosk",
+                                         config_key="vastelijn_alleen", status="pending"))
+        db.execute(update(Device).where(Device.id == random.randint(1, 1000)).values(status=random.choice(STATUSES)))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def sync_op(owner_id: int, write: bool):
+    await run_in_threadpool(sync_write if write else sync_read, owner_id)
+
+
+# ============ ASYNC ============
+
+async def async_op(owner_id: int, write: bool):
+    async with AsyncSessionLocal() as db:
+        if write:
+            # Dezelfde statements als sync_write, in één transactie
+            await db.execute(insert(Device).values(owner_id=owner_id, label="nieuw", mode="kiosk",
+                                                   config_key="vastelijn_alleen", status="pending"))
+            await db.execute(
+                update(Device).where(Device.id == random.randint(1, 1000)).values(status=random.choice(STATUSES))
+            )
+            await db.commit()
+        else:
+            await list_devices_page(db, owner_id)
+            await count_devices_by_status(db, owner_id)
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))] * 1000 if values else 0.0
+
+
+async def run(mode: str, owner_id: int, concurrency: int, seconds: float, write_ratio: float) -> dict:
+    op = sync_op if mode == "sync" else async_op
+    latencies: List[float] = []
+    probe: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                await op(owner_id, random.random() < write_ratio)
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+
+    async def prober():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await run_in_threadpool(lambda: None)
+            probe.append(time.perf_counter() - started)
+            await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    await asyncio.gather(prober(), *[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return {
+        "ops": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+        "probe_p99": percentile(probe, 0.99),
+        "errors": errors,
+    }
+
+
+async def main(args):
+    run_migrations(engine)
+    owner_id = seed(args.devices)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = args.threads
+
+    print(f"{args.concurrency} gelijktijdig, {args.write_ratio:.0%} writes, threadpool {args.threads} threads")
+    print(f"{'route':8} {'ops/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'threadpool wacht p99 ms':>24} {'fouten':>7}")
+    for mode in ("sync", "async"):
+        r = await run(mode, owner_id, args.concurrency, args.seconds, args.write_ratio)
+        print(
+            f"{mode:8} {r['ops']:>9.0f} {r['p50']:>9.1f} {r['p99']:>9.1f} "
+            f"{r['probe_p99']:>24.1f} {r['errors']:>7}"
+        )
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--threads", type=int, default=40, help="grootte van de threadpool")
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,72 @@
+"""
+Benchmark: requests/sec op /api/me met en zonder principal cache.
+
+Start de app in-process (ASGI transport) tegen een tijdelijke database en
+vuurt met een vaste concurrency requests af op /api/me.
+
+    cd backend && python -m bench.bench_auth_cache --requests 5000 --concurrency 32
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp(prefix="bench-auth-")
+os.environ.setdefault("DATA_DIR", _tmp)
+os.environ.setdefault("DB_PATH", os.path.join(_tmp, "portal.db"))
+
+import httpx  # noqa: E402
+
+from app.auth import get_principal_cache  # noqa: E402
+from app.main import app, lifespan  # noqa: E402
+
+
+async def hammer(client: httpx.AsyncClient, headers: dict, total: int, concurrency: int) -> float:
+    remaining = total
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            r = await client.get("/api/me", headers=headers)
+            r.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return total / (time.perf_counter() - started)
+
+
+async def main(total: int, concurrency: int):
+    async with lifespan(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            creds = {"email": "bench@example.com", "password": "bench-password"}
+            await client.post("/api/auth/register", json=creds)
+            token = (await client.post("/api/auth/login", json=creds)).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+
+            cache = get_principal_cache()
+            ttl = cache.ttl
+
+            cache.ttl = 0
+            cache.clear()
+            await hammer(client, headers, 200, concurrency)  # warm-up
+            without = await hammer(client, headers, total, concurrency)
+
+            cache.ttl = ttl or 60
+            await hammer(client, headers, 200, concurrency)
+            with_cache = await hammer(client, headers, total, concurrency)
+
+    print(f"{'mode':14} {'req/s':>10}")
+    print(f"{'zonder cache':14} {without:>10.1f}")
+    print(f"{'met cache':14} {with_cache:>10.1f}")
+    print(f"speedup: {with_cache / without:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
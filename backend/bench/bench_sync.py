@@ -0,0 +1,91 @@
+"""
+Benchmark: Headwind device sync tegen de mock Headwind server.
+
+Vult een tijdelijke database met devices die aan de mock devices gekoppeld
+zijn en meet een volledige sync (sequentieel vs gelijktijdig ophalen van
+pagina's) en daarna een incrementele sync na een handvol check-ins.
+
+    cd backend && python -m bench.bench_sync --devices 20000 --latency 0.02
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="bench-sync-")
+os.environ.setdefault("DATA_DIR", _tmp)
+os.environ.setdefault("DB_PATH", os.path.join(_tmp, "portal.db"))
+
+import httpx  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from app.db import engine  # noqa: E402
+from app.device_sync import DeviceSync  # noqa: E402
+from app.headwind_client import HeadwindClient  # noqa: E402
+from app.migrations import run_migrations  # noqa: E402
+from app.models import Device, User  # noqa: E402
+from bench.mock_headwind import create_app  # noqa: E402
+
+
+def seed(count: int):
+    with engine.begin() as conn:
+        owner_id = conn.execute(
+            insert(User).values(email="bench@example.com", password_hash="x", role="admin")
+        ).inserted_primary_key[0]
+        conn.execute(
+            insert(Device.__table__),
+            [
+                {
+                    "owner_id": owner_id,
+                    "label": f"Device {i}",
+                    "mode": "kiosk",
+                    "config_key": "vastelijn_alleen",
+                    "status": "pending",
+                    "headwind_number": f"VL{i:06d}",
+                }
+                for i in range(1, count + 1)
+            ],
+        )
+
+
+def report(name: str, result, requests: int):
+    print(
+        f"{name:28} {result.seconds:>8.3f}s  pages={result.pages:<4} calls={requests:<4} "
+        f"fetched={result.fetched:<6} changed={result.changed:<6} offline={result.marked_offline}"
+    )
+
+
+async def main(devices: int, latency: float, page_size: int, concurrency: int, touched: int):
+    run_migrations(engine)
+    seed(devices)
+
+    mock = create_app(devices, latency)
+    client = HeadwindClient()
+    client._http = httpx.AsyncClient(transport=httpx.ASGITransport(app=mock), base_url="http://headwind")
+    state = mock.state.devices
+
+    for name, workers in (("volledig, sequentieel", 1), (f"volledig, {concurrency} tegelijk", concurrency)):
+        state.requests = 0
+        sync = DeviceSync(client, page_size=page_size, concurrency=workers)
+        report(name, await sync.run(full=True), state.requests)
+
+    sync = DeviceSync(client, page_size=page_size, concurrency=concurrency)
+    state.requests = 0
+    report("incrementeel, geen wijziging", await sync.run(), state.requests)
+
+    await asyncio.sleep(0.01)
+    await client._http.post("/mock/touch", params={"count": touched})
+    state.requests = 0
+    report(f"incrementeel, {touched} check-ins", await sync.run(), state.requests)
+    await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.02, help="gesimuleerde Headwind latency per pagina (s)")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--touched", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.devices, args.latency, args.page_size, args.concurrency, args.touched))
@@ -0,0 +1,149 @@
+"""
+Lokale mock van de Headwind MDM REST API, voor de device sync en benchmarks.
+
+Ondersteunt de calls die de portal doet:
+
+- POST /rest/public/jwt/login                  -> {"id_token": <JWT met exp>}
+- POST /rest/private/devices/search            -> pagina's, sortBy lastUpdate
+- GET  /rest/private/configurations/search     -> alle configuraties
+- POST /mock/touch                             -> laat devices "inchecken"
+- POST /mock/configurations                    -> voeg een configuratie toe
+
+Los draaien:
+
+    cd backend && python -m bench.mock_headwind --devices 10000 --port 8090
+
+of in-process gebruiken via `create_app()` met een httpx.ASGITransport.
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import List, Optional
+
+from fastapi import FastAPI, Header, HTTPException, Request
+from jose import jwt
+
+from app.headwind_client import CONFIGURATIONS
+
+MOCK_SECRET = "mock-headwind"
+TOKEN_TTL = 3600
+
+
+class MockDevices:
+    """In-memory device lijst met Headwind-achtige velden"""
+
+    def __init__(self, count: int, prefix: str = "VL", online_fraction: float = 0.5):
+        now = int(time.time() * 1000)
+        self.devices: List[dict] = []
+        for i in range(1, count + 1):
+            if random.random() < online_fraction:
+                last_update = now - random.randint(0, 5 * 60 * 1000)
+            else:
+                last_update = now - random.randint(2 * 3600 * 1000, 30 * 86400 * 1000)
+            self.devices.append({
+                "id": i,
+                "number": f"{prefix}{i:06d}",
+                "description": "",
+                "configurationId": random.choice([3, 4, 5]),
+                "lastUpdate": last_update,
+            })
+        self.requests = 0
+
+    def touch(self, count: int) -> List[str]:
+        """Zet lastUpdate van `count` willekeurige devices op nu"""
+        now = int(time.time() * 1000)
+        touched = random.sample(self.devices, min(count, len(self.devices)))
+        for d in touched:
+            d["lastUpdate"] = now
+        return [d["number"] for d in touched]
+
+    def search(self, page_num: int, page_size: int, sort_by: Optional[str], sort_dir: str) -> dict:
+        items = self.devices
+        if sort_by:
+            items = sorted(items, key=lambda d: d.get(sort_by) or 0, reverse=sort_dir.upper() == "DESC")
+        start = (max(page_num, 1) - 1) * page_size
+        return {
+            "status": "OK",
+            "message": None,
+            "data": {
+                "devices": {
+                    "items": items[start:start + page_size],
+                    "totalItemsCount": len(self.devices),
+                },
+            },
+        }
+
+
+def create_app(count: int = 1000, latency: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Mock Headwind")
+    app.state.devices = MockDevices(count)
+    app.state.configurations = [
+        {"id": c["id"], "name": c["name"], "description": c["description"], "qrCodeKey": c["qr_key"]}
+        for c in CONFIGURATIONS.values()
+    ]
+
+    def check_auth(authorization: Optional[str]):
+        if not authorization or not authorization.startswith("Bearer "):
+            raise HTTPException(401)
+        try:
+            jwt.decode(authorization[7:], MOCK_SECRET, algorithms=["HS256"])
+        except Exception:
+            raise HTTPException(401)
+
+    @app.post("/rest/public/jwt/login")
+    async def login(body: dict):
+        token = jwt.encode(
+            {"sub": body.get("login"), "exp": int(time.time()) + TOKEN_TTL},
+            MOCK_SECRET,
+            algorithm="HS256",
+        )
+        return {"id_token": token}
+
+    @app.post("/rest/private/devices/search")
+    async def search_devices(request: Request, authorization: Optional[str] = Header(None)):
+        check_auth(authorization)
+        body = await request.json()
+        if latency:
+            await asyncio.sleep(latency)
+        app.state.devices.requests += 1
+        return app.state.devices.search(
+            int(body.get("pageNum") or 1),
+            int(body.get("pageSize") or 50),
+            body.get("sortBy"),
+            body.get("sortDir") or "ASC",
+        )
+
+    @app.get("/rest/private/configurations/search")
+    async def search_configurations(authorization: Optional[str] = Header(None)):
+        check_auth(authorization)
+        return {"status": "OK", "message": None, "data": app.state.configurations}
+
+    @app.post("/mock/configurations")
+    async def add_configuration(body: dict):
+        configurations = app.state.configurations
+        config = {
+            "id": max(c["id"] for c in configurations) + 1,
+            "name": body.get("name") or "Nieuwe configuratie",
+            "description": body.get("description") or "",
+            "qrCodeKey": body.get("qrCodeKey") or f"{random.getrandbits(128):032x}",
+        }
+        configurations.append(config)
+        return config
+
+    @app.post("/mock/touch")
+    async def touch(count: int = 10):
+        return {"touched": app.state.devices.touch(count)}
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0, help="extra vertraging per search call (s)")
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.devices, args.latency), host="127.0.0.1", port=args.port, log_level="warning")
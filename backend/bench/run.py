@@ -0,0 +1,456 @@
+"""
+Benchmark harness voor de hot endpoints van de portal.
+
+Bouwt een tijdelijke database (met migraties, N miljoen download_logs
+regels en herberekende rollups), start de mock Headwind en de portal als
+echte uvicorn processen en belast daarna per scenario een vast aantal
+seconden met een vaste concurrency:
+
+- provisioning       GET /api/public/provisioning
+- provisioning_304   idem met If-None-Match (pollende kiosks)
+- apk                gelijktijdige volledige downloads van een grote APK
+- login              POST /api/auth/login (bcrypt)
+- admin_stats        GET /api/admin/stats over de gevulde download_logs
+- upload_apk         POST /api/admin/upload-apk met steeds een nieuwe APK
+
+Per scenario: throughput, p50/p99/max latency, fouten, bytes/s en het
+piek RSS van het portal proces. Met --save worden de resultaten als
+baseline bewaard; --compare zet een run naast een baseline en eindigt met
+exit code 1 als een scenario meer dan --threshold achteruit gaat.
+
+    cd backend && python -m bench.run --rows 2000000 --save bench/baseline.json
+    cd backend && python -m bench.run --compare bench/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+_tmp = tempfile.mkdtemp(prefix="bench-run-")
+os.environ.setdefault("DATA_DIR", _tmp)
+os.environ.setdefault("DB_PATH", os.path.join(_tmp, "portal.db"))
+
+import httpx  # noqa: E402
+
+from app import stats  # noqa: E402
+from app.auth import hash_pw  # noqa: E402
+from app.db import engine  # noqa: E402
+from app.migrations import run_migrations  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("provisioning", "provisioning_304", "apk", "login", "admin_stats", "upload_apk")
+USER_AGENTS = (
+    "Dalvik/2.1.0 (Linux; U; Android 12; SM-T220 Build/SP1A)",
+    "Mozilla/5.0 (Linux; Android 13) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36",
+    "curl/8.4.0",
+)
+CREDENTIALS = {"email": "bench@example.com", "password": "bench-password"}
+
+
+# ============ DATABASE ============
+
+def seed_download_logs(rows: int, days: int = 365, batch: int = 100_000):
+    """Vul download_logs snel via sqlite3 (executemany) en herbereken de rollups"""
+    now = datetime.utcnow()
+    span = days * 86400
+    conn = sqlite3.connect(os.environ["DB_PATH"])
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        for offset in range(0, rows, batch):
+            count = min(batch, rows - offset)
+            conn.executemany(
+                "INSERT INTO download_logs (ip_address, user_agent, downloaded_at) VALUES (?, ?, ?)",
+                (
+                    (
+                        f"10.{i % 250}.{(i // 250) % 250}.{i % 199}",
+                        USER_AGENTS[i % len(USER_AGENTS)],
+                        (now - timedelta(seconds=random.randrange(span))).strftime("%Y-%m-%d %H:%M:%S.%f"),
+                    )
+                    for i in range(offset, offset + count)
+                ),
+            )
+            conn.commit()
+    finally:
+        conn.close()
+    with engine.begin() as conn:
+        stats.rebuild_rollups(conn)
+
+
+def seed_admin_and_devices(count: int):
+    """Maak het bench admin account aan met `count` devices die in de mock Headwind bestaan"""
+    conn = sqlite3.connect(os.environ["DB_PATH"])
+    try:
+        conn.execute(
+            "INSERT INTO users (email, password_hash, role) VALUES (?, ?, 'admin')",
+            (CREDENTIALS["email"], hash_pw(CREDENTIALS["password"])),
+        )
+        owner_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO devices (owner_id, label, mode, config_key, status, headwind_number) "
+            "VALUES (?, ?, 'kiosk', 'vastelijn_alleen', 'pending', ?)",
+            ((owner_id, f"Device {i}", f"VL{i:06d}") for i in range(1, count + 1)),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def prepare_database(rows: int, devices: int):
+    started = time.perf_counter()
+    run_migrations(engine)
+    seed_download_logs(rows)
+    seed_admin_and_devices(devices)
+    engine.dispose()
+    print(f"Database: {rows} download_logs, {devices} devices in {time.perf_counter() - started:.1f}s")
+
+
+# ============ PROCESSEN ============
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_process(args: List[str], env: dict, health_url: str) -> subprocess.Popen:
+    # stdout (prints van jobs en migraties) weg; fouten op stderr blijven zichtbaar
+    proc = subprocess.Popen([sys.executable, *args], cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"Proces gestopt: {' '.join(args)}")
+        try:
+            httpx.get(health_url, timeout=1)
+            return proc
+        except httpx.TransportError:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit(f"Proces niet bereikbaar: {health_url}")
+
+
+def stop_process(proc: subprocess.Popen):
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+class RssSampler:
+    """Houdt het piek RSS (VmRSS, Linux) van een proces bij"""
+
+    def __init__(self, pid: int, interval: float = 0.02):
+        self.path = f"/proc/{pid}/status"
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _read(self) -> int:
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._read())
+
+    def reset(self):
+        self.peak = self._read()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+# ============ LOAD ============
+
+async def run_load(
+    client: httpx.AsyncClient,
+    request: Callable,
+    seconds: float,
+    concurrency: int,
+) -> dict:
+    """Laat `concurrency` workers `request(client)` herhalen tot de tijd om is"""
+    latencies: List[float] = []
+    errors = 0
+    transferred = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal errors, transferred
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                transferred += await request(client)
+                latencies.append(time.perf_counter() - started)
+            except (httpx.HTTPError, AssertionError):
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(q: float) -> Optional[float]:
+        return round(latencies[int(q * (len(latencies) - 1))] * 1000, 2) if latencies else None
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "throughput": round(len(latencies) / elapsed, 2),
+        "p50_ms": pct(0.50),
+        "p99_ms": pct(0.99),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+        "mb_per_s": round(transferred / elapsed / 1e6, 2),
+    }
+
+
+def expect(response: httpx.Response, *statuses: int) -> httpx.Response:
+    assert response.status_code in statuses, f"{response.request.url}: {response.status_code}"
+    return response
+
+
+def build_scenarios(token: str, etag: str, upload_bytes: int) -> Dict[str, Callable]:
+    auth = {"Authorization": f"Bearer {token}"}
+
+    async def provisioning(client):
+        return len(expect(await client.get("/api/public/provisioning"), 200).content)
+
+    async def provisioning_304(client):
+        headers = {"If-None-Match": etag}
+        return len(expect(await client.get("/api/public/provisioning", headers=headers), 304).content)
+
+    async def apk(client):
+        size = 0
+        async with client.stream("GET", "/api/public/apk") as response:
+            expect(response, 200)
+            async for chunk in response.aiter_raw():
+                size += len(chunk)
+        return size
+
+    async def login(client):
+        return len(expect(await client.post("/api/auth/login", json=CREDENTIALS), 200).content)
+
+    async def admin_stats(client):
+        return len(expect(await client.get("/api/admin/stats", headers=auth), 200).content)
+
+    async def upload_apk(client):
+        # Steeds andere inhoud, anders dedupliceert de blob store de upload
+        data = os.urandom(64) + bytes(upload_bytes - 64)
+        files = {"file": ("bench.apk", data, "application/vnd.android.package-archive")}
+        response = await client.post("/api/admin/upload-apk", params={"channel": ""}, headers=auth, files=files)
+        return len(expect(response, 200).content) + upload_bytes
+
+    return {
+        "provisioning": provisioning,
+        "provisioning_304": provisioning_304,
+        "apk": apk,
+        "login": login,
+        "admin_stats": admin_stats,
+        "upload_apk": upload_apk,
+    }
+
+
+async def drive(base_url: str, rss: RssSampler, args) -> Dict[str, dict]:
+    limits = httpx.Limits(max_connections=max(args.concurrency, args.apk_concurrency) + 8)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        token = expect(await client.post("/api/auth/login", json=CREDENTIALS), 200).json()["access_token"]
+        auth = {"Authorization": f"Bearer {token}"}
+
+        apk = os.urandom(1024) + bytes(args.apk_mb * 1024 * 1024 - 1024)
+        files = {"file": ("vastelijn.apk", apk, "application/vnd.android.package-archive")}
+        expect(await client.post("/api/admin/upload-apk", headers=auth, files=files), 200)
+        del apk
+        etag = expect(await client.get("/api/public/provisioning"), 200).headers["etag"]
+
+        scenarios = build_scenarios(token, etag, args.upload_mb * 1024 * 1024)
+        concurrency = {
+            "apk": args.apk_concurrency,
+            "login": min(args.concurrency, 8),
+            "upload_apk": min(args.concurrency, 2),
+        }
+
+        results = {}
+        for name in args.only:
+            await asyncio.sleep(0.5)
+            rss.reset()
+            result = await run_load(client, scenarios[name], args.seconds, concurrency.get(name, args.concurrency))
+            result["peak_rss_mb"] = round(rss.peak / 1e6, 1)
+            results[name] = result
+            print_result(name, result)
+        return results
+
+
+# ============ RAPPORTAGE ============
+
+HEADER = f"{'scenario':18} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'MB/s':>8} {'RSS MB':>7} {'fouten':>6}"
+
+
+def print_result(name: str, r: dict):
+    def fmt(value, width):
+        return f"{value:>{width}}" if value is not None else f"{'-':>{width}}"
+
+    print(
+        f"{name:18} {fmt(r['throughput'], 9)} {fmt(r['p50_ms'], 9)} {fmt(r['p99_ms'], 9)} "
+        f"{fmt(r['max_ms'], 9)} {fmt(r['mb_per_s'], 8)} {fmt(r['peak_rss_mb'], 7)} {r['errors']:>6}"
+    )
+
+
+def compare(results: Dict[str, dict], baseline: dict, threshold: float) -> List[str]:
+    """Print de verschillen met een baseline; geef de achteruitgegane scenario's terug"""
+    regressions = []
+    print(f"\nVergelijking met baseline van {baseline['meta'].get('date')} ({baseline['meta'].get('git')})")
+    print(f"{'scenario':18} {'req/s':>26} {'p99 ms':>28} {'RSS MB':>22}")
+    for name, current in results.items():
+        before = baseline["results"].get(name)
+        if not before:
+            continue
+
+        def delta(key: str) -> Optional[float]:
+            if not before.get(key) or current.get(key) is None:
+                return None
+            return (current[key] - before[key]) / before[key]
+
+        throughput, p99, rss = delta("throughput"), delta("p99_ms"), delta("peak_rss_mb")
+        worse = (throughput is not None and throughput < -threshold) or (p99 is not None and p99 > threshold)
+        if worse:
+            regressions.append(name)
+
+        def cell(key: str, change: Optional[float], width: int) -> str:
+            text = f"{before.get(key)} -> {current.get(key)}"
+            if change is not None:
+                text += f" ({change:+.0%})"
+            return f"{text:>{width}}"
+
+        print(
+            f"{name:18} {cell('throughput', throughput, 26)} {cell('p99_ms', p99, 28)} "
+            f"{cell('peak_rss_mb', rss, 22)}{'  ACHTERUIT' if worse else ''}"
+        )
+    return regressions
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    prepare_database(args.rows, args.devices)
+
+    mock_port, portal_port = free_port(), free_port()
+    env = {
+        **os.environ,
+        "HEADWIND_BASE_URL": f"http://127.0.0.1:{mock_port}",
+        "HEADWIND_ADMIN_USER": "admin",
+        "HEADWIND_ADMIN_PASS": "admin",
+        "HEADWIND_SYNC_INTERVAL_SECONDS": str(args.sync_interval),
+        # De harness logt steeds met hetzelfde account in
+        "LOGIN_MAX_PER_IP": "1000000000",
+        "LOGIN_MAX_PER_EMAIL": "1000000000",
+    }
+    mock = start_process(
+        ["-m", "bench.mock_headwind", "--devices", str(args.devices), "--port", str(mock_port)],
+        env,
+        f"http://127.0.0.1:{mock_port}/docs",
+    )
+    portal = None
+    try:
+        portal = start_process(
+            ["-m", "uvicorn", "app.main:app", "--port", str(portal_port), "--log-level", "warning"],
+            env,
+            f"http://127.0.0.1:{portal_port}/api/health",
+        )
+        rss = RssSampler(portal.pid)
+        rss.start()
+        print(HEADER)
+        try:
+            results = asyncio.run(drive(f"http://127.0.0.1:{portal_port}", rss, args))
+        finally:
+            rss.stop()
+    finally:
+        if portal is not None:
+            stop_process(portal)
+        stop_process(mock)
+        if os.environ["DB_PATH"].startswith(_tmp):
+            shutil.rmtree(_tmp, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "date": datetime.utcnow().isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "rows": args.rows,
+            "devices": args.devices,
+            "seconds": args.seconds,
+            "concurrency": args.concurrency,
+            "apk_mb": args.apk_mb,
+            "apk_concurrency": args.apk_concurrency,
+            "upload_mb": args.upload_mb,
+        },
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"\nBaseline opgeslagen in {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nAchteruitgang (> {args.threshold:.0%}): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000, help="aantal download_logs regels")
+    parser.add_argument("--devices", type=int, default=5000, help="devices in de database en de mock Headwind")
+    parser.add_argument("--seconds", type=float, default=10, help="duur per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--apk-mb", type=int, default=50, help="grootte van de APK voor het download scenario")
+    parser.add_argument("--apk-concurrency", type=int, default=16, help="gelijktijdige APK downloads")
+    parser.add_argument("--upload-mb", type=int, default=5, help="grootte van de APK in het upload scenario")
+    parser.add_argument("--sync-interval", type=float, default=5, help="device sync interval tijdens de run (0 = uit)")
+    parser.add_argument("--only", default=",".join(SCENARIOS), help="komma-gescheiden scenario's")
+    parser.add_argument("--save", help="schrijf de resultaten als baseline JSON")
+    parser.add_argument("--compare", help="vergelijk met een baseline JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="toegestane achteruitgang (0.10 = 10%%)")
+    args = parser.parse_args()
+    args.only = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(args.only) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"onbekende scenario's: {', '.join(sorted(unknown))}")
+    main(args)
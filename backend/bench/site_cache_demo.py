@@ -0,0 +1,195 @@
+"""
+Demo/test van de site cache modus met twee lokale instanties.
+
+Start een upstream portal en een site cache (PORTAL_MODE=site_cache,
+UPSTREAM_URL=<upstream>) als echte uvicorn processen, elk met een eigen
+tijdelijke data directory, en controleert:
+
+1. N gelijktijdige downloads van een nog niet gecachte APK leveren allemaal
+   de juiste bytes, met één enkele download bij de upstream
+2. de provisioning van de site cache wijst naar de APK op de site cache
+3. herhaalde provisioning requests worden met een 304 gerevalideerd
+4. een nieuwe upload op de upstream verschijnt na het revalidatie interval
+   en wordt vooraf opgehaald
+5. met de upstream uit blijven provisioning en APK gewoon werken
+
+    cd backend && python -m bench.site_cache_demo --devices 200 --apk-mb 20
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CREDENTIALS = {"email": "demo@example.com", "password": "demo-password"}
+REVALIDATE_SECONDS = 1.0
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_portal(port: int, data_dir: str, extra_env: dict) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "DATA_DIR": data_dir,
+        "DB_PATH": os.path.join(data_dir, "portal.db"),
+        "BCRYPT_ROUNDS": "4",
+        "HEADWIND_SYNC_INTERVAL_SECONDS": "0",
+        **extra_env,
+    }
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"Portal op poort {port} gestopt")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/health", timeout=1)
+            return proc
+        except httpx.TransportError:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit(f"Portal op poort {port} niet bereikbaar")
+
+
+def stop_portal(proc: subprocess.Popen):
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+async def admin_token(client: httpx.AsyncClient) -> dict:
+    await client.post("/api/auth/register", json=CREDENTIALS)
+    response = await client.post("/api/auth/login", json=CREDENTIALS)
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def upload(client: httpx.AsyncClient, auth: dict, data: bytes) -> str:
+    files = {"file": ("vastelijn.apk", data, "application/vnd.android.package-archive")}
+    response = await client.post("/api/admin/upload-apk", headers=auth, files=files)
+    response.raise_for_status()
+    return response.json()["file_hash"]
+
+
+def check(condition: bool, message: str):
+    print(f"  {'OK  ' if condition else 'FOUT'} {message}")
+    if not condition:
+        raise SystemExit(1)
+
+
+async def download(client: httpx.AsyncClient, url: str) -> str:
+    sha = hashlib.sha256()
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+async def drive(upstream_url: str, site_url: str, upstream: subprocess.Popen, args) -> None:
+    limits = httpx.Limits(max_connections=args.devices + 8)
+    async with httpx.AsyncClient(base_url=upstream_url, timeout=120) as up, \
+            httpx.AsyncClient(base_url=site_url, timeout=120, limits=limits) as site:
+        up_auth = await admin_token(up)
+        site_auth = await admin_token(site)
+        apk = os.urandom(args.apk_mb * 1024 * 1024)
+        file_hash = await upload(up, up_auth, apk)
+        # Nep APK zonder signing certificaat: checksum handmatig zetten
+        (await up.put("/api/admin/config", headers=up_auth, json={"checksum": "ZGVtbw=="})).raise_for_status()
+
+        print(f"1. {args.devices} gelijktijdige downloads (koude cache)")
+        started = time.perf_counter()
+        url = f"/api/public/apk/{file_hash}.apk"
+        hashes: List[str] = await asyncio.gather(*[download(site, url) for _ in range(args.devices)])
+        elapsed = time.perf_counter() - started
+        check(all(h == file_hash for h in hashes), f"alle {len(hashes)} downloads hebben de juiste SHA-256")
+        status = (await site.get("/api/admin/site-cache", headers=site_auth)).json()
+        check(status["stats"].get("blob_fetch") == 1, f"één upstream download (stats: {status['stats']})")
+        print(f"  {args.devices * args.apk_mb} MB naar devices in {elapsed:.1f}s, {args.apk_mb} MB over de WAN")
+
+        print("2. provisioning via de site cache")
+        data = (await site.get("/api/public/provisioning")).json()
+        check(data["apk_url"] == f"{site_url}/api/public/apk/{file_hash}.apk", f"apk_url = {data['apk_url']}")
+        check(site_url in data["qr_json"], "QR payload wijst naar de site cache")
+
+        print("3. revalidatie met If-None-Match")
+        await asyncio.sleep(REVALIDATE_SECONDS * 1.2)
+        etag = (await site.get("/api/public/provisioning")).headers["etag"]
+        response = await site.get("/api/public/provisioning", headers={"If-None-Match": etag})
+        status = (await site.get("/api/admin/site-cache", headers=site_auth)).json()
+        check(response.status_code == 304, "device krijgt 304")
+        check(status["stats"].get("revalidated_304", 0) >= 1, "upstream antwoordde 304")
+
+        print("4. nieuwe versie op de upstream")
+        new_hash = await upload(up, up_auth, os.urandom(args.apk_mb * 1024 * 1024))
+        await asyncio.sleep(REVALIDATE_SECONDS * 1.2)
+        data = (await site.get("/api/public/provisioning")).json()
+        check(data["apk_url"].endswith(f"/{new_hash}.apk"), "provisioning wijst naar de nieuwe versie")
+        for _ in range(100):
+            status = (await site.get("/api/admin/site-cache", headers=site_auth)).json()
+            if not status["fetching"]:
+                break
+            await asyncio.sleep(0.1)
+        check(status["stats"].get("blob_fetch") == 2, "nieuwe APK vooraf opgehaald")
+
+        print("5. upstream onbereikbaar")
+        stop_portal(upstream)
+        await asyncio.sleep(REVALIDATE_SECONDS * 1.2)
+        response = await site.get("/api/public/provisioning")
+        check(response.status_code == 200, "provisioning uit de cache")
+        check(await download(site, "/api/public/apk") == new_hash, "APK uit de cache")
+
+
+def main(args):
+    root = tempfile.mkdtemp(prefix="site-cache-demo-")
+    upstream_port, site_port = free_port(), free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    site_url = f"http://127.0.0.1:{site_port}"
+    for name in ("upstream", "site"):
+        os.makedirs(os.path.join(root, name))
+    upstream = start_portal(upstream_port, os.path.join(root, "upstream"), {})
+    site = None
+    try:
+        site = start_portal(
+            site_port,
+            os.path.join(root, "site"),
+            {
+                "PORTAL_MODE": "site_cache",
+                "UPSTREAM_URL": upstream_url,
+                "SITE_CACHE_REVALIDATE_SECONDS": str(REVALIDATE_SECONDS),
+            },
+        )
+        asyncio.run(drive(upstream_url, site_url, upstream, args))
+        print("Alles OK")
+    finally:
+        if site is not None:
+            stop_portal(site)
+        stop_portal(upstream)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=200, help="gelijktijdige downloads")
+    parser.add_argument("--apk-mb", type=int, default=20)
+    args = parser.parse_args()
+    main(args)
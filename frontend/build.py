@@ -0,0 +1,109 @@
+"""
+Build van de statische frontend.
+
+- Assets (alles behalve index.html) krijgen een content hash in de naam:
+  `app.js` -> `assets/app.3f2a9c1b7e.js`. De inhoud achter zo'n URL
+  verandert nooit, dus nginx kan ze met `immutable` eeuwig laten cachen.
+- Verwijzingen in index.html worden herschreven naar de gehashte namen;
+  index.html zelf houdt zijn naam en wordt altijd gerevalideerd.
+- Van elk tekstbestand worden vooraf een .gz (gzip -9) en .br (brotli
+  q11) variant gemaakt, die nginx zonder CPU kosten serveert.
+
+Gebruik:
+
+    python build.py --src src --out dist
+
+Vereist de `brotli` package. nginx.conf zet voor .js, .css en index.html
+`Content-Encoding: br` op basis van Accept-Encoding alleen; de .br variant
+moet daarom voor die bestanden altijd bestaan, hoe klein ook.
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import re
+import shutil
+
+import brotli
+
+COMPRESSIBLE = {".html", ".js", ".css", ".svg", ".json", ".txt", ".map"}
+# Heel kleine bestanden worden niet kleiner van compressie
+MIN_COMPRESS_SIZE = 256
+# nginx serveert deze altijd als .br aan clients die brotli accepteren
+ALWAYS_BROTLI = {".html", ".js", ".css"}
+HASH_LENGTH = 10
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(name: str, data: bytes) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{content_hash(data)}{ext}"
+
+
+def precompress(path: str, data: bytes):
+    """Schrijf .gz en .br varianten naast een bestand"""
+    ext = os.path.splitext(path)[1]
+    if ext in ALWAYS_BROTLI or (ext in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE):
+        with open(path + ".br", "wb") as f:
+            f.write(brotli.compress(data, quality=11))
+    if ext not in COMPRESSIBLE or len(data) < MIN_COMPRESS_SIZE:
+        return
+    # mtime=0 zodat de build reproduceerbaar is
+    with open(path + ".gz", "wb") as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+
+
+def rewrite_references(html: str, mapping: dict) -> str:
+    """Vervang src/href naar originele assets door de gehashte namen"""
+
+    def replace(match):
+        attr, quote, url = match.group(1), match.group(2), match.group(3)
+        key = url.lstrip("/")
+        if key in mapping:
+            url = "/" + mapping[key]
+        return f"{attr}={quote}{url}{quote}"
+
+    return re.sub(r'\b(src|href)=(["\'])([^"\']+)\2', replace, html)
+
+
+def build(src: str, out: str) -> dict:
+    if os.path.isdir(out):
+        shutil.rmtree(out)
+    os.makedirs(os.path.join(out, "assets"))
+
+    mapping = {}
+    for root, _, files in os.walk(src):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, src).replace(os.sep, "/")
+            if rel == "index.html":
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            target = "assets/" + hashed_name(rel, data)
+            dest = os.path.join(out, target)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest, "wb") as f:
+                f.write(data)
+            precompress(dest, data)
+            mapping[rel] = target
+
+    with open(os.path.join(src, "index.html"), encoding="utf-8") as f:
+        html = rewrite_references(f.read(), mapping)
+    index = os.path.join(out, "index.html")
+    with open(index, "w", encoding="utf-8") as f:
+        f.write(html)
+    precompress(index, html.encode("utf-8"))
+    return mapping
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default="src")
+    parser.add_argument("--out", default="dist")
+    args = parser.parse_args()
+    for original, target in build(args.src, args.out).items():
+        print(f"{original} -> {target}")
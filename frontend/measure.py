@@ -0,0 +1,193 @@
+"""
+Meet wat de build (build.py) oplevert voor de provisioning pagina.
+
+Zonder --url wordt een verbinding gesimuleerd (standaard traag Wi-Fi) en
+worden `src/` zoals nginx het vroeger serveerde (ongecomprimeerd, zonder
+Cache-Control, dus elk bezoek revalideren) en `dist/` (brotli/gzip,
+immutable assets) naast elkaar gezet:
+
+- bytes over de lijn bij een eerste en een herhaald bezoek
+- geschatte time-to-first-render: verbinding + index.html, daarna CSS en
+  JS parallel (de pagina wordt door app.js gerenderd)
+
+Met --url wordt een draaiende deployment echt opgevraagd met
+`Accept-Encoding: br, gzip`, inclusief een herhaald bezoek dat
+Cache-Control respecteert.
+
+Gebruik:
+
+    python measure.py --kbps 1000 --rtt 150
+    python measure.py --url http://127.0.0.1:8088
+"""
+import argparse
+import os
+import re
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+# Geschatte grootte van request + response headers per request
+HEADER_BYTES = 350
+ASSET_RE = re.compile(r'\b(?:src|href)=["\']/?([^"\']+\.(?:js|css))["\']')
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def page_assets(html: str) -> List[str]:
+    return ASSET_RE.findall(html)
+
+
+def encoded_size(path: str, encoding: str) -> int:
+    """Grootte zoals nginx hem zou sturen bij deze Accept-Encoding"""
+    for suffix in ((".br",) if encoding == "br" else ()) + ((".gz",) if encoding in ("br", "gzip") else ()):
+        if os.path.exists(path + suffix):
+            return os.path.getsize(path + suffix)
+    return os.path.getsize(path)
+
+
+def resources(root: str, encoding: str, immutable: bool) -> List[Tuple[str, int, bool]]:
+    """(naam, bytes, cachebaar zonder revalidatie) voor index.html + assets"""
+    index = os.path.join(root, "index.html")
+    items = [("index.html", encoded_size(index, encoding), False)]
+    for name in page_assets(read(index).decode("utf-8")):
+        items.append((name, encoded_size(os.path.join(root, name), encoding), immutable))
+    return items
+
+
+def transfer_ms(size: int, kbps: float) -> float:
+    return (size + HEADER_BYTES) * 8 / kbps
+
+
+def simulate(items, kbps: float, rtt: float, repeat: bool) -> Tuple[int, float]:
+    """
+    Returns (bytes over de lijn, ms tot first render).
+
+    Model: 1 RTT voor de TCP verbinding, dan index.html (RTT + transfer).
+    CSS en JS worden parallel opgehaald: één RTT plus de gedeelde
+    bandbreedte. Bij een herhaald bezoek kost revalideren een RTT met
+    een 304 zonder body; immutable assets komen uit de cache.
+    """
+    html, assets = items[0], items[1:]
+    total = 0
+    elapsed = rtt
+    if repeat:
+        total += HEADER_BYTES
+        elapsed += rtt + transfer_ms(0, kbps)
+    else:
+        total += html[1] + HEADER_BYTES
+        elapsed += rtt + transfer_ms(html[1], kbps)
+
+    fetched = [size for _, size, cached in assets if not (repeat and cached)]
+    if fetched:
+        body = 0 if repeat else sum(fetched)
+        total += body + HEADER_BYTES * len(fetched)
+        elapsed += rtt + (body + HEADER_BYTES * len(fetched)) * 8 / kbps
+    return total, elapsed
+
+
+def report_simulation(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    scenarios = [
+        ("voor (src)", resources(os.path.join(here, args.src), "identity", immutable=False)),
+        ("na (dist, gzip)", resources(os.path.join(here, args.dist), "gzip", immutable=True)),
+        ("na (dist, br)", resources(os.path.join(here, args.dist), "br", immutable=True)),
+    ]
+    print(f"Gesimuleerde verbinding: {args.kbps:g} kbit/s, RTT {args.rtt:g} ms\n")
+    print(f"{'':18} {'1e bezoek':>12} {'TTFR':>9} {'herhaald':>10} {'TTFR':>9}")
+    for label, items in scenarios:
+        first_bytes, first_ms = simulate(items, args.kbps, args.rtt, repeat=False)
+        repeat_bytes, repeat_ms = simulate(items, args.kbps, args.rtt, repeat=True)
+        print(f"{label:18} {first_bytes:>10} B {first_ms:>6.0f} ms {repeat_bytes:>8} B {repeat_ms:>6.0f} ms")
+    print("\nPer bestand (bytes over de lijn, zonder headers):")
+    for label, items in scenarios:
+        print(f"  {label}: " + ", ".join(f"{name}={size}" for name, size, _ in items))
+
+
+def fetch(url: str, headers: Dict[str, str]) -> Tuple[int, int, Dict[str, str], bytes, float]:
+    """(status, bytes body over de lijn, headers, body, ms)"""
+    request = urllib.request.Request(url, headers=headers)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            body = response.read()
+            status, response_headers = response.status, dict(response.headers)
+    except urllib.error.HTTPError as exc:
+        body, status, response_headers = b"", exc.code, dict(exc.headers)
+    return status, len(body), response_headers, body, (time.perf_counter() - started) * 1000
+
+
+def decode(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "gzip":
+        import gzip
+
+        return gzip.decompress(body)
+    if encoding == "br":
+        import brotli
+
+        return brotli.decompress(body)
+    return body
+
+
+def visit(base: str, cache: Dict[str, Dict[str, str]]) -> Tuple[int, float]:
+    """Eén paginabezoek; `cache` bevat response headers van een vorig bezoek"""
+    try:
+        import brotli  # noqa: F401
+
+        accept = "br, gzip"
+    except ImportError:
+        accept = "gzip"
+
+    started = time.perf_counter()
+    total = 0
+    paths = ["/index.html"]
+    while paths:
+        path = paths.pop(0)
+        previous = cache.get(path)
+        if previous and "immutable" in previous.get("Cache-Control", ""):
+            continue
+        headers = {"Accept-Encoding": accept}
+        if previous and previous.get("ETag"):
+            headers["If-None-Match"] = previous["ETag"]
+        status, size, response_headers, body, _ = fetch(base + path, headers)
+        total += size + HEADER_BYTES
+        if status == 200:
+            cache[path] = response_headers
+            if path == "/index.html":
+                html = decode(body, response_headers.get("Content-Encoding")).decode("utf-8")
+                paths.extend("/" + name for name in page_assets(html))
+        elif status != 304:
+            raise SystemExit(f"{path}: HTTP {status}")
+    return total, (time.perf_counter() - started) * 1000
+
+
+def report_live(args):
+    base = args.url.rstrip("/")
+    cache: Dict[str, Dict[str, str]] = {}
+    first_bytes, first_ms = visit(base, cache)
+    repeat_bytes, repeat_ms = visit(base, cache)
+    print(f"{base}")
+    print(f"  1e bezoek: {first_bytes} B in {first_ms:.0f} ms")
+    print(f"  herhaald:  {repeat_bytes} B in {repeat_ms:.0f} ms")
+    for path, headers in cache.items():
+        print(
+            f"  {path}: Content-Encoding={headers.get('Content-Encoding', '-')}"
+            f" Cache-Control={headers.get('Cache-Control', '-')}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default="src")
+    parser.add_argument("--dist", default="dist")
+    parser.add_argument("--kbps", type=float, default=1000, help="bandbreedte in kbit/s")
+    parser.add_argument("--rtt", type=float, default=150, help="round trip time in ms")
+    parser.add_argument("--url", help="meet een draaiende deployment in plaats van te simuleren")
+    args = parser.parse_args()
+    if args.url:
+        report_live(args)
+    else:
+        report_simulation(args)
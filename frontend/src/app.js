@@ -6,7 +6,14 @@ function el(html) {
   return t.content.firstChild;
 }
 
+// Open SSE verbinding van het admin dashboard (gesloten bij wisselen van view)
+let adminEvents = null;
+
 function setView(node) {
+  if (adminEvents) {
+    adminEvents.close();
+    adminEvents = null;
+  }
   const root = document.getElementById("app");
   root.innerHTML = "";
   root.appendChild(node);
@@ -31,10 +38,9 @@ async function api(path, opts = {}) {
   return data;
 }
 
-// QR Code generator
-function generateQRCode(text, size = 280) {
-  const encoded = encodeURIComponent(text);
-  return `<img src="https://api.qrserver.com/v1/create-qr-code/?size=${size}x${size}&data=${encoded}" alt="QR Code" style="max-width:100%;" />`;
+// QR Code wordt server-side gerenderd (en gecached)
+function provisioningQRCode(size = 280) {
+  return `<img src="${API}/api/public/provisioning/qr.svg?size=${size}" alt="QR Code" width="${size}" height="${size}" style="max-width:100%;height:auto;" />`;
 }
 
 // ============ PUBLIEKE PAGINA (geen login nodig) ============
@@ -77,7 +83,7 @@ async function publicView() {
         </div>
       `;
     } else {
-      const qrCode = generateQRCode(data.qr_json, 300);
+      const qrCode = provisioningQRCode(300);
       const instructions = data.instructions.join("<br>");
 
       content.innerHTML = `
@@ -180,13 +186,25 @@ function loginView() {
   setView(node);
 }
 
+async function waitForJob(jobId, timeoutMs = 60000) {
+  const start = Date.now();
+  while (Date.now() - start < timeoutMs) {
+    const job = await api(`/api/admin/jobs/${jobId}`);
+    if (job.status === "done" || job.status === "failed") return job;
+    await new Promise((r) => setTimeout(r, 1000));
+  }
+  return { status: "timeout", result: null, error: "Checksum berekening duurt te lang, probeer later opnieuw." };
+}
+
 // ============ ADMIN PAGINA ============
 async function adminView() {
   let config = {};
   let stats = { total_downloads: 0, today_downloads: 0, week_downloads: 0, recent_downloads: [] };
+  let deviceCounts = { total: 0, by_status: {} };
   try {
     config = await api("/api/admin/config");
     stats = await api("/api/admin/stats");
+    deviceCounts = await api("/api/admin/devices/status-counts");
   } catch (e) {
     if (e.message.includes("401") || e.message.includes("Not authenticated")) {
       clearToken();
@@ -214,6 +232,13 @@ async function adminView() {
         <h2>APK Uploaden</h2>
         <p class="small">Upload de VasteLijn APK. De signing certificate checksum wordt automatisch berekend.</p>
         <input type="file" id="apk-file" accept=".apk" style="margin:12px 0" />
+        <label>Channel</label>
+        <select id="apk-channel" style="margin-bottom:12px">
+          <option value="stable">stable (klanten)</option>
+          <option value="beta">beta (kiosk_dev)</option>
+          <option value="dev">dev (dev_ontwikkel)</option>
+          <option value="">alleen uploaden</option>
+        </select>
         <button id="upload-btn">Upload APK</button>
         <p class="small" id="upload-status" style="margin-top:12px"></p>
       </div>
@@ -263,32 +288,39 @@ async function adminView() {
       </div>
 
       <div class="card">
-        <h2>Download Statistieken</h2>
+        <h2>Download Statistieken <span class="small" id="live-status" style="color:#888"></span></h2>
         <div class="status-grid">
           <div class="status-item">
             <span class="status-label">Totaal downloads:</span>
-            <span class="status-value ok" style="font-size:1.2em;font-weight:bold">${stats.total_downloads}</span>
+            <span class="status-value ok" id="stat-total" style="font-size:1.2em;font-weight:bold">${stats.total_downloads}</span>
           </div>
           <div class="status-item">
             <span class="status-label">Vandaag:</span>
-            <span class="status-value">${stats.today_downloads}</span>
+            <span class="status-value" id="stat-today">${stats.today_downloads}</span>
           </div>
           <div class="status-item">
             <span class="status-label">Afgelopen 7 dagen:</span>
-            <span class="status-value">${stats.week_downloads}</span>
+            <span class="status-value" id="stat-week">${stats.week_downloads}</span>
           </div>
         </div>
-        ${stats.recent_downloads.length > 0 ? `
-          <h3 style="margin-top:16px;font-size:0.95em">Recente downloads</h3>
-          <div class="recent-downloads">
-            ${stats.recent_downloads.map(d => `
-              <div class="download-entry">
-                <span class="small">${new Date(d.downloaded_at).toLocaleString('nl-NL')}</span>
-                <span class="small" style="color:#888">${d.ip_address || 'Onbekend IP'}</span>
-              </div>
-            `).join('')}
-          </div>
-        ` : '<p class="small">Nog geen downloads</p>'}
+        <h3 style="margin-top:16px;font-size:0.95em">Recente downloads</h3>
+        <div class="recent-downloads" id="recent-downloads">
+          ${stats.recent_downloads.length > 0
+            ? stats.recent_downloads.map(downloadEntry).join('')
+            : '<p class="small">Nog geen downloads</p>'}
+        </div>
+      </div>
+
+      <div class="card">
+        <h2>Devices</h2>
+        <div class="status-grid">
+          ${DEVICE_STATUSES.map(s => `
+            <div class="status-item">
+              <span class="status-label">${s.label}:</span>
+              <span class="status-value" id="devices-${s.key}">${deviceCounts.by_status[s.key] || 0}</span>
+            </div>
+          `).join('')}
+        </div>
       </div>
     </div>
   `);
@@ -314,13 +346,22 @@ async function adminView() {
     status.style.color = "#a9b8d8";
 
     try {
-      const result = await api("/api/admin/upload-apk", { method: "POST", body: formData });
+      const channel = node.querySelector("#apk-channel").value;
+      const result = await api(`/api/admin/upload-apk?channel=${encodeURIComponent(channel)}`, { method: "POST", body: formData });
       status.textContent = result.message;
       status.style.color = "#4CAF50";
 
-      // Update checksum veld als berekend
-      if (result.cert_checksum) {
-        node.querySelector("#checksum").value = result.cert_checksum;
+      // Checksum wordt op de achtergrond berekend: poll de job
+      let checksum = result.cert_checksum;
+      if (!checksum && result.job_id) {
+        const job = await waitForJob(result.job_id);
+        checksum = job.result;
+        status.textContent = checksum ? "APK geupload en checksum berekend" : (job.error || "Voer handmatig de checksum in.");
+      }
+
+      // Update checksum veld als berekend (alleen relevant voor stable)
+      if (checksum && channel === "stable") {
+        node.querySelector("#checksum").value = checksum;
       }
 
       // Refresh de pagina na 2 seconden
@@ -357,6 +398,101 @@ async function adminView() {
   };
 
   setView(node);
+  connectAdminEvents(node);
+}
+
+const DEVICE_STATUSES = [
+  { key: "pending", label: "Wacht op enrollment" },
+  { key: "enrolled", label: "Ingeschreven" },
+  { key: "online", label: "Online" },
+  { key: "offline", label: "Offline" },
+];
+
+function downloadEntry(d) {
+  return `
+    <div class="download-entry">
+      <span class="small">${new Date(d.downloaded_at).toLocaleString('nl-NL')}</span>
+      <span class="small" style="color:#888">${d.ip_address || 'Onbekend IP'}</span>
+    </div>
+  `;
+}
+
+// Live updates via Server-Sent Events: geen polling van /api/admin/stats
+function connectAdminEvents(node) {
+  if (!getToken() || !window.EventSource) return;
+  const live = node.querySelector("#live-status");
+  const bump = (id, delta) => {
+    const e = node.querySelector(id);
+    if (e) e.textContent = String(Number(e.textContent || 0) + delta);
+  };
+  let lastEventId = null;
+
+  // Het login token hoort niet in een URL (access logs): elke verbinding
+  // krijgt een kortlevend stream ticket
+  async function connect() {
+    let ticket;
+    try {
+      ticket = (await api("/api/admin/events/ticket", { method: "POST" })).ticket;
+    } catch {
+      live.textContent = "○ verbinding verbroken, opnieuw verbinden...";
+      if (node.isConnected) setTimeout(connect, 5000);
+      return;
+    }
+    if (!node.isConnected) return;
+    const resume = lastEventId ? `&last_event_id=${encodeURIComponent(lastEventId)}` : "";
+    const source = new EventSource(`${API}/api/admin/events?ticket=${encodeURIComponent(ticket)}${resume}`);
+    adminEvents = source;
+    source.onopen = () => { live.textContent = "● live"; };
+    source.onerror = () => {
+      live.textContent = "○ verbinding verbroken, opnieuw verbinden...";
+      // Met een verlopen ticket geeft de automatische reconnect 401 en stopt
+      // EventSource: dan zelf opnieuw verbinden met een nieuw ticket
+      if (source.readyState === EventSource.CLOSED && adminEvents === source) {
+        adminEvents = null;
+        setTimeout(connect, 3000);
+      }
+    };
+
+    source.addEventListener("download", (e) => {
+      lastEventId = e.lastEventId;
+      const d = JSON.parse(e.data);
+      bump("#stat-total", 1);
+      bump("#stat-today", 1);
+      bump("#stat-week", 1);
+      const list = node.querySelector("#recent-downloads");
+      if (list.querySelector("p")) list.innerHTML = "";
+      list.insertBefore(el(downloadEntry(d)), list.firstChild);
+      while (list.children.length > 10) list.removeChild(list.lastChild);
+    });
+
+    source.addEventListener("device_status", (e) => {
+      lastEventId = e.lastEventId;
+      const d = JSON.parse(e.data);
+      for (const [status, delta] of Object.entries(d.count_delta || {})) {
+        bump(`#devices-${status}`, delta);
+      }
+    });
+
+    // Events gemist (client liep achter of server herstart): één keer alles opnieuw ophalen
+    source.addEventListener("resync", async (e) => {
+      lastEventId = e.lastEventId;
+      try {
+        const stats = await api("/api/admin/stats");
+        const counts = await api("/api/admin/devices/status-counts");
+        node.querySelector("#stat-total").textContent = stats.total_downloads;
+        node.querySelector("#stat-today").textContent = stats.today_downloads;
+        node.querySelector("#stat-week").textContent = stats.week_downloads;
+        node.querySelector("#recent-downloads").innerHTML = stats.recent_downloads.length
+          ? stats.recent_downloads.map(downloadEntry).join('')
+          : '<p class="small">Nog geen downloads</p>';
+        for (const s of DEVICE_STATUSES) {
+          node.querySelector(`#devices-${s.key}`).textContent = counts.by_status[s.key] || 0;
+        }
+      } catch { /* volgende resync probeert het opnieuw */ }
+    });
+  }
+
+  connect();
 }
 
 // ============ BOOT ============